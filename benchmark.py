@@ -0,0 +1,232 @@
+"""
+COSC264 Networking assignment
+The benchmark suite for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from tcp_async import run_loopback
+from tcp_transmission import TCP
+from contextlib import redirect_stdout
+from time import perf_counter
+from receiver import Receiver
+from channel import Channel
+from sender import Sender
+from packet import Packet, Frame
+from io import BytesIO, StringIO
+from timeit import timeit
+from random import Random
+from sys import argv
+import json
+import csv
+
+
+class Benchmark(TCP):
+
+    BENCHMARK = 'benchmark'  # name of the benchmark program file
+    ROUNDS = 100000  # default number of times each per packet case is timed
+    TRANSFERS = ((65536, 0.0), (65536, 0.1), (65536, 0.3), (1048576, 0.0), (1048576, 0.1))  # default (bytes, P)
+    WINDOW = 16  # default window of the end to end transfers
+    TOLERANCE = 0.25  # default fraction a result may be worse than its baseline by
+    FIELDS = ('name', 'value', 'unit', 'better')  # columns of a result
+
+    def __init__(self, rounds=ROUNDS, seed=0):
+        super().__init__()
+        self.program = self.BENCHMARK
+        self.metrics.program = self.program  # label of the program's metrics
+        self.programs[self.BENCHMARK] = ('[--rounds=<N>] [--sizes=<bytes>,...] [--p=<P>,...] [--window=<N>] '
+                                         '[--output=<file.csv|file.json>] [--baseline=<file>] [--tolerance=<fraction>]')
+        self.rounds = rounds  # number of times each per packet case is timed
+        self.seed = seed  # seed of the channel and of the transferred data
+
+    def per_packet(self, case):
+        """
+        Times a case over the number of rounds
+        :return: average microseconds spent on one packet
+        """
+        return timeit(case, number=self.rounds) / self.rounds * 1e6
+
+    @staticmethod
+    def result(name, value, unit, better):
+        return {'name': name, 'value': value, 'unit': unit, 'better': better}
+
+    @staticmethod
+    def drop(byte_packet):
+        """
+        Decodes a byte pack the way a receiving program does, dropping it on a bad check sum
+        """
+        try:
+            Packet.un_buffer(byte_packet)
+        except ValueError:
+            pass
+
+    def codec(self):
+        """
+        Times encoding and decoding of a full data packet, an acknowledgement
+        packet, and the dropping of a data packet with a flipped bit
+        :return: list of results in packets per second
+        """
+        data_pack = Packet(Packet.MAGIC_NO, Packet.PTYPE_DATA, 0, Packet.MAX_BYTES, bytes(Packet.MAX_BYTES))
+        ack_pack = Packet(Packet.MAGIC_NO, Packet.PTYPE_ACK, 0, 0, b'')
+        data_bytes, ack_bytes = data_pack.buffer(), ack_pack.buffer()
+        corrupt_pack = Packet.un_buffer(data_bytes)[0]
+        Channel(self.seed).flip_bit(corrupt_pack)
+        corrupt_bytes = corrupt_pack.buffer(Packet.un_buffer(data_bytes)[1])  # forwarded with its old check sum
+
+        cases = [
+            ("codec.buffer_data", lambda: data_pack.buffer()),
+            ("codec.un_buffer_data", lambda: Packet.un_buffer(data_bytes)),
+            ("codec.buffer_ack", lambda: ack_pack.buffer()),
+            ("codec.un_buffer_ack", lambda: Packet.un_buffer(ack_bytes)),
+            ("codec.drop_bit_error", lambda: self.drop(corrupt_bytes))
+        ]
+        return [self.result(name, 1e6 / self.per_packet(case), 'packets/s', 'higher') for name, case in cases]
+
+    def channel(self, p=0.1):
+        """
+        Times the loss and bit error decision the channel makes for every packet
+        :return: list of results in microseconds per packet
+        """
+        channel = Channel(self.seed)
+        channel.quiet = True
+        channel.use_loss_model('bernoulli', p)
+        data_pack = Packet(Packet.MAGIC_NO, Packet.PTYPE_DATA, 0, Packet.MAX_BYTES, bytes(Packet.MAX_BYTES))
+        cost = self.per_packet(lambda: channel.is_err(data_pack, p, 0, 0, 0))
+        return [self.result("channel.is_err.p=" + str(p), cost, 'us/packet', 'lower')]
+
+    def relay(self, sizes=(Packet.MAX_BYTES, Packet.MAX_MSS)):
+        """
+        Times the channel forwarding a packet of each data size by decoding and re-encoding
+        it, and by framing it in place as the channel's reader does
+        :return: list of results in microseconds per packet
+        """
+        results = list()
+
+        for size in sizes:
+            byte_pack = Packet(Packet.MAGIC_NO, Packet.PTYPE_DATA, 0, size, bytes(size), 0, 0, 2).buffer()
+            view = memoryview(bytearray(byte_pack))
+            results += [
+                self.result("channel.relay_decode.size=" + str(size), self.per_packet(
+                    lambda: Packet.un_buffer(byte_pack)[0].buffer(0)), 'us/packet', 'lower'),
+                self.result("channel.relay_frame.size=" + str(size), self.per_packet(
+                    lambda: Frame(view[:]).buffer()), 'us/packet', 'lower')
+            ]
+        return results
+
+    def transfer(self, size, p, window=WINDOW):
+        """
+        Sends size bytes from a sender through a channel to a receiver over loopback
+        sockets, running the asyncio engines of all three programs in this process
+        :return: goodput in bytes per second
+        """
+        sender, receiver, channel = Sender(), Receiver(), Channel(self.seed)
+        channel.use_loss_model('bernoulli', p)
+        data = Random(self.seed).randbytes(size)
+        received = BytesIO()
+
+        for program in (sender, receiver, channel):
+            program.quiet = True  # per packet messages are not printed
+        with redirect_stdout(StringIO()):
+            start = perf_counter()
+            run_loopback(sender, channel, receiver, BytesIO(data), received, p, window)
+            elapsed = perf_counter() - start
+
+        if received.getvalue() != data:
+            raise RuntimeError("transfer of " + str(size) + " bytes at P " + str(p) + " was not received intact")
+        return size / elapsed
+
+    def transfers(self, cases=TRANSFERS, window=WINDOW):
+        """
+        :param cases: list of (file size, probability of packet loss) of each transfer
+        :return: list of goodput results for each case
+        """
+        return [self.result("transfer.size=" + str(size) + ".p=" + str(p) + ".window=" + str(window),
+                            self.transfer(size, p, window), 'bytes/s', 'higher')
+                for size, p in cases]
+
+    @staticmethod
+    def save(results, file_name):
+        """
+        Writes results to a JSON file, or a CSV file if the file name ends in .csv
+        """
+        with open(file_name, 'w', newline='') as file:
+            if file_name.endswith('.csv'):
+                writer = csv.DictWriter(file, Benchmark.FIELDS)
+                writer.writeheader()
+                writer.writerows(results)
+            else:
+                json.dump(results, file, indent=2)
+
+    @staticmethod
+    def load(file_name):
+        """
+        :return: list of results read from a file written by save
+        """
+        with open(file_name, newline='') as file:
+            if file_name.endswith('.csv'):
+                return [dict(row, value=float(row['value'])) for row in csv.DictReader(file)]
+            return json.load(file)
+
+    @staticmethod
+    def compare(results, baseline, tolerance=TOLERANCE):
+        """
+        Compares results to the baseline results of the same name
+        :return: list of descriptions of results worse than their baseline by more than the tolerance
+        """
+        previous, regressions = {result['name']: result for result in baseline}, list()
+
+        for result in results:
+            if result['name'] not in previous:
+                continue
+            old, new = previous[result['name']]['value'], result['value']
+            change = (new - old) / old if old else 0.0
+
+            if (change < -tolerance and result['better'] == 'higher') or \
+                    (change > tolerance and result['better'] == 'lower'):
+                regressions.append(result['name'] + " went from " + str(round(old, 3)) + " to " +
+                                   str(round(new, 3)) + " " + result['unit'] + " (" +
+                                   str(round(change * 100, 1)) + "%)")
+        return regressions
+
+    def run(self):
+        """
+        Runs the benchmark suite, saving and comparing results as set by the options
+        """
+        self.rounds = self.option('rounds', int, self.rounds)
+        cases = list(self.TRANSFERS)
+
+        if 'sizes' in self.options or 'p' in self.options:  # every size is sent at every probability given
+            sizes = [self.check_instance(size, int) for size in str(self.option('sizes', str, ','.join(
+                sorted({str(size) for size, _ in self.TRANSFERS}, key=int)))).split(',')]
+            probabilities = [self.check_instance(p, float) for p in str(self.option('p', str, ','.join(
+                sorted({str(p) for _, p in self.TRANSFERS}, key=float)))).split(',')]
+            cases = [(size, p) for size in sizes for p in probabilities]
+
+        results = self.codec() + self.channel() + self.relay() + self.transfers(cases,
+                                                                 self.option('window', int, self.WINDOW))
+        for result in results:
+            print(result['name'] + ": " + str(round(result['value'], 3)) + " " + result['unit'])
+
+        if self.option('output', str, None):
+            self.save(results, self.option('output', str, None))
+            print("Results saved to " + self.option('output', str, None))
+
+        if self.option('baseline', str, None):
+            regressions = self.compare(results, self.load(self.option('baseline', str, None)),
+                                       self.option('tolerance', float, self.TOLERANCE))
+            for regression in regressions:
+                print("Regression: " + regression)
+            print(str(len(regressions)) + " regression(s) against " + self.option('baseline', str, None))
+
+            if regressions:
+                exit(1)  # fails a check run on the benchmark
+
+
+def main(arguments):
+    benchmark = Benchmark()
+    benchmark.validate_args(arguments, 1, list())
+    benchmark.run()
+
+
+if __name__ == '__main__':
+    main(argv)
@@ -5,24 +5,38 @@ Author:
     - Adam Ross
 """
 
-from random import uniform, randint
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_ERROR, error as socket_error
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+from random import Random
 from tcp_transmission import TCP
-from packet import Packet
+from tcp_async import AsyncLink, AsyncChannel
+import loss_model
+import tracing
+from packet import Frame, FrameReader
+from link_emulator import LinkEmulator
+import link_emulator
 from select import select
-from time import time
+from time import time, monotonic
 from sys import argv
 
 
 class Channel(TCP):
 
     CHANNEL = 'channel'  # name of the channel program file
+    READER = FrameReader  # relays packets as the bytes they arrived as, without decoding them
 
     SENDER = 1
     RECEIVER = 0
 
-    def __init__(self):
+    def __init__(self, seed=None):
         super().__init__()
         self.program = self.CHANNEL
+        self.metrics.program = self.program  # label of the program's metrics
+        self.seed = seed  # seeds the channel so runs repeat the same losses and bit errors
+        self.random = Random(seed)  # chooses the bit a bit error flips
+        self.loss_model = None  # decides packet losses and bit errors
+        self.corrupted = False  # if is_err flipped a bit of the packet it last passed, for tracing its forward
+        self.emulator = None  # delays, queues and rate limits forwarded packets, None to forward them at once
 
         self.packet_info = {
             self.SENDER: ["sender", "receiver", "Data"],
@@ -33,31 +47,157 @@ class Channel(TCP):
         """
         Check for correct magic_no, packet loss, and bit errors
         """
-        u, v, max_incr = round(uniform(0, 1), 4), round(uniform(0, 1), 4), 10
+        if self.loss_model is None:
+            self.use_loss_model('bernoulli', p)
+        u, threshold, v = self.loss_model.draw()
 
         #  check if the packet is not valid and drops if so
         if not received_packet or not received_packet.is_magic():
             transmission_cnt += 1  # increment transmission count
-            print("Received packet invalid. Packet dropped.")
+            self.metrics.count('invalid_packets')
+
+            if self.tracer is not None:
+                self.tracer.record(tracing.DROPPED, 0, 0, reason=tracing.INVALID)
+
+            if not self.quiet:
+                print("Received packet invalid. Packet dropped.")
             return received_packet, loss_cnt, bit_cnt, transmission_cnt + 1, True
 
         #  check if μ value is less than the probability of a packet loss event
-        if u < p:
+        if u < threshold:
             loss_cnt += 1  # packet loss count incremented
-            print("A μ value of " + str(u) + " < " + str(p) + ", indicating #" +
-                  str(loss_cnt) +
-                  " occurrence of the probability of a packet loss event")
+            self.metrics.count('packets_lost')
+
+            if self.tracer is not None:
+                self.tracer.packet(tracing.DROPPED, received_packet, tracing.LOSS)
+
+            if not self.quiet:
+                print("A μ value of " + str(round(u, 4)) + " < " + str(threshold) + ", indicating #" +
+                      str(loss_cnt) +
+                      " occurrence of the probability of a packet loss event")
             return received_packet, loss_cnt, bit_cnt, transmission_cnt + 1, True
 
         # check if v value is less than the probability of a bit error event
-        if v < self.BIT_ERR:
+        if v < self.loss_model.bit_err:
             bit_cnt += 1  # bit error count incremented
-            print("A v value of " + str(v) + " < " + str(self.BIT_ERR) +
-                  ", indicating #" + str(bit_cnt) +
-                  " occurrence of the probability of a bit error event")
-            received_packet.data_len += randint(1, max_incr)  # increment data_len
+            self.metrics.count('bit_errors')
+
+            if not self.quiet:
+                print("A v value of " + str(round(v, 4)) + " < " + str(self.loss_model.bit_err) +
+                      ", indicating #" + str(bit_cnt) +
+                      " occurrence of the probability of a bit error event")
+            self.flip_bit(received_packet)
+            self.corrupted = True
         return received_packet, loss_cnt, bit_cnt, transmission_cnt, False
 
+    def corruption(self):
+        """
+        :return: reason the packet is_err last passed is traced with when forwarded, corrupt if it had a bit flipped
+        """
+        reason, self.corrupted = tracing.CORRUPT if self.corrupted else tracing.NONE, False
+        return reason
+
+    def init_loss(self, p):
+        """
+        Seeds the channel and selects its loss model from the --seed, --loss and --bit-err options
+        """
+        self.seed = self.option('seed', int, self.seed)
+        self.random.seed(self.seed)
+        self.BIT_ERR = self.option('bit-err', float, self.BIT_ERR)
+        self.use_loss_model(self.option('loss', str, 'bernoulli'), p)
+
+    def init_link(self):
+        """
+        Sets up the emulated link from the --link profile and the --bandwidth, --delay,
+        --jitter, --reorder, --queue and --aqm options, unless none of them are given
+        """
+        settings = {name: self.option(name, str, None) for name in link_emulator.OPTIONS if name in self.options}
+
+        if settings or 'link' in self.options:
+            try:
+                self.emulator = LinkEmulator.create(self.option('link', str, None), settings,
+                                                    None if self.seed is None else self.seed + 1)
+            except (ValueError, KeyError):
+                self.exit_program()
+
+    def admit(self, packet, transmitter, size):
+        """
+        Queues a packet of size bytes on the emulated link, declaring it dropped if the queue is full
+        :return: time the packet is delivered, None if it is dropped
+        """
+        at = self.emulator.admit(transmitter, monotonic(), size)
+
+        if at is None:
+            self.metrics.count('queue_drops')
+
+            if self.tracer is not None:
+                self.tracer.packet(tracing.DROPPED, packet, tracing.QUEUE)
+            if not self.quiet:
+                print("Link queue to the " + self.packet_info[transmitter][1] + " is full. Packet dropped.")
+        return at
+
+    def forward(self, sock, packet, check_sum, transmitter):
+        """
+        Sends a packet on to the other program, or onto the emulated link to it
+        :return: False if the emulated link dropped the packet, otherwise True
+        """
+        byte_pack, reason = packet.buffer(check_sum), self.corruption()
+
+        if self.emulator is None:
+            self.count_sent(byte_pack, packet, reason)
+            sock.sendall(byte_pack)
+            return True
+        at = self.admit(packet, transmitter, len(byte_pack))
+
+        if at is not None:  # the received bytes are reused by the next read, so a copy waits on the link
+            self.emulator.schedule(at, (sock, Frame(memoryview(bytearray(byte_pack))), reason))
+        return at is not None
+
+    def deliver(self, items):
+        """
+        Sends the packets of the emulated link that have crossed it
+        """
+        for sock, frame, reason in items:
+            byte_pack = frame.buffer()
+            self.count_sent(byte_pack, frame, reason)
+            sock.sendall(byte_pack)
+
+    def trans_finn(self, cnts, packs, file=None, rtt=None):
+        """
+        Delivers the packets still crossing the emulated link before the program completes
+        """
+        for item in () if self.emulator is None else self.emulator.drain():
+            try:
+                self.deliver([item])
+            except (socket_error, ConnectionError):
+                pass  # the program it is for has closed, and needs nothing more
+        super().trans_finn(cnts, packs, file, rtt)
+
+    def use_loss_model(self, spec, p):
+        """
+        Selects the loss model deciding packet losses and bit errors, exiting if the spec is invalid
+        """
+        try:
+            self.loss_model = loss_model.create(spec, p, self.BIT_ERR, self.seed)
+        except (ValueError, OSError):
+            self.exit_program()
+
+    def flip_bit(self, received_packet):
+        """
+        Flips one random bit of the packet data, or of its seq_no if it has no data,
+        which the packet check sum no longer matches once forwarded
+        """
+        if received_packet.data_len > 0:
+            data = received_packet.data
+
+            if not isinstance(data, memoryview) or data.readonly:
+                data = bytearray(data)  # decoded data is a read-only view, a frame's is flipped in place
+            bit = self.random.randint(0, 8 * len(data) - 1)
+            data[bit // 8] ^= 1 << bit % 8
+            received_packet.data = data
+        else:
+            received_packet.seq_no ^= 1 << self.random.randint(0, 30)
+
     def check_p_in_range(self, p):
         """
         Check if the P value is a float within the range of 0.0 and 1.0.
@@ -69,106 +209,450 @@ class Channel(TCP):
             p = self.check_instance(p, float)
 
     def print_packet_transmission_success(self, packet_data_transmitter, received_packet, is_sending=True):
+        if is_sending:
+            self.metrics.count(self.packet_info[packet_data_transmitter][2].lower() + '_packets_relayed')
+
+        if self.quiet:
+            return
         print(self.packet_info[packet_data_transmitter][2] + " packet containing " + str(received_packet.data_len) +
               " chars transmitted" + (" to " if is_sending else " from ") +
               self.packet_info[packet_data_transmitter][int(is_sending)])
 
+    def async_channel(self, p):
+        """
+        Relays packets with the asyncio engine, reacting to each packet as it arrives
+        """
+        s_link = AsyncLink(self, self.socks['csIn'], self.socks.get('csOut'), self.ports.get('sIn'), 'sender')
+        r_link = AsyncLink(self, self.socks['crIn'], self.socks.get('crOut'), self.ports.get('rIn'), 'receiver')
+        counts, p_cnt = self.run_async(AsyncChannel(self, s_link, r_link, p).run())
+        self.trans_finn(counts, p_cnt)  # close program
+
     def run(self, cs_in, cs_out, cr_in, cr_out, s_in, r_in, p):
         """
         Receive and send packets between programs using TCP connections
         """
         self.check_p_in_range(p)  # checks P float value is >= 0 and < 1
+        self.init_loss(p)  # seed and loss model of the channel
+        self.init_link()  # link the channel emulates, if any
 
         trans, cont, end, err, packet_data_transmitter, timer = False, False, False, False, None, time()
         p_cnt, r_cnt, snt, lss, bit, error_countdown = 0, 0, 0, 0, 0, 10
 
-        self.ports = {
-            'csIn': cs_in,
-            'csOut': cs_out,
-            'crIn': cr_in,
-            'crOut': cr_out,
-            'sIn': s_in,
-            'rIn': r_in
-        }  # dictionary for ports
-        self.socks = {
-            'csIn': None,
-            'csOut': None,
-            'crIn': None,
-            'crOut': None
-        }  # dictionary for sockets
+        if self.option('duplex', bool, False):  # the sender and receiver each connect once to an In port
+            self.ports = {
+                'csIn': cs_in,
+                'crIn': cr_in
+            }  # dictionary for ports
+            self.socks = {
+                'csIn': None,
+                'crIn': None
+            }  # dictionary for sockets
+        else:
+            self.ports = {
+                'csIn': cs_in,
+                'csOut': cs_out,
+                'crIn': cr_in,
+                'crOut': cr_out,
+                'sIn': s_in,
+                'rIn': r_in
+            }  # dictionary for ports
+            self.socks = {
+                'csIn': None,
+                'csOut': None,
+                'crIn': None,
+                'crOut': None
+            }  # dictionary for sockets
 
         self.port_socket_init()  # init ports, sockets
-        r_conn = [self.socks['crIn'], self.socks['crOut'], self.ports['rIn']]  # receiver connection data
-        s_conn = [self.socks['csIn'], self.socks['csOut'], self.ports['sIn']]  # sender connection data
+
+        if self.option('async', bool, False):
+            self.async_channel(p)  # asyncio engine, closes program
+        r_conn = [self.socks['crIn'], self.socks.get('crOut'), self.ports.get('rIn')]  # receiver connection data
+        s_conn = [self.socks['csIn'], self.socks.get('csOut'), self.ports.get('sIn')]  # sender connection data
         self.conns = [r_conn, s_conn]
         self.conn_init()  # init socket connections
 
+        if self.option('duplex', bool, False):  # packets are sent back on the accepted connections
+            self.socks['crOut'], self.socks['csOut'] = self.conns[self.RECEIVER], self.conns[self.SENDER]
+
         while True:
-            is_readable, _, _ = select(self.conns, [], [], 1)  # wait for input on sockets
-            received_packet = None
+            is_readable, _, _ = select(self.conns, [], [], 1 if self.emulator is None else
+                                       self.emulator.timeout(monotonic(), 1))  # wait for input or a packet due
 
-            if is_readable:  # if a packet of data is received from sender or receiver
+            if is_readable:  # if packets of data are received from sender or receiver
                 for read in is_readable:
-                    try:
-                        if read == self.conns[self.SENDER]:
-                            # receive packet from sender program
-                            received_packet, check_sum = Packet.un_buffer(self.conns[1].recv(self.BUFFER))
-                            sock = self.socks['crOut']  # set socket for sending
-                            packet_data_transmitter = self.SENDER
+                    if read == self.conns[self.SENDER]:
+                        sock = self.socks['crOut']  # set socket for sending to the receiver program
+                        packet_data_transmitter = self.SENDER
+                    else:
+                        sock = self.socks['csOut']  # set socket for sending to the sender program
+                        packet_data_transmitter = self.RECEIVER
 
-                            if len(received_packet.data) == 0:
-                                end = True  # this indicates final data pack
-                        elif read == self.conns[self.RECEIVER]:
-                            # receive packet from the receiver program
-                            received_packet, check_sum = Packet.un_buffer(self.conns[0].recv(self.BUFFER))
-                            sock = self.socks['csOut']  # set socket for sending
-                            packet_data_transmitter = self.RECEIVER
-
-                        self.print_packet_transmission_success(packet_data_transmitter, received_packet, False)
-                        trans, cont, err = True, True, False
-                        r_cnt += 1  # increment the count of packets received
+                    try:
+                        received_packets = self.read_packets(read)  # every whole packet received
                     except Exception:
                         if not trans:  # if no packets have been received at all, timer resets as no conn is initiated
                             timer = time()
                             continue
+                        elif end:  # a connection closed after the final data packet, as a session ends
+                            print("All TCP transmissions are complete")
+                            self.trans_finn([snt, r_cnt, p, lss, bit, time() - timer], p_cnt)
                         elif error_countdown > 0:
                             error_countdown -= 1
                         else:
                             self.conn_error()  # closes program when connection is lost or deadlock event
+                        received_packets = [(None, None)]  # an invalid packet in place of the failed read
+
+                    for received_packet, check_sum in received_packets:
+                        if received_packet is not None:
+                            if packet_data_transmitter == self.SENDER and len(received_packet.data) == 0:
+                                end = True  # this indicates final data pack
+
+                            self.print_packet_transmission_success(packet_data_transmitter, received_packet, False)
+                            trans, cont, err = True, True, False
+                            r_cnt += 1  # increment the count of packets received
+
+                        # if transmitting, checks for packet loss, bit error, validity
+                        if not (not cont and packet_data_transmitter == self.RECEIVER):
+                            received_packet, lss, bit, snt, err = self.is_err(received_packet, p, lss, bit, snt)
 
-                    # if transmitting, checks for packet loss, bit error, validity
-                    if not (not cont and packet_data_transmitter == self.RECEIVER):
-                        received_packet, lss, bit, snt, err = self.is_err(received_packet, p, lss, bit, snt)
+                        # if there is neither packet loss, bit error, invalidity
+                        if not err:
+                            try:
+                                # a packet the emulated link's queue drops is not counted as sent
+                                if self.forward(sock, received_packet, check_sum, packet_data_transmitter) and cont:
+                                    self.print_packet_transmission_success(packet_data_transmitter, received_packet)
+                                    snt += 1  # increment total transmissions count
 
-                    # if there is neither packet loss, bit error, invalidity
-                    if not err:
-                        try:
-                            sock.send(received_packet.buffer(check_sum))  # send packet
+                                    if packet_data_transmitter == self.RECEIVER:
+                                        p_cnt += 2  # increment data packet count
+                            except Exception:
+                                if trans and not cont:
+                                    print("All TCP transmissions are complete")
+                                    counts = [snt, r_cnt, p, lss, bit, time() - timer]
+                                    self.trans_finn(counts, p_cnt)
+                                if trans or error_countdown <= 0:  # when connection is lost or deadlock event
+                                    self.conn_error()  # closes program
+                                else:
+                                    error_countdown -= 1
 
-                            if cont:
-                                self.print_packet_transmission_success(packet_data_transmitter, received_packet)
-                                snt += 1  # increment total transmissions count
+                        if end and packet_data_transmitter == self.RECEIVER:
+                            cont = False  # set the continue variable to False if final packet
 
-                                if packet_data_transmitter == self.RECEIVER:
-                                    p_cnt += 2  # increment data packet count
-                        except Exception:
-                            if trans and not cont:
-                                print("All TCP transmissions are complete")
-                                counts = [snt, r_cnt, p, lss, bit, time() - timer]
-                                self.trans_finn(counts, p_cnt)
-                            if trans or error_countdown <= 0:  # when connection is lost or deadlock event
-                                self.conn_error()  # closes program
-                            else:
-                                error_countdown -= 1
+            if self.emulator is not None:
+                try:
+                    self.deliver(self.emulator.due(monotonic()))
+                except (socket_error, ConnectionError):
+                    if end:  # the other program closed after the final data packet
+                        print("All TCP transmissions are complete")
+                        self.trans_finn([snt, r_cnt, p, lss, bit, time() - timer], p_cnt)
+                    self.conn_error()  # closes program
+
+
+class Flow:
+
+    def __init__(self, flow_id, s_in, r_in):
+        self.flow_id = flow_id  # flow_id carried in the header of the flow's packets
+        self.ports = {
+            Channel.SENDER: r_in,
+            Channel.RECEIVER: s_in
+        }  # transmitter: In port of the program its packets are relayed to
+        self.outs = {
+            Channel.SENDER: None,
+            Channel.RECEIVER: None
+        }  # transmitter: socket connected to the program its packets are relayed to
+        self.pending = {
+            Channel.SENDER: bytearray(),
+            Channel.RECEIVER: bytearray()
+        }  # transmitter: bytes relayed that the program's socket has not yet taken
+        self.end, self.done = False, False  # if the final data packet was relayed, if the flow has closed
+        self.p_cnt, self.r_cnt, self.snt, self.lss, self.bit = 0, 0, 0, 0, 0
+
+
+class MuxChannel(Channel):
+
+    BACKLOG = 128  # connections waiting to be accepted on each In socket
+    RETRY_DELAY = 0.05  # seconds before a refused connection to a program is retried
+
+    def __init__(self):
+        super().__init__()
+        self.programs[self.CHANNEL] = ('--mux [--quiet] [--metrics=json|prom] [--seed=<n>] [--loss=<model>] '
+                                       '[--bit-err=<P>] <csIn> <crIn> <P> <flow>:<sIn>:<rIn> [<flow>:<sIn>:<rIn> ...]')
+        self.selector = DefaultSelector()  # readiness of every socket of every flow
+        self.flows = dict()  # flow_id: routing table entry and counters of a flow
+        self.conn_flows = dict()  # accepted connection: flow it has sent packets for
+        self.retries = list()  # (time, flow, transmitter) of connections to retry
+        self.p = 0.0  # probability of packet loss
+
+    def parse_routes(self, arguments):
+        """
+        Parses '<flow>:<sIn>:<rIn>' routes following the positional channel arguments
+        :return: dictionary of flow_id: (sIn, rIn)
+        """
+        routes = dict()
+        for route in arguments:
+            parts = route.split(':')
+
+            if len(parts) != 3:
+                self.exit_program()
+            flow_id, s_in, r_in = [self.check_instance(part, int) for part in parts]
+
+            if flow_id in routes:
+                self.exit_program()
+            routes[flow_id] = (s_in, r_in)
+        return routes
+
+    def run(self, cs_in, cr_in, p, routes):
+        """
+        Relays packets of many sender and receiver pairs, routing each packet by
+        its flow_id, from a single selectors event loop
+        """
+        self.check_p_in_range(p)  # checks P float value is >= 0 and < 1
+        self.init_loss(p)  # seed and loss model of the channel
+        self.p, timer = p, time()
+
+        if any(name in self.options for name in link_emulator.OPTIONS + ('link',)):
+            self.exit_program()  # flows share one channel, so it cannot emulate a link for each
+
+        self.ports = {
+            'csIn': cs_in,
+            'crIn': cr_in
+        }  # dictionary for ports
+        for flow_id, (s_in, r_in) in routes.items():
+            self.ports['sIn#' + str(flow_id)], self.ports['rIn#' + str(flow_id)] = s_in, r_in
+        self.socks = {
+            'csIn': None,
+            'crIn': None
+        }  # dictionary for sockets
+
+        self.port_socket_init()  # init ports, sockets
+        print("\nWaiting for connection...")
+
+        for port, transmitter in (('csIn', self.SENDER), ('crIn', self.RECEIVER)):
+            self.socks[port].listen(self.BACKLOG)
+            self.socks[port].setblocking(False)
+            self.selector.register(self.socks[port], EVENT_READ, (self.accept, transmitter))
+
+        for flow_id in routes:
+            flow = Flow(flow_id, self.ports['sIn#' + str(flow_id)], self.ports['rIn#' + str(flow_id)])
+            self.flows[flow_id] = flow
+
+            for transmitter in flow.outs:
+                self.connect(flow, transmitter)
+
+        last_event = time()
+        while not all(flow.done and not any(flow.pending.values()) for flow in self.flows.values()):
+            wait = min([retry[0] for retry in self.retries] + [time() + 1]) - time()
+
+            for key, _ in self.selector.select(max(0, wait)):
+                handler, transmitter = key.data
+                handler(key.fileobj, transmitter)
+                last_event = time()
+
+            for retry in [retry for retry in self.retries if retry[0] <= time()]:
+                self.retries.remove(retry)
+                self.connect(retry[1], retry[2])
+
+            if time() - last_event > self.TIME_OUT:  # remaining flows are deemed disrupted
+                for flow in self.flows.values():
+                    self.finish_flow(flow, False)
+        self.report(timer)
+
+    def connect(self, flow, transmitter):
+        """
+        Starts connecting to the program a flow's packets from transmitter are relayed to
+        """
+        if flow.done:
+            return
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.setblocking(False)
+        sock.connect_ex((self.LOOPBACK, flow.ports[transmitter]))
+        self.selector.register(sock, EVENT_WRITE, (self.connected, (flow, transmitter)))
+
+    def connected(self, sock, route):
+        """
+        Completes a connection to a program, retrying later if it was refused
+        """
+        flow, transmitter = route
+        self.selector.unregister(sock)
+
+        if flow.done or sock.getsockopt(SOL_SOCKET, SO_ERROR) != 0:
+            sock.close()
+            if not flow.done:
+                self.retries.append((time() + self.RETRY_DELAY, flow, transmitter))
+            return
+        flow.outs[transmitter] = self.no_delay(sock)  # stays non-blocking, as one slow program must not stall the rest
+        print("Out port for flow #" + str(flow.flow_id) + " " + self.packet_info[transmitter][1] + " connected...")
+
+    def accept(self, listener, transmitter):
+        """
+        Accepts a connection from a sender or receiver program of any flow
+        """
+        try:
+            connection, _ = listener.accept()
+        except BlockingIOError:
+            return
+        self.conns.append(self.no_delay(connection))
+        self.selector.register(connection, EVENT_READ, (self.relay, transmitter))
+        print("In port for " + self.packet_info[transmitter][0] + " connected...")
+
+    def relay(self, connection, transmitter):
+        """
+        Routes every packet received on a connection to its flow, injecting
+        packet loss and bit errors with the counters of the flow
+        """
+        try:
+            received_packets = self.read_packets(connection)  # every whole packet received
+        except ValueError:
+            self.print_invalid_packet(list(self.programs.keys()).index(self.packet_info[transmitter][0]))
+            return
+        except (socket_error, ConnectionError):
+            self.disconnect(connection)
+            return
+
+        for received_packet, check_sum in received_packets:
+            flow = self.flows.get(received_packet.flow_id)
+
+            if flow is None or flow.done:
+                self.metrics.count('unknown_flow_packets')
+
+                if not self.quiet:
+                    print("Received packet for unknown flow #" + str(received_packet.flow_id) + ". Packet dropped.")
+                continue
+            self.conn_flows[connection] = flow
+
+            if transmitter == self.SENDER and len(received_packet.data) == 0:
+                flow.end = True  # this indicates final data pack
+            self.print_packet_transmission_success(transmitter, received_packet, False)
+            flow.r_cnt += 1  # increment the count of packets received
+
+            received_packet, flow.lss, flow.bit, flow.snt, err = self.is_err(
+                received_packet, self.p, flow.lss, flow.bit, flow.snt)
+
+            if not err and flow.outs[transmitter] is not None:
+                try:
+                    byte_pack = received_packet.buffer(check_sum)  # original check sum
+                    self.count_sent(byte_pack, received_packet, self.corruption())
+                    self.send(flow, transmitter, byte_pack)
+                except socket_error:
+                    self.finish_flow(flow)
+                    continue
+                self.print_packet_transmission_success(transmitter, received_packet)
+                flow.snt += 1  # increment total transmissions count
+
+                if transmitter == self.RECEIVER:
+                    flow.p_cnt += 2  # increment data packet count
+
+    def send(self, flow, transmitter, byte_pack):
+        """
+        Sends a packet to the program a flow's packets from transmitter are relayed to, buffering
+        what the socket does not take at once until the selector reports it writable
+        """
+        pending = flow.pending[transmitter]
+
+        if not pending:  # otherwise the packet must wait behind those already buffered
+            try:
+                byte_pack = memoryview(byte_pack)[flow.outs[transmitter].send(byte_pack):]
+            except BlockingIOError:
+                pass
+            if not byte_pack:
+                return
+            self.selector.register(flow.outs[transmitter], EVENT_WRITE, (self.flush, (flow, transmitter)))
+        pending.extend(byte_pack)  # copied, as the packet may be a view of the receive buffer
+
+    def flush(self, sock, route):
+        """
+        Sends as much of the bytes buffered for a program as its socket takes, closing
+        the socket once they are all sent if the flow has finished
+        """
+        flow, transmitter = route
+        pending = flow.pending[transmitter]
+        try:
+            del pending[:sock.send(pending)]
+        except BlockingIOError:
+            return
+        except socket_error:
+            pending.clear()  # the program has closed, so nothing more can reach it
+            self.finish_flow(flow)
+
+        if not pending and flow.outs[transmitter] is not None:
+            self.selector.unregister(sock)
+
+            if flow.done:
+                self.close_out(flow, transmitter)
+
+    def close_out(self, flow, transmitter):
+        """
+        Closes the socket to the program a flow's packets from transmitter are relayed to
+        """
+        try:
+            self.selector.unregister(flow.outs[transmitter])
+        except KeyError:
+            pass  # it was not waiting to be written to
+        flow.outs[transmitter].close()
+        flow.outs[transmitter] = None
+        flow.pending[transmitter].clear()
+
+    def disconnect(self, connection):
+        """
+        Closes a connection a program has closed, which finishes the flow it belongs to
+        """
+        self.selector.unregister(connection)
+        connection.close()
+        flow = self.conn_flows.pop(connection, None)
+
+        if flow is not None:
+            self.finish_flow(flow)
+
+    def finish_flow(self, flow, drain=True):
+        """
+        Closes the connections to a flow's programs once either program has closed,
+        each once the bytes buffered for it are sent, unless drain is False
+        """
+        if not flow.done:
+            flow.done = True
+            print("Flow #" + str(flow.flow_id) + (" transmissions are complete" if flow.end else " has failed"))
+
+        for transmitter in flow.outs:
+            if flow.outs[transmitter] is not None and (not drain or not flow.pending[transmitter]):
+                self.close_out(flow, transmitter)
+
+    def print_packet_transmission_success(self, packet_data_transmitter, received_packet, is_sending=True):
+        if not self.quiet:
+            print("Flow #" + str(received_packet.flow_id) + ": ", end="")
+        super().print_packet_transmission_success(packet_data_transmitter, received_packet, is_sending)
+
+    def report(self, timer):
+        """
+        Prints the counts of each flow, then the totals of all flows and closes the program
+        """
+        print("All TCP transmissions are complete")
+        for flow in self.flows.values():
+            print("\nFlow #" + str(flow.flow_id) + (" completed" if flow.end else " did not complete") + ":\n - " +
+                  str(flow.snt) + " transmissions sent \n - " + str(flow.r_cnt) + " transmissions received\n - " +
+                  str(flow.lss) + " packets lost\n - " + str(flow.bit) + " bit errors")
 
-                    if end and packet_data_transmitter == self.RECEIVER:
-                        cont = False  # set the continue variable to False if final packet
+        flows = self.flows.values()
+        counts = [sum(flow.snt for flow in flows), sum(flow.r_cnt for flow in flows), self.p,
+                  sum(flow.lss for flow in flows), sum(flow.bit for flow in flows), time() - timer]
+        self.selector.close()
+        self.trans_finn(counts, sum(flow.p_cnt for flow in flows))  # close program
 
 
 def main(arguments):
-    tcp_app_channel = Channel()
-    vals = tcp_app_channel.validate_args(arguments, 8, [int] * 6 + [float])
-    tcp_app_channel.run(vals[0], vals[1], vals[2], vals[3], vals[4], vals[5], vals[6])
+    if '--mux' in arguments:
+        tcp_app_channel = MuxChannel()
+        vals = tcp_app_channel.validate_args(arguments, 5, [int, int, float])
+        routes = tcp_app_channel.parse_routes(tcp_app_channel.parse_options(arguments)[4:])
+        tcp_app_channel.run(vals[0], vals[1], vals[2], routes)
+    elif '--duplex' in arguments:
+        tcp_app_channel = Channel()
+        vals = tcp_app_channel.validate_args(arguments, 4, [int, int, float])
+        tcp_app_channel.run(vals[0], None, vals[1], None, None, None, vals[2])
+    else:
+        tcp_app_channel = Channel()
+        vals = tcp_app_channel.validate_args(arguments, 8, [int] * 6 + [float])
+        tcp_app_channel.run(vals[0], vals[1], vals[2], vals[3], vals[4], vals[5], vals[6])
 
 
 if __name__ == '__main__':
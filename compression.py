@@ -0,0 +1,115 @@
+"""
+COSC264 Networking assignment
+The payload compression of the sender and receiver for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from segment_source import SegmentSource
+from packet import Packet
+from io import RawIOBase
+import zlib
+import lzma
+
+
+class Compression:
+
+    CODECS = ('zlib', 'lzma')  # codecs a sender may offer
+    MODES = ('stream', 'segment')  # one context over the whole file, or each segment on its own
+    LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 6}]  # raw LZMA2, without a container per segment
+
+    def __init__(self, codec, mode='stream'):
+        if codec not in self.CODECS or mode not in self.MODES:
+            raise ValueError("unknown compression " + str(codec) + ":" + str(mode))
+        self.codec = codec  # name of the codec
+        self.stream = mode == 'stream'  # if the file is compressed as one stream rather than per segment
+        self.decoder = self.decompressor() if self.stream else None  # context of the received stream
+
+    @staticmethod
+    def parse(spec):
+        """
+        Parses a compression of the form '<codec>[:stream|segment]', or 'none'
+        :return: compression, None for no compression
+        """
+        if spec == 'none':
+            return None
+        codec, _, mode = spec.partition(':')
+        return Compression(codec, mode or 'stream')
+
+    def spec(self):
+        return self.codec + ":" + ('stream' if self.stream else 'segment')
+
+    def compressor(self):
+        if self.codec == 'zlib':
+            return zlib.compressobj()
+        return lzma.LZMACompressor(lzma.FORMAT_RAW, filters=self.LZMA_FILTERS)
+
+    def decompressor(self):
+        if self.codec == 'zlib':
+            return zlib.decompressobj()
+        return lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=self.LZMA_FILTERS)
+
+    def source(self, file, size=Packet.MAX_BYTES):
+        """
+        :return: segment source of a file, whose segments are the compressed stream in stream mode
+        """
+        return SegmentSource(CompressedReader(file, self) if self.stream else file, size)
+
+    def encode(self, data):
+        """
+        :return: data of a segment to send, flag of its packet's data_type
+        """
+        if len(data) == 0:
+            return data, 0  # the empty packet declaring the end of file is never compressed
+        if self.stream:
+            return data, Packet.FLAG_COMPRESSED  # segments of the source are already compressed
+
+        compressor = self.compressor()
+        return compressor.compress(data) + compressor.flush(), Packet.FLAG_COMPRESSED
+
+    def decode(self, packet):
+        """
+        Decompresses the data of a packet delivered in order, the end of file
+        packet returning what is left in the stream
+        :return: decompressed data
+        """
+        if self.stream and packet.data_len == 0:
+            return self.decoder.flush() if self.codec == 'zlib' else b''
+        if not packet.data_type & Packet.FLAG_COMPRESSED:
+            return packet.data
+        if self.stream:
+            return self.decoder.decompress(packet.data)
+        return self.decompressor().decompress(packet.data)
+
+
+class CompressedReader(RawIOBase):
+
+    CHUNK = 65536  # bytes of the file compressed at a time
+
+    def __init__(self, file, compression):
+        super().__init__()
+        self.file = file  # file the data is read from
+        self.name = getattr(file, 'name', repr(file))  # name of the file, for messages
+        self.compressor = compression.compressor()  # context over the whole file
+        self.pending = b''  # compressed bytes not yet read
+        self.eof = False  # if the whole file has been compressed
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        """
+        :return: up to size bytes of the compressed file, empty once it is all read
+        """
+        while not self.eof and (size < 0 or len(self.pending) < size):
+            chunk = self.file.read(self.CHUNK)
+            self.eof = not chunk
+            self.pending += self.compressor.compress(chunk) if chunk else self.compressor.flush()
+
+        size = len(self.pending) if size < 0 else size
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def close(self):
+        self.file.close()
+        super().close()
@@ -0,0 +1,250 @@
+"""
+COSC264 Networking assignment
+The delta sync of a file against the receiver's existing copy for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from base64 import b64encode, b64decode
+from hashlib import blake2b
+from struct import Struct
+from io import RawIOBase
+from math import isqrt
+import zlib
+import os
+
+SIGNATURE_STRUCT = Struct('>I16s')  # weak rolling checksum and strong hash of a block
+COPY_STRUCT = Struct('>II')  # index of the first block copied and the number of blocks
+LITERAL_STRUCT = Struct('>I')  # length of the literal data that follows
+COPY, LITERAL = b'C', b'L'  # op codes of the delta stream
+
+
+class Signatures:
+
+    MIN_BLOCK = 1024  # smallest block size, for small files
+    MAX_BLOCK = 65536  # largest block size, for very large files
+    PAGE = 1024  # signatures answered per request, well within the largest packet once encoded
+
+    def __init__(self, block, packed=b''):
+        self.block = block  # bytes per block, the last block may be shorter
+        self.packed = bytearray(packed)  # packed signature of each block, in order
+
+    @staticmethod
+    def block_size(size):
+        """
+        :return: block size for a file of size bytes, growing with its square root
+        as rsync does, so large files do not have too many signatures
+        """
+        return min(Signatures.MAX_BLOCK, max(Signatures.MIN_BLOCK, isqrt(size) // 64 * 64))
+
+    @staticmethod
+    def strong(data):
+        return blake2b(data, digest_size=16).digest()
+
+    @staticmethod
+    def of_file(file):
+        """
+        :return: signatures of every block of a file
+        """
+        block = Signatures.block_size(os.fstat(file.fileno()).st_size)
+        signatures = Signatures(block)
+
+        for data in iter(lambda: file.read(block), b''):
+            signatures.packed += SIGNATURE_STRUCT.pack(zlib.adler32(data), Signatures.strong(data))
+        return signatures
+
+    def __len__(self):
+        return len(self.packed) // SIGNATURE_STRUCT.size
+
+    def page(self, first):
+        """
+        :return: terms answering a request for the signatures from block first on
+        """
+        size = SIGNATURE_STRUCT.size
+        return {'first': first, 'sigs': b64encode(self.packed[first * size:(first + self.PAGE) * size]).decode()}
+
+    def add(self, terms):
+        """
+        Appends a page of signatures answered by the receiver, unless it is not the next one
+        """
+        if int(terms.get('first', -1)) == len(self):
+            self.packed += b64decode(terms.get('sigs', ''))
+
+    def table(self):
+        """
+        :return: dictionary of weak checksum: {strong hash: index of the first block with them}
+        """
+        table = dict()
+        for index, (weak, strong) in enumerate(SIGNATURE_STRUCT.iter_unpack(self.packed)):
+            table.setdefault(weak, dict()).setdefault(strong, index)
+        return table
+
+
+class DeltaEncoder(RawIOBase):
+
+    CHUNK = 65536  # bytes of the file scanned at a time, and most bytes of one literal
+    MOD = 65521  # modulus of the Adler-32 weak checksum
+
+    def __init__(self, file, signatures):
+        super().__init__()
+        self.file = file  # file the delta is computed for
+        self.name = getattr(file, 'name', repr(file))  # name of the file, for messages
+        self.block = signatures.block  # bytes per block of the receiver's copy
+        self.table = signatures.table()  # weak checksum: {strong hash: block index}
+        self.buffer = b''  # bytes of the file read but not yet encoded
+        self.scan = 0  # position in the buffer the scan continues from
+        self.pending = bytearray()  # encoded delta stream not yet read
+        self.copy = None  # [first block, count] of the run of blocks being copied
+        self.eof = False  # if the whole file has been encoded
+        self.literal_bytes = self.copied_bytes = 0  # bytes sent as they are, and referenced by block
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        """
+        :return: up to size bytes of the delta stream, empty once it is all read
+        """
+        while not self.eof and (size < 0 or len(self.pending) < size):
+            self.encode()
+
+        size = len(self.pending) if size < 0 else min(size, len(self.pending))
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    def encode(self):
+        """
+        Scans the next chunk of the file with the rolling checksum, emitting a block
+        reference wherever a block of the receiver's copy matches and literal data elsewhere
+        """
+        chunk = self.file.read(self.CHUNK)
+        buf, block, table, mod = self.buffer + chunk, self.block, self.table, self.MOD
+        pos, start, weak = self.scan, 0, None  # scan position, start of the literal, checksum of the block at pos
+        end = len(buf) - block  # last position a whole block starts at
+
+        while pos <= end:
+            if pos - start >= self.CHUNK:
+                self.emit(buf[start:pos], None, 0)  # bounds the literal held in memory
+                start = pos
+            if weak is None:
+                weak = zlib.adler32(buf[pos:pos + block])
+            strongs = table.get(weak)
+
+            if strongs is not None:
+                index = strongs.get(Signatures.strong(buf[pos:pos + block]))
+
+                if index is not None:
+                    self.emit(buf[start:pos], index, block)
+                    pos += block
+                    start, weak = pos, None
+                    continue
+
+            if pos < end:  # rolls the checksum one byte on
+                out, a = buf[pos], weak & 0xffff
+                a = (a - out + buf[pos + block]) % mod
+                weak = ((((weak >> 16) - block * out + a - 1) % mod) << 16) | a
+            pos += 1
+
+        if chunk:  # less than a block is left to scan until more of the file is read
+            self.buffer, self.scan = buf[start:], pos - start
+            return
+
+        tail = buf[pos:]  # shorter than a block, it can only match the last block of the copy
+        index = table.get(zlib.adler32(tail), dict()).get(Signatures.strong(tail)) if tail else None
+
+        if index is not None:
+            self.emit(buf[start:pos], index, len(tail))
+        else:
+            self.emit(buf[start:], None, 0)
+        self.flush_copy()
+        self.buffer, self.eof = b'', True
+
+    def emit(self, literal, index, length):
+        """
+        Adds literal data, then a reference to a block of the receiver's copy, to the
+        delta stream, extending the run of copied blocks when the block follows it
+        """
+        if literal:
+            self.flush_copy()
+            self.pending += LITERAL + LITERAL_STRUCT.pack(len(literal)) + literal
+            self.literal_bytes += len(literal)
+
+        if index is None:
+            return
+        self.copied_bytes += length
+
+        if self.copy and self.copy[0] + self.copy[1] == index:
+            self.copy[1] += 1
+        else:
+            self.flush_copy()
+            self.copy = [index, 1]
+
+    def flush_copy(self):
+        if self.copy:
+            self.pending += COPY + COPY_STRUCT.pack(*self.copy)
+            self.copy = None
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class DeltaWriter:
+
+    SUFFIX = '.basis'  # ending of the name the receiver's old copy is kept under
+
+    def __init__(self, file, basis=None, block=Signatures.MIN_BLOCK):
+        self.file = file  # file the rebuilt data is written to
+        self.name = file.name  # name of the file, for messages
+        self.basis = basis  # old copy blocks are copied from, None if there is none
+        self.block = block  # bytes per block of the old copy
+        self.active = False  # if the sender agreed to send a delta, otherwise data is written as it is
+        self.complete = False  # if the final data packet has been delivered
+        self.pending = bytearray()  # delta stream received but not yet decoded
+        self.literal = 0  # bytes of the current literal still to come
+
+    def write(self, data):
+        """
+        Decodes the delta stream, writing literal data as it arrives and the blocks it references
+        """
+        if not self.active:
+            self.file.write(data)
+            return
+
+        self.pending += data
+        pos, out = 0, list()
+
+        while pos < len(self.pending):
+            if self.literal:
+                literal = bytes(self.pending[pos:pos + self.literal])
+                out.append(literal)
+                self.literal -= len(literal)
+                pos += len(literal)
+            elif self.pending[pos:pos + 1] == LITERAL and len(self.pending) - pos > LITERAL_STRUCT.size:
+                self.literal = LITERAL_STRUCT.unpack_from(self.pending, pos + 1)[0]
+                pos += 1 + LITERAL_STRUCT.size
+            elif self.pending[pos:pos + 1] == COPY and len(self.pending) - pos > COPY_STRUCT.size:
+                index, count = COPY_STRUCT.unpack_from(self.pending, pos + 1)
+                out.append(os.pread(self.basis.fileno(), count * self.block, index * self.block))
+                pos += 1 + COPY_STRUCT.size
+            elif self.pending[pos:pos + 1] in (LITERAL, COPY):
+                break  # the rest of the op has not arrived
+            else:
+                raise ValueError("invalid delta op " + repr(bytes(self.pending[pos:pos + 1])))
+
+        del self.pending[:pos]
+        for data in out:
+            self.file.write(data)
+
+    def close(self):
+        """
+        Closes the file, removing the old copy once the new one is complete
+        """
+        self.file.close()
+
+        if self.basis is not None:
+            self.basis.close()
+
+            if self.complete:
+                os.remove(self.basis.name)
@@ -0,0 +1,107 @@
+"""
+COSC264 Networking assignment
+The checkpoint journal of the receiver for resuming transfers.
+Author:
+    - Adam Ross
+"""
+
+from hashlib import sha256
+import json
+import os
+
+
+class Journal:
+
+    INTERVAL = 1024 * 1024  # bytes written between checkpoints
+    CHUNK = 1024 * 1024  # bytes of the output read at a time when it is verified
+    SUFFIX = '.journal'  # ending of the journal's file name after the output's
+
+    def __init__(self, file, interval=INTERVAL):
+        self.fd = file.fileno()  # descriptor of the output file
+        self.name = file.name + self.SUFFIX  # file the checkpoints are saved to
+        self.interval = interval  # bytes written between checkpoints
+        self.offset = 0  # bytes of the output that are written
+        self.digest = sha256()  # digest of the bytes of the output that are written
+        self.durable = 0  # offset of the last checkpoint, whose bytes are synced to disk
+        self.started = False  # if the first data packet has been delivered
+        self.complete = False  # if the final data packet has been delivered
+        self.recover()
+
+    def recover(self):
+        """
+        Resumes from the last checkpoint if the output still holds the data it
+        names, otherwise from the start, dropping any bytes written after it
+        """
+        try:
+            with open(self.name) as journal:
+                checkpoint = json.load(journal)
+            offset, digest = int(checkpoint['offset']), checkpoint['digest']
+        except (OSError, ValueError, KeyError, TypeError):
+            offset, digest = 0, sha256().hexdigest()  # no journal, or one that cannot be read
+
+        prefix, read = sha256(), 0
+        while read < offset:
+            chunk = os.pread(self.fd, min(self.CHUNK, offset - read), read)
+            if not chunk:
+                break  # the output is shorter than its journal
+            prefix.update(chunk)
+            read += len(chunk)
+
+        if read == offset and prefix.hexdigest() == digest:
+            self.offset, self.digest, self.durable = offset, prefix, offset
+        self.position()
+
+    def start(self, offset):
+        """
+        Takes the offset of the first data packet, which is the checkpoint when
+        the sender resumes from it and otherwise the start of the file
+        """
+        self.started = True
+
+        if offset != self.offset:
+            self.offset, self.digest, self.durable = 0, sha256(), 0
+            self.position()
+
+    def position(self):
+        """
+        Discards every byte of the output after the offset, where the next data is written
+        """
+        os.ftruncate(self.fd, self.offset)
+        os.lseek(self.fd, self.offset, os.SEEK_SET)
+
+    def terms(self):
+        """
+        :return: terms answering an offer to resume, the offset and digest of the durable data
+        """
+        return {'resume': self.offset, 'digest': self.digest.hexdigest()}
+
+    def update(self, data):
+        """
+        Records data written to the output, saving a checkpoint once enough is written since the last one
+        """
+        self.digest.update(data)
+        self.offset += len(data)
+
+        if self.offset - self.durable >= self.interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Syncs the output, then replaces the journal with the offset and digest of its data
+        """
+        os.fsync(self.fd)
+        with open(self.name + '.tmp', 'w') as journal:
+            json.dump({'offset': self.offset, 'digest': self.digest.hexdigest()}, journal)
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(self.name + '.tmp', self.name)  # a crash leaves the old or the new journal, never half of one
+        self.durable = self.offset
+
+    def close(self):
+        """
+        Removes the journal of a complete transfer, or checkpoints an incomplete one so it can be resumed
+        """
+        if not self.complete:
+            self.checkpoint()
+        elif os.path.exists(self.name):
+            os.remove(self.name)
@@ -0,0 +1,168 @@
+"""
+COSC264 Networking assignment
+The link emulation of the channel for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from collections import deque
+from random import Random
+from time import monotonic, sleep
+import heapq
+
+OPTIONS = ('bandwidth', 'delay', 'jitter', 'reorder', 'queue', 'aqm')  # settings of a link, as channel options
+UNITS = {'': 1, 'k': 1e3, 'm': 1e6, 'g': 1e9}  # multiplier of each bandwidth suffix
+
+PROFILES = {
+    'lan': {'bandwidth': '1G', 'delay': '0.0002', 'queue': '1000'},
+    'dsl': {'bandwidth': '8M', 'delay': '0.015', 'jitter': '0.002', 'queue': '64'},
+    'wan': {'bandwidth': '100M', 'delay': '0.04', 'jitter': '0.004', 'queue': '256'},
+    'lte': {'bandwidth': '20M', 'delay': '0.035', 'jitter': '0.01', 'reorder': '0.01', 'queue': '128', 'aqm': 'red'},
+    'satellite': {'bandwidth': '10M', 'delay': '0.3', 'jitter': '0.005', 'queue': '512'}
+}  # name: settings of a typical link, which options given with it override
+
+
+def parse_rate(spec):
+    """
+    :return: bits per second of a bandwidth such as '512k', '10M' or '1G', None if unlimited
+    """
+    spec = str(spec).strip().lower()
+    number, unit = (spec[:-1], spec[-1]) if spec[-1:] in UNITS else (spec, '')
+    rate = float(number) * UNITS[unit]
+
+    if rate < 0:
+        raise ValueError("bandwidth must be >= 0")
+    return rate or None
+
+
+class Red:
+
+    WEIGHT = 0.002  # weight of each new queue length in the average
+
+    def __init__(self, limit, min_th=None, max_th=None, max_p=0.1):
+        self.min_th = limit / 4 if min_th is None else min_th  # average length below which no packet is dropped
+        self.max_th = limit * 3 / 4 if max_th is None else max_th  # average length above which every packet is
+        self.max_p = max_p  # probability of a drop as the average reaches max_th
+        self.avg = 0.0  # moving average of the queue length seen by arriving packets
+
+        if not 0 <= self.min_th < self.max_th or not 0 <= max_p <= 1:
+            raise ValueError("RED needs 0 <= min < max and 0 <= max_p <= 1")
+
+    def drop(self, queued, rng):
+        """
+        :return: if an arriving packet is dropped early, by the average queue length it sees
+        """
+        self.avg += self.WEIGHT * (queued - self.avg)
+
+        if self.avg < self.min_th:
+            return False
+        if self.avg >= self.max_th:
+            return True
+        return rng.random() < self.max_p * (self.avg - self.min_th) / (self.max_th - self.min_th)
+
+
+class Direction:
+
+    def __init__(self, red):
+        self.queued = deque()  # time each packet in the queue finishes being transmitted, in order
+        self.free_at = 0.0  # time the transmitter finishes the last packet queued
+        self.delivered_at = 0.0  # latest delivery, which later packets do not overtake unless reordered
+        self.red = red  # early drop of arriving packets, None for tail drop
+
+
+class LinkEmulator:
+
+    def __init__(self, bandwidth=None, delay=0.0, jitter=0.0, reorder=0.0, queue=None, aqm='tail', seed=None):
+        """
+        :param bandwidth: bits per second of each direction, None for no limit
+        :param delay: seconds each packet takes to cross the link once transmitted
+        :param jitter: standard deviation in seconds of the delay
+        :param reorder: probability of a packet skipping the delay, so it overtakes those in flight
+        :param queue: packets waiting to be transmitted in each direction before arriving ones are dropped
+        :param aqm: 'tail' to drop packets once the queue is full, or 'red[:<min>:<max>:<max_p>]'
+        """
+        if (bandwidth is not None and bandwidth <= 0) or delay < 0 or jitter < 0 or not 0 <= reorder <= 1 or \
+                (queue is not None and queue < 1):
+            raise ValueError("invalid link settings")
+        name, _, thresholds = aqm.partition(':')
+
+        if name not in ('tail', 'red') or (name == 'red' and queue is None):
+            raise ValueError("unknown queue management " + str(aqm) + ", red needs a queue")
+        self.red = None  # RED thresholds given as min, max and max_p, None for tail drop
+
+        if name == 'red':
+            self.red = [float(value) for value in thresholds.split(':')] if thresholds else list()
+            Red(queue, *self.red)  # checks the thresholds before any packet is queued
+
+        self.bandwidth = bandwidth  # bits per second, None if unlimited
+        self.delay, self.jitter, self.reorder = delay, jitter, reorder
+        self.queue = queue  # queue limit in packets, None if unbounded
+        self.random = Random(seed)  # draws jitter, reordering and early drops, apart from the loss model
+        self.directions = dict()  # transmitter: state of the direction its packets are sent in
+        self.heap = list()  # (delivery time, order, item) of every packet in flight
+        self.order = 0  # keeps packets due at the same time in the order they were sent
+
+    @staticmethod
+    def create(profile=None, settings=None, seed=None):
+        """
+        :param profile: name of a link profile the settings are applied over, or None
+        :param settings: dictionary of option name: value, as given on the command line
+        :return: link emulator with the settings
+        """
+        settings = dict(PROFILES[profile] if profile is not None else dict(), **(settings or dict()))
+        return LinkEmulator(parse_rate(settings.get('bandwidth', 0)), float(settings.get('delay', 0.0)),
+                            float(settings.get('jitter', 0.0)), float(settings.get('reorder', 0.0)),
+                            int(settings['queue']) if 'queue' in settings else None,
+                            str(settings.get('aqm', 'tail')), seed)
+
+    def admit(self, transmitter, now, size):
+        """
+        Queues a packet of size bytes behind those the transmitter has sent, unless the queue drops it
+        :return: time the packet is delivered, None if it is dropped
+        """
+        if transmitter not in self.directions:
+            self.directions[transmitter] = Direction(None if self.red is None else Red(self.queue, *self.red))
+        direction = self.directions[transmitter]
+
+        while direction.queued and direction.queued[0] <= now:
+            direction.queued.popleft()  # transmitted, so no longer in the queue
+
+        if self.queue is not None and (len(direction.queued) >= self.queue or (
+                direction.red is not None and direction.red.drop(len(direction.queued), self.random))):
+            return None
+        direction.free_at = max(now, direction.free_at) + (size * 8 / self.bandwidth if self.bandwidth else 0.0)
+        direction.queued.append(direction.free_at)
+
+        if self.reorder and self.random.random() < self.reorder:
+            return direction.free_at  # skips the delay, overtaking packets in flight
+        at = direction.free_at + max(0.0, self.delay + (self.random.gauss(0.0, self.jitter) if self.jitter else 0.0))
+        direction.delivered_at = max(at, direction.delivered_at)  # jitter alone keeps packets in order
+        return direction.delivered_at
+
+    def schedule(self, at, item):
+        heapq.heappush(self.heap, (at, self.order, item))
+        self.order += 1
+
+    def timeout(self, now, longest):
+        """
+        :return: seconds until the next packet is due, at most longest
+        """
+        return min(longest, max(0.0, self.heap[0][0] - now)) if self.heap else longest
+
+    def due(self, now):
+        """
+        :return: list of the items of the packets due by now, in order of delivery
+        """
+        items = list()
+        while self.heap and self.heap[0][0] <= now:
+            items.append(heapq.heappop(self.heap)[2])
+        return items
+
+    def drain(self):
+        """
+        Waits for each packet still in flight to be due
+        :return: generator of their items, in order of delivery
+        """
+        while self.heap:
+            sleep(max(0.0, self.heap[0][0] - monotonic()))
+            yield heapq.heappop(self.heap)[2]
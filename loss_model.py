@@ -0,0 +1,132 @@
+"""
+COSC264 Networking assignment
+The loss models of the channel for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from abc import ABC, abstractmethod
+from random import Random
+from math import log
+
+
+class LossModel(ABC):
+
+    BLOCK = 4096  # packets decided per block of draws
+
+    def __init__(self, bit_err, seed=None):
+        self.bit_err = bit_err  # probability of a bit error in a delivered packet
+        self.rng = Random(seed)  # the same seed gives the same decisions wherever the channel runs
+        self.us, self.thresholds, self.vs = list(), list(), list()  # current block of draws
+        self.pos = 0  # next draw of the block
+
+    def draw(self):
+        """
+        Takes the next decision, drawing a new block once the current one is used up
+        :return: μ value, probability of loss it is compared to, v value compared to bit_err
+        """
+        if self.pos == len(self.us):
+            self.us, self.thresholds, self.vs = self.block(self.BLOCK)
+            self.pos = 0
+        pos = self.pos
+        self.pos += 1
+        return self.us[pos], self.thresholds[pos], self.vs[pos]
+
+    def uniforms(self, size):
+        """
+        :return: list of size uniform values in [0, 1)
+        """
+        return [self.rng.random() for _ in range(size)]
+
+    @abstractmethod
+    def block(self, size):
+        """
+        :return: lists of size μ values, loss probabilities and v values
+        """
+
+
+class Bernoulli(LossModel):
+
+    def __init__(self, p, bit_err, seed=None):
+        super().__init__(bit_err, seed)
+        self.p = p  # independent probability of each packet being lost
+
+    def block(self, size):
+        return self.uniforms(size), [self.p] * size, self.uniforms(size)
+
+
+class GilbertElliott(LossModel):
+
+    def __init__(self, p_gb, p_bg, loss_good, loss_bad, bit_err, seed=None):
+        super().__init__(bit_err, seed)
+
+        if not 0 < p_gb <= 1 or not 0 < p_bg <= 1:
+            raise ValueError("state transition probabilities must be > 0 and <= 1")
+        self.p_gb = p_gb  # probability of moving from the good to the bad state after a packet
+        self.p_bg = p_bg  # probability of moving from the bad to the good state after a packet
+        self.loss = {False: loss_good, True: loss_bad}  # if in the bad state: probability of loss
+        self.bad = True  # current state, switched to good as the first run starts
+        self.remaining = 0  # packets left in the current state
+
+    def sojourn(self, p):
+        """
+        :return: geometric number of packets spent in a state left with probability p
+        """
+        return 1 if p >= 1 else 1 + int(log(1 - self.rng.random()) / log(1 - p))
+
+    def block(self, size):
+        """
+        Lays out runs of good and bad states of geometric length, then compares
+        the μ value of each packet to the loss probability of its state
+        """
+        states = list()
+        while len(states) < size:
+            if self.remaining == 0:
+                self.bad = not self.bad
+                self.remaining = self.sojourn(self.p_bg if self.bad else self.p_gb)
+            run = min(self.remaining, size - len(states))
+            states.extend([self.bad] * run)
+            self.remaining -= run
+
+        return self.uniforms(size), [self.loss[state] for state in states], self.uniforms(size)
+
+
+class TraceLoss(LossModel):
+
+    LOST, BIT_ERROR = '1', '2'  # trace entries for a lost packet and a bit error, any other is delivered
+
+    def __init__(self, file_name):
+        super().__init__(0.5)  # trace entries are replayed as draws of 0.0 or 1.0 against 0.5
+        with open(file_name) as file:
+            self.trace = file.read().split()  # one whitespace separated entry per packet
+
+        if not self.trace:
+            raise ValueError("loss trace " + str(file_name) + " is empty")
+        self.entry = 0  # next trace entry, the trace repeats once replayed
+
+    def block(self, size):
+        entries = [self.trace[(self.entry + i) % len(self.trace)] for i in range(size)]
+        self.entry = (self.entry + size) % len(self.trace)
+        return ([0.0 if entry == self.LOST else 1.0 for entry in entries], [0.5] * size,
+                [0.0 if entry == self.BIT_ERROR else 1.0 for entry in entries])
+
+
+def create(spec, p, bit_err, seed=None):
+    """
+    Creates a loss model from a specification of the form:
+     - 'bernoulli', each packet is lost with probability p
+     - 'gilbert:<p_gb>:<p_bg>[:<loss_good>]', bursts of loss with probability p in the bad state
+     - 'trace:<file>', replays the losses and bit errors of a trace file
+    :return: loss model
+    """
+    name, _, rest = spec.partition(':')
+    params = rest.split(':') if rest else list()
+
+    if name == 'bernoulli' and not params:
+        return Bernoulli(p, bit_err, seed)
+    if name == 'gilbert' and len(params) in (2, 3):
+        loss_good = float(params[2]) if len(params) == 3 else 0.0
+        return GilbertElliott(float(params[0]), float(params[1]), loss_good, p, bit_err, seed)
+    if name == 'trace' and rest:
+        return TraceLoss(rest)
+    raise ValueError("unknown loss model " + spec)
@@ -0,0 +1,105 @@
+"""
+COSC264 Networking assignment
+The metrics registry for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from collections import Counter
+from bisect import bisect_left
+from time import time
+import json
+
+
+class Histogram:
+
+    BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)  # upper bounds in seconds
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets  # upper bound of each bucket, ascending
+        self.counts = [0] * (len(buckets) + 1)  # observations per bucket, the last above every bound
+        self.sum = 0.0  # sum of all observations
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        """
+        :return: dictionary of cumulative counts per upper bound, sum and count of observations
+        """
+        cumulative, total = dict(), 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            cumulative[str(bound)] = total
+        return {'buckets': cumulative, 'sum': self.sum, 'count': total}
+
+
+class Metrics:
+
+    PREFIX = 'tcp_'  # prefix of every Prometheus metric name
+
+    def __init__(self, program=None):
+        self.program = program  # name of the program the metrics are labelled with
+        self.counters = Counter()  # name: count
+        self.histograms = dict()  # name: histogram of observed values
+        self.started = time()  # seconds since the epoch when the program started
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe(self, name, value):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].observe(value)
+
+    def snapshot(self, elapsed=None):
+        """
+        :param elapsed: seconds the program ran for, otherwise measured since it started
+        :return: dictionary of every counter, histogram and the goodput of delivered data
+        """
+        elapsed = time() - self.started if elapsed is None else elapsed
+        return {
+            'program': self.program,
+            'elapsed_seconds': elapsed,
+            'counters': dict(self.counters),
+            'goodput_bytes_per_second': self.counters['data_bytes'] / elapsed if elapsed > 0 else 0.0,
+            'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()}
+        }
+
+    def to_json(self, elapsed=None):
+        return json.dumps(self.snapshot(elapsed), indent=2)
+
+    def to_prometheus(self, elapsed=None):
+        """
+        :return: metrics in the Prometheus text exposition format
+        """
+        snapshot, label = self.snapshot(elapsed), 'program="' + str(self.program) + '"'
+        lines = list()
+
+        for name, value in sorted(snapshot['counters'].items()):
+            lines += ["# TYPE " + self.PREFIX + name + "_total counter",
+                      self.PREFIX + name + "_total{" + label + "} " + str(value)]
+
+        for name in ('elapsed_seconds', 'goodput_bytes_per_second'):
+            lines += ["# TYPE " + self.PREFIX + name + " gauge",
+                      self.PREFIX + name + "{" + label + "} " + str(snapshot[name])]
+
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            lines.append("# TYPE " + self.PREFIX + name + " histogram")
+            for bound, count in histogram['buckets'].items():
+                lines.append(self.PREFIX + name + "_bucket{" + label + ',le="' + bound + '"} ' + str(count))
+            lines += [self.PREFIX + name + "_sum{" + label + "} " + str(histogram['sum']),
+                      self.PREFIX + name + "_count{" + label + "} " + str(histogram['count'])]
+        return "\n".join(lines)
+
+    def dump(self, form, elapsed=None):
+        """
+        :param form: 'json' or 'prom'
+        :return: metrics in the requested format
+        """
+        if form == 'prom':
+            return self.to_prometheus(elapsed)
+        if form == 'json':
+            return self.to_json(elapsed)
+        raise ValueError("unknown metrics format " + str(form))
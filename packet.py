@@ -5,24 +5,43 @@ Author:
     - Adam Ross
 """
 
-from struct import pack, unpack
+from struct import Struct, error as struct_error
+from zlib import crc32
+
+CHECK_STRUCT = Struct("I")  # CRC32 check sum of everything in the packet after it
+FIELDS_STRUCT = Struct("iiiii")  # version 1: magic_no, data_type, seq_no, data_len, flow_id
+FIELDS_V2_STRUCT = Struct("<HBHQQII")  # version 2: magic_no, version, data_type, seq_no, offset, data_len, flow_id
+LEN_STRUCT = Struct("i")  # data_len on its own, for framing the byte stream
+LEN_V2_STRUCT = Struct("<I")  # data_len of a version 2 header on its own
+ECHO_STRUCT = Struct("i")  # seq_no of the data packet an acknowledgement answers
+ECHO_V2_STRUCT = Struct("<Q")  # seq_no of the data packet a version 2 acknowledgement answers
 
 
 class Packet:
 
+    __slots__ = ('magic_no', 'data_type', 'seq_no', 'data_len', 'data', 'flow_id', 'offset', 'version')
+
     MAGIC_NO = 0x497E  # The unique hexadecimal value to identify valid packets
     PTYPE_DATA = 0  # The value representing data packets
     PTYPE_ACK = 1  # The value representing acknowledgement packets
-    MAX_BYTES = 512  # Maximum chars read from a file
-    HEADER = 20  # The sum of the bytes of 4 packed integer values
-    FORMAT_STR = "iiiii"
+    PTYPE_NEGOTIATE = 2  # The value representing compression offers and their answers
+    TYPE_MASK = 0xFF  # Bits of data_type holding the packet type, the bits above it are flags
+    FLAG_COMPRESSED = 0x100  # Flag of a data packet whose data is compressed
+    MAX_BYTES = 512  # Maximum chars read from a file, unless a larger segment size is negotiated
+    MAX_MSS = 65536  # Largest segment size a version 2 header can be negotiated up to
+    HEADER = CHECK_STRUCT.size + FIELDS_STRUCT.size  # The sum of the bytes of 6 packed integer values
+    HEADER_V2 = CHECK_STRUCT.size + FIELDS_V2_STRUCT.size  # The bytes of a check sum and version 2 header
+    VERSION_OFFSET = CHECK_STRUCT.size + 2  # Byte holding the version of a version 2 header, 0 in version 1
 
-    def __init__(self, magic_no, data_type, seq_no, data_len, data):
+    def __init__(self, magic_no, data_type, seq_no, data_len, data, flow_id=0, offset=0, version=1):
         self.magic_no = magic_no  # For identifying a packets validity
         self.data_type = data_type  # Distinguishes the packet type
         self.seq_no = seq_no  # Distinguishes a packets position in a sequence
         self.data_len = data_len  # Declares the length of the data in the packet
         self.data = data  # Contains data at a length specified in dataLen
+        self.flow_id = flow_id  # Identifies the sender and receiver pair a channel relays the packet for
+        self.offset = offset  # Position of the data in the sent stream, carried by version 2 headers only
+        self.version = version  # Version of the header the packet is sent with
 
     def is_magic(self):
         """
@@ -33,40 +52,276 @@ class Packet:
 
     def sender_check(self):
         """
-        Checks if data received is not an acknowledgement packet
+        Checks if data received is not an acknowledgement packet, which may
+        echo the seq_no of the data packet that caused it
         :return: True if packet is not an acknowledgement packet, otherwise False
         """
         data_type, data_len = self.data_type, self.data_len
-        return not Packet.is_magic(self) or data_type != self.PTYPE_ACK or data_len != 0
+        return not Packet.is_magic(self) or data_type != self.PTYPE_ACK or \
+            data_len not in (0, self.echo_struct().size)
 
     def receiver_check(self):
         """
-        Checks if data received is a valid data packet
+        Checks if data received is a valid data packet, which may be flagged as compressed
         :return: True if packet is a valid data packet, otherwise False
         """
-        return Packet.is_magic(self) and self.data_type == self.PTYPE_DATA
+        return Packet.is_magic(self) and (self.data_type & self.TYPE_MASK) == self.PTYPE_DATA
+
+    def is_negotiate(self):
+        """
+        Checks if data received is a compression offer or the answer to one
+        :return: True if packet is a negotiation packet, otherwise False
+        """
+        return Packet.is_magic(self) and self.data_type == self.PTYPE_NEGOTIATE
+
+    def echo_struct(self):
+        return ECHO_V2_STRUCT if self.version == 2 else ECHO_STRUCT
+
+    def ack(self, seq_no, echo=False):
+        """
+        :param echo: if the seq_no of this packet is echoed, so the sender can time it
+        :return: acknowledgement of this packet, in its header version and flow
+        """
+        data = self.echo_struct().pack(self.seq_no) if echo else b''
+        return Packet(self.MAGIC_NO, self.PTYPE_ACK, seq_no, len(data), data, self.flow_id, 0, self.version)
 
-    def buffer(self, chk_sum):
+    def echoed(self):
+        """
+        :return: seq_no of the data packet an acknowledgement answers, None if it does not echo one
+        """
+        echo = self.echo_struct()
+        return echo.unpack(self.data)[0] if self.data_len == echo.size else None
+
+    @staticmethod
+    def negotiation(terms, flow_id=0, seq_no=0):
+        """
+        :param terms: dictionary of the terms offered or agreed, such as the compression and segment size
+        :return: negotiation packet carrying the terms as 'name=value' pairs
+        """
+        data = ';'.join(name + '=' + str(value) for name, value in terms.items()).encode()
+        return Packet(Packet.MAGIC_NO, Packet.PTYPE_NEGOTIATE, seq_no, len(data), data, flow_id)
+
+    def terms(self):
+        """
+        :return: dictionary of the terms carried by a negotiation packet
+        """
+        pairs = [term.partition('=') for term in str(self.data, 'utf-8', 'replace').split(';') if term]
+        return {name: value for name, _, value in pairs}
+
+    def buffer(self, chk_sum=None):
         """
         Turns a package of data into a byte pack for TCP transmitting
-        :param chk_sum: checksum of the packet
+        :param chk_sum: check sum to send in place of the CRC32 of the packet, for
+        forwarding a packet with the check sum it was received with
         :return: byte pack
         """
-        fmt = self.FORMAT_STR + str(self.data_len) + 's'
-        data_type, seq_no, data_len = self.data_type, self.seq_no, self.data_len
-        return pack(fmt, chk_sum, self.magic_no, data_type, seq_no, data_len, self.data)
+        data, pad = self.data, self.data_len - len(self.data)
+
+        if pad < 0:
+            data = data[:self.data_len]  # data beyond data_len is not sent
+        elif pad > 0:
+            data = bytes(data) + bytes(pad)  # pads data up to data_len with null bytes
+        if self.version == 2:
+            fields = FIELDS_V2_STRUCT.pack(self.magic_no, 2, self.data_type, self.seq_no, self.offset, self.data_len,
+                                           self.flow_id)
+        else:
+            fields = FIELDS_STRUCT.pack(self.magic_no, self.data_type, self.seq_no, self.data_len, self.flow_id)
+
+        if chk_sum is None:
+            chk_sum = crc32(data, crc32(fields))  # check sum of the header fields and data
+        return CHECK_STRUCT.pack(chk_sum) + fields + data
 
     @staticmethod
     def un_buffer(byte_packet):
         """
-        Unpacks received byte pack and converts it to a data packet
+        Unpacks received byte pack and converts it to a data packet, checking the
+        CRC32 check sum before anything else is unpacked, then the header version
         :param byte_packet: byte packet received from TCP socket
-        :return: data packet, check sum of the packet
+        :return: data packet, with data as a view of byte_packet, check sum of the packet
+        """
+        view = memoryview(byte_packet)
+        chk_sum = CHECK_STRUCT.unpack_from(view)[0]
+
+        if crc32(view[CHECK_STRUCT.size:]) != chk_sum:
+            raise ValueError("packet check sum mismatch")  # a bit error, packet dropped
+        if Packet.header_size(view) == Packet.HEADER_V2:
+            magic_no, version, data_type, seq_no, offset, data_len, flow_id = \
+                FIELDS_V2_STRUCT.unpack_from(view, CHECK_STRUCT.size)
+        else:
+            magic_no, data_type, seq_no, data_len, flow_id = FIELDS_STRUCT.unpack_from(view, CHECK_STRUCT.size)
+            offset, version = 0, 1
+        header = Packet.HEADER_V2 if version == 2 else Packet.HEADER
+        data = view[header:data_len + header]
+
+        if len(data) != data_len:
+            raise ValueError("packet data shorter than its data_len")
+        return Packet(magic_no, data_type, seq_no, data_len, data, flow_id, offset, version), chk_sum
+
+    @staticmethod
+    def header_size(stream, pos=0):
+        """
+        :return: bytes of the check sum and header of the packet at pos, by its version
         """
-        hdr = unpack(Packet.FORMAT_STR, byte_packet[:Packet.HEADER])  # Unpacks 4 header integers
-        chk_sum, magic_no, data_type, seq_no, data_len = hdr[0], hdr[1], hdr[2], hdr[3], hdr[4]
+        if len(stream) > pos + Packet.VERSION_OFFSET and stream[pos + Packet.VERSION_OFFSET] == 2:
+            return Packet.HEADER_V2
+        return Packet.HEADER
+
+
+class PacketReader:
+
+    READ_SIZE = 65536  # maximum number of bytes taken from a socket per recv
+    LEN_OFFSET = 16  # position of the data_len integer within a packet header
+    LEN_V2_OFFSET = Packet.HEADER_V2 - 8  # position of the data_len integer within a version 2 header
+    MAX_DATA = 2 * Packet.MAX_MSS  # largest data_len accepted before the stream is deemed corrupt
+
+    def __init__(self, sock):
+        self.sock = sock  # stream socket packets are received from, if read rather than fed
+        self.pending = b''  # incomplete packet left over from the previous recv
+        self.dropped = 0  # count of packets dropped for a bad check sum or length
+
+    def read(self):
+        """
+        Receives a chunk of the byte stream from the socket and decodes it
+        :return: list of (data packet, check sum) tuples, in order of arrival
+        """
+        chunk = self.sock.recv(self.READ_SIZE)
+
+        if not chunk:
+            raise ConnectionError("connection closed by peer")
+        return self.feed(chunk)
+
+    def feed(self, chunk):
+        """
+        Decodes every complete packet in a chunk of the byte stream, keeping any
+        trailing partial packet until the rest of it arrives
+        :param chunk: bytes received from the stream
+        :return: list of (data packet, check sum) tuples, in order of arrival
+        """
+        stream = self.pending + chunk if self.pending else chunk
+        view, packets, pos = memoryview(stream), list(), 0
+
+        while len(stream) - pos >= Packet.HEADER:
+            header = Packet.header_size(stream, pos)
+
+            if len(stream) - pos < header:
+                break
+            if header == Packet.HEADER_V2:
+                data_len = LEN_V2_STRUCT.unpack_from(stream, pos + self.LEN_V2_OFFSET)[0]
+            else:
+                data_len = LEN_STRUCT.unpack_from(stream, pos + self.LEN_OFFSET)[0]
+
+            if not 0 <= data_len <= self.MAX_DATA:
+                self.pending = b''  # stream cannot be re-synchronised, discard it
+                raise ValueError("invalid packet length " + str(data_len))
+            end = pos + header + data_len
+
+            if end > len(stream):
+                break
+            try:
+                packets.append(Packet.un_buffer(view[pos:end]))  # packets share the chunk, no copies
+            except (struct_error, ValueError):
+                self.dropped += 1  # drops only the invalid packet, its length keeps the stream framed
+            pos = end
+        self.pending = stream[pos:]
+        return packets
+
+
+class Frame:
+
+    __slots__ = ('view', 'magic_no', 'data_type', 'data_len', 'flow_id', 'data', 'version')
+
+    SEQ_STRUCT = Struct("i")  # seq_no of a version 1 header on its own
+    SEQ_V2_STRUCT = Struct("<Q")  # seq_no of a version 2 header on its own
+    SEQ_OFFSET = CHECK_STRUCT.size + 8  # position of the seq_no within a version 1 header
+    SEQ_V2_OFFSET = CHECK_STRUCT.size + 5  # position of the seq_no within a version 2 header
+
+    def __init__(self, view):
+        """
+        Reads the header fields of a packet in place, without checking its check sum or copying its data
+        :param view: writable view of the whole packet, from its check sum to the end of its data
+        """
+        self.view = view  # bytes the packet arrived as, forwarded as they are
+        if Packet.header_size(view) == Packet.HEADER_V2:
+            self.magic_no, self.version, self.data_type, _, _, self.data_len, self.flow_id = \
+                FIELDS_V2_STRUCT.unpack_from(view, CHECK_STRUCT.size)
+        else:
+            self.magic_no, self.data_type, _, self.data_len, self.flow_id = \
+                FIELDS_STRUCT.unpack_from(view, CHECK_STRUCT.size)
+            self.version = 1
+        self.data = view[len(view) - self.data_len:]  # writable, so a bit error is applied in place
+
+    def is_magic(self):
+        return self.magic_no == Packet.MAGIC_NO
+
+    def seq(self):
+        """
+        :return: struct and position of the seq_no in the header, by its version
+        """
+        return (self.SEQ_V2_STRUCT, self.SEQ_V2_OFFSET) if self.version == 2 else (self.SEQ_STRUCT, self.SEQ_OFFSET)
+
+    @property
+    def seq_no(self):
+        struct, offset = self.seq()
+        return struct.unpack_from(self.view, offset)[0]
+
+    @seq_no.setter
+    def seq_no(self, seq_no):
+        struct, offset = self.seq()
+        struct.pack_into(self.view, offset, seq_no)
+
+    def buffer(self, chk_sum=None):
+        """
+        :return: bytes of the packet as it arrived, with any change to its fields made
+        in place, and so still with the check sum it was received with
+        """
+        return self.view
+
+
+class FrameReader:
+
+    def __init__(self, sock):
+        self.sock = sock  # stream socket packets are received from
+        self.buffer = bytearray(Packet.HEADER_V2 + PacketReader.MAX_DATA + PacketReader.READ_SIZE)  # never resized
+        self.view = memoryview(self.buffer)  # packets are framed as views of the buffer
+        self.start = self.end = 0  # bytes received but not yet framed are buffer[start:end]
+        self.dropped = 0  # check sums are left to the receiving program, so none are dropped here
+
+    def read(self):
+        """
+        Receives a chunk of the byte stream into the buffer, after the partial packet left over
+        from the previous chunk, and frames the packets in it without decoding or copying them.
+        Every frame is a view of the buffer, which is reused by the next read
+        :return: list of (frame, None) tuples, in order of arrival
+        """
+        if self.start:
+            pending = self.end - self.start
+            self.buffer[:pending] = self.buffer[self.start:self.end]  # moves the partial packet to the front
+            self.start, self.end = 0, pending
+        received = self.sock.recv_into(self.view[self.end:self.end + PacketReader.READ_SIZE])
+
+        if not received:
+            raise ConnectionError("connection closed by peer")
+        self.end += received
+        frames, pos = list(), self.start
+
+        while self.end - pos >= Packet.HEADER:
+            header = Packet.header_size(self.buffer, pos)
+
+            if self.end - pos < header:
+                break
+            if header == Packet.HEADER_V2:
+                data_len = LEN_V2_STRUCT.unpack_from(self.buffer, pos + PacketReader.LEN_V2_OFFSET)[0]
+            else:
+                data_len = LEN_STRUCT.unpack_from(self.buffer, pos + PacketReader.LEN_OFFSET)[0]
+
+            if not 0 <= data_len <= PacketReader.MAX_DATA:
+                self.start = self.end = 0  # stream cannot be re-synchronised, discard it
+                raise ValueError("invalid packet length " + str(data_len))
+            end = pos + header + data_len
 
-        if chk_sum != (magic_no + data_type + seq_no + data_len):
-            data_len = chk_sum - (magic_no + data_type + seq_no)  # Fixes data len from bit err
-        data = unpack(str(data_len) + 's', byte_packet[Packet.HEADER:data_len + Packet.HEADER])
-        return Packet(magic_no, data_type, seq_no, data_len, data[0]), chk_sum
+            if end > self.end:
+                break
+            frames.append((Frame(self.view[pos:end]), None))
+            pos = end
+        self.start = pos
+        return frames
@@ -6,8 +6,17 @@ Author:
 """
 
 from tcp_transmission import TCP
+from socket import error as socket_error
+from tcp_async import AsyncLink, AsyncReceiver, AsyncSessionReceiver
+from write_behind import WriteBehind
+from journal import Journal
+from delta import Signatures, DeltaWriter
+from compression import Compression
 from packet import Packet
+import tracing
+from urllib.parse import unquote
 from select import select
+from os import path, makedirs, replace
 from time import time
 from sys import argv
 
@@ -15,74 +24,302 @@ from sys import argv
 class Receiver(TCP):
 
     RECEIVER = 'receiver'  # name of the receiver program file
+    LINGER = 16  # seconds a finished receiver waits for a resend, twice the sender's longest time out
 
     def __init__(self):
         super().__init__()
         self.program = self.RECEIVER
+        self.metrics.program = self.program  # label of the program's metrics
+        self.compression = None  # compression agreed with the sender
+        self.directory = None  # directory the files of a session are written to
+        self.fsync = 'none'  # when received data is synced to disk
+        self.manifest = list()  # (name, size) of each file of a session, in order
+        self.journal = None  # checkpoint journal of the output, None unless the transfer can resume
+        self.delta = None  # writer rebuilding the output from a delta, None unless one can be received
+        self.signatures = None  # block signatures of the old copy of the output, None if there is none
 
     def run(self, r_in, r_out, cr_in, file_name):
         """
         Transmit packets to/from the channel program using TCP connection
         """
-        file = self.open_file(file_name)  # open a file for writing received data to
+        window = self.option('window', int, 1)  # max number of packets buffered out of order
+        self.fsync = self.option('fsync', str, 'none')  # when received data is synced to disk
+
+        try:
+            WriteBehind.policy(self.fsync)  # checks the policy before the file is opened
+        except ValueError:
+            self.exit_program()
+
+        if window < 1 or (self.option('resume', bool, False) and self.option('delta', bool, False)):
+            self.exit_program()
+
+        if self.option('session', bool, False):  # the output is the directory of every file the session sends
+            self.directory, file = file_name, None
+            makedirs(self.directory, exist_ok=True)
+        elif self.option('resume', bool, False):  # the output is kept, from its last checkpoint
+            output = open(file_name, 'r+b' if path.exists(file_name) else 'w+b')
+            self.journal = Journal(output)
+            file = WriteBehind(output, self.fsync, journal=self.journal)
+
+            if self.journal.offset:
+                print("Resuming " + str(file_name) + " at byte " + str(self.journal.offset))
+        elif self.option('delta', bool, False):  # the old output is kept as the basis of a delta
+            file = self.delta = self.delta_writer(file_name)
+        else:
+            file = WriteBehind(self.open_file(file_name), self.fsync)  # data is written by a background thread
 
         expected, s_cnt, r_cnt, p_cnt, fails = 0, 0, 0, 1, 0
 
-        self.ports = {
-            'rIn': r_in,
-            'rOut': r_out,
-            'crIn': cr_in
-        }  # dictionary for ports
-        self.socks = {
-            'rIn': None,
-            'rOut': None
-        }  # dictionary for the sockets
+        if self.option('duplex', bool, False):  # one connection to the channel carries both ways
+            self.ports = {'crIn': cr_in}  # dictionary for ports
+            self.socks = {'rOut': None}  # dictionary for the sockets
+        else:
+            self.ports = {
+                'rIn': r_in,
+                'rOut': r_out,
+                'crIn': cr_in
+            }  # dictionary for ports
+            self.socks = {
+                'rIn': None,
+                'rOut': None
+            }  # dictionary for the sockets
 
         self.port_socket_init()  # init ports, sockets
-        self.conns = [[self.socks['rIn'], self.socks['rOut'], self.ports['crIn']]]  # connection data
+
+        if self.directory is not None:
+            self.session_receiver(window)  # asyncio engine, closes program
+
+        if self.option('async', bool, False):
+            self.async_receiver(file, window)  # asyncio engine, closes program
+
+        self.conns = [[self.socks.get('rIn'), self.socks['rOut'], self.ports['crIn']]]  # connection data
         timer = self.conn_init()  # init socket connections
 
+        if window > 1:
+            self.window_receiver(file, window, timer)  # pipelined transfer, closes program
+
         while True:
             is_readable, _, _ = select(self.conns, [], [], 1)  # wait for input on socket
 
-            if is_readable:  # if a packet of data is received from channel
-                received_packet, fails, error = self.receive_packet(fails, 1, file)
-                if error:
-                    continue
-                r_cnt += 1  # increment received packet count
+            if is_readable:  # if packets of data are received from channel
+                received_packets, fails, _ = self.receive_packets(fails, 1, file)
 
-                check_sum = Packet.MAGIC_NO + Packet.PTYPE_ACK + received_packet.seq_no  # packet validation
+                for received_packet in received_packets:
+                    r_cnt += 1  # increment received packet count
 
-                if received_packet.receiver_check():  # send acknowledgement packet
-                    if received_packet.seq_no != expected:  # resend last acknowledgement pack
-                        out_pack = Packet(Packet.MAGIC_NO, Packet.PTYPE_ACK, received_packet.seq_no, 0, b'')
-
-                        self.send_packet('rOut', out_pack, check_sum, file)
+                    if received_packet.is_negotiate():  # answer an offer of compression or segment size
+                        self.send_packet('rOut', self.negotiated(received_packet), file)
                         s_cnt += 1  # increment sent packet count
-                    else:  # send new acknowledgement packet, write/print data
-                        p_cnt = self.print_data(received_packet.data, p_cnt, len(received_packet.data))
-                        out_pack = Packet(Packet.MAGIC_NO, Packet.PTYPE_ACK, received_packet.seq_no, 0, b'')
+                    elif received_packet.receiver_check():  # send acknowledgement packet
+                        if received_packet.seq_no != expected:  # resend last acknowledgement pack
+                            self.send_packet('rOut', received_packet.ack(received_packet.seq_no), file)
+                            s_cnt += 1  # increment sent packet count
+                        else:  # send new acknowledgement packet, write/print data
+                            p_cnt = self.print_data(received_packet.data, p_cnt, len(received_packet.data))
+                            out_pack = received_packet.ack(received_packet.seq_no)
+                            self.send_packet('rOut', out_pack, file)
+                            expected = 1 - expected  # toggle expected between 1 and 0
+                            s_cnt += 1  # increment sent packet count
+
+                            file.write(self.decode(received_packet))  # write received data to file
+
+                            if received_packet.data_len == 0:
+                                # terminate program, closes sockets and connections
+                                self.trans_finn(self.linger(out_pack, [s_cnt, r_cnt]), p_cnt, file)
+                    else:
+                        self.print_invalid_packet(list(self.programs.keys()).index(self.program) + 1)
+
+            if (time() - timer) > self.TIME_OUT and r_cnt == 0:  # connection time-out
+                self.conn_error(file)  # close program
+
+    def async_receiver(self, file, window):
+        """
+        Receives data with the asyncio engine, acknowledging packets as they arrive
+        """
+        link = AsyncLink(self, self.socks.get('rIn'), self.socks['rOut'], self.ports['crIn'], 'channel')
+        cnts, p_cnt = self.run_async(AsyncReceiver(self, link, file, window).run(), file)
+        self.trans_finn(cnts, p_cnt, file)  # close program
+
+    def session_receiver(self, window):
+        """
+        Receives the files of a session with the asyncio engine, over one connection to the channel
+        """
+        link = AsyncLink(self, self.socks.get('rIn'), self.socks['rOut'], self.ports['crIn'], 'channel')
+        cnts, p_cnt = self.run_async(AsyncSessionReceiver(self, link, window).run())
+        print(str(len(self.manifest)) + " file(s) received in " + str(self.directory))
+        self.trans_finn(cnts, p_cnt)  # close program
+
+    def session_file(self, entry):
+        """
+        Opens the file of a manifest entry in the session's directory, restarting
+        the decompression of the stream for it
+        :return: file the data of the entry is written to
+        """
+        terms = entry.terms()
+        name = path.basename(unquote(terms['file'])) or "file_" + str(entry.seq_no)  # never outside the directory
+        self.manifest.append((name, int(terms.get('size', 0))))
+
+        if self.compression:
+            self.compression = Compression.parse(self.compression.spec())
+        return WriteBehind(open(path.join(self.directory, name), 'wb'), self.fsync)
+
+    def session_file_done(self, file):
+        """
+        Closes the file of the last manifest entry once its final data packet is written
+        """
+        name, size = self.manifest[-1]
+        self.close_file(file)
+        received = path.getsize(file.name)
+
+        print(name + " received, " + str(received) + " bytes" +
+              ("" if received == size else " of the " + str(size) + " in the manifest"))
+
+    def delta_writer(self, file_name):
+        """
+        Keeps the old output as the basis of a delta, unless the basis of an
+        unfinished transfer is still there, and computes its block signatures
+        :return: writer of the output, which rebuilds it from the delta the sender agrees to
+        """
+        basis_name = file_name + DeltaWriter.SUFFIX
 
-                        self.send_packet('rOut', out_pack, check_sum, file)
-                        expected = 1 - expected  # toggle expected between 1 and 0
+        if path.exists(file_name) and not path.exists(basis_name):
+            replace(file_name, basis_name)
+        basis = open(basis_name, 'rb') if path.exists(basis_name) else None
+
+        if basis is not None:
+            self.signatures = Signatures.of_file(basis)
+            print("Signatures of " + str(len(self.signatures)) + " blocks of " + basis_name + " computed")
+        return DeltaWriter(WriteBehind(open(file_name, 'wb'), self.fsync), basis,
+                           self.signatures.block if self.signatures else Signatures.MIN_BLOCK)
+
+    def negotiated(self, offer):
+        """
+        Accepts the compression a sender offers if it is known, keeping it when the
+        offer is resent, a version 2 header with a segment size of at most MAX_MSS,
+        the checkpoint of the journal when the sender offers to resume, and a delta
+        when it has an old copy of the file. Requests for the signatures of the old
+        copy are answered with a page of them
+        :return: answer to the offer, with the terms accepted
+        """
+        terms, answer = offer.terms(), dict()
+
+        if terms.get('signatures', '').isdigit() and self.signatures is not None:
+            return Packet.negotiation(self.signatures.page(int(terms['signatures'])), offer.flow_id, offer.seq_no)
+        spec = terms.get('compress', 'none')
+
+        if self.compression is None or self.compression.spec() != spec:
+            try:
+                self.compression = Compression.parse(spec)
+            except ValueError:
+                self.compression = None  # data is sent as it is
+
+        if self.compression:
+            answer['compress'] = self.compression.spec()
+        if terms.get('version') == '2' and terms.get('mss', '').isdigit():
+            answer['version'], answer['mss'] = 2, max(1, min(int(terms['mss']), Packet.MAX_MSS))
+        if 'resume' in terms and self.journal is not None:
+            answer.update(self.journal.terms())  # offset and digest of the data already durable
+        if 'delta' in terms and self.signatures is not None:
+            answer['delta'], answer['blocks'] = self.signatures.block, len(self.signatures)
+            self.delta.active = True  # data is the delta against the old copy
+        return Packet.negotiation(answer, offer.flow_id, offer.seq_no)
+
+    def decode(self, packet):
+        """
+        :return: data of a packet delivered in order, decompressed if it is compressed
+        """
+        if self.journal is not None:
+            if not self.journal.started:
+                self.journal.start(packet.offset)  # the sender resumes at the checkpoint or starts over
+            self.journal.complete = packet.data_len == 0
+        if self.delta is not None:
+            self.delta.complete = packet.data_len == 0
+        return self.compression.decode(packet) if self.compression else packet.data
+
+    def window_receiver(self, file, window, timer):
+        """
+        Receives pipelined packets, buffering those that arrive out of order and
+        cumulatively acknowledging the next expected seq_no for each packet
+        """
+        expected, s_cnt, r_cnt, p_cnt, fails, finished = 0, 0, 0, 1, 0, False
+        out_of_order = dict()  # seq_no: packet received ahead of the expected seq_no
+
+        while True:
+            is_readable, _, _ = select(self.conns, [], [], 1)  # wait for input on socket
+
+            if is_readable:  # if packets of data are received from channel
+                received_packets, fails, _ = self.receive_packets(fails, 1, file)
+
+                for received_packet in received_packets:
+                    r_cnt += 1  # increment received packet count
+
+                    if received_packet.is_negotiate():  # answer an offer of compression or segment size
+                        self.send_packet('rOut', self.negotiated(received_packet), file)
                         s_cnt += 1  # increment sent packet count
+                        continue
+
+                    if not received_packet.receiver_check():
+                        self.print_invalid_packet(list(self.programs.keys()).index(self.program) + 1)
+                        continue
 
-                        if received_packet.data_len > 0:
-                            file.write(received_packet.data)  # write received data to file
-                        else:
-                            # terminate program, closes sockets and connections
-                            self.trans_finn([s_cnt, r_cnt], p_cnt, file)
-                else:
-                    self.print_invalid_packet(list(self.programs.keys()).index(self.program) + 1)
+                    if expected < received_packet.seq_no < expected + window:
+                        out_of_order[received_packet.seq_no] = received_packet  # hold until the gap is filled
+                    elif received_packet.seq_no == expected:
+                        out_of_order[expected] = received_packet
+
+                        while expected in out_of_order:  # deliver every packet now in sequence
+                            in_order = out_of_order.pop(expected)
+                            p_cnt = self.print_data(in_order.data, p_cnt, len(in_order.data))
+                            expected += 1
+                            file.write(self.decode(in_order))  # write received data to file
+                            finished = in_order.data_len == 0
+
+                    out_pack = received_packet.ack(expected, echo=True)  # the echo lets the sender time this packet
+                    self.send_packet('rOut', out_pack, file)
+                    s_cnt += 1  # increment sent packet count
+
+                    if finished:
+                        # terminate program, closes sockets and connections
+                        self.trans_finn(self.linger(out_pack, [s_cnt, r_cnt]), p_cnt, file)
 
             if (time() - timer) > self.TIME_OUT and r_cnt == 0:  # connection time-out
                 self.conn_error(file)  # close program
 
+    def linger(self, ack, cnts):
+        """
+        Sends the acknowledgement of the final data packet again for each data packet
+        resent, as the sender resends until it gets one, until the channel closes once
+        the sender has finished, or nothing arrives for LINGER seconds
+        :return: counts of packets sent and received, including those while lingering
+        """
+        s_cnt, r_cnt = cnts
+
+        while select(self.conns, [], [], self.LINGER)[0]:
+            try:
+                received_packets = [packet for packet, _ in self.read_packets(self.conns[0])]
+
+                for received_packet in received_packets:
+                    r_cnt += 1  # increment received packet count
+
+                    if received_packet.receiver_check():  # a resent data packet
+                        byte_pack = ack.buffer()
+                        self.count_sent(byte_pack, ack, tracing.RETRANSMIT)
+                        self.socks['rOut'].sendall(byte_pack)
+                        s_cnt += 1  # increment sent packet count
+            except (socket_error, ConnectionError, ValueError):
+                break  # the channel has closed
+        return [s_cnt, r_cnt]
+
 
 def main(arguments):
     tcp_app_receiver = Receiver()
-    vals = tcp_app_receiver.validate_args(arguments, 5, [int] * 3 + [str])
-    tcp_app_receiver.run(vals[0], vals[1], vals[2], vals[3])
+
+    if '--duplex' in arguments:
+        vals = tcp_app_receiver.validate_args(arguments, 3, [int, str])
+        tcp_app_receiver.run(None, None, vals[0], vals[1])
+    else:
+        vals = tcp_app_receiver.validate_args(arguments, 5, [int] * 3 + [str])
+        tcp_app_receiver.run(vals[0], vals[1], vals[2], vals[3])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,66 @@
+"""
+COSC264 Networking assignment
+The round trip time estimator for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+
+class RttEstimator:
+
+    ALPHA = 0.125  # gain applied to each new round trip time sample
+    BETA = 0.25  # gain applied to each new round trip time deviation
+    K = 4  # number of deviations added to the smoothed round trip time
+    INITIAL_RTO = 1.0  # retransmission time out in seconds before any sample is taken
+    MIN_RTO = 0.01  # lower bound of the retransmission time out in seconds
+    MAX_RTO = 8.0  # upper bound of the retransmission time out in seconds
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics  # registry the round trip time samples are observed in, if any
+        self.srtt = None  # smoothed round trip time in seconds
+        self.rttvar = None  # round trip time variation in seconds
+        self.rto = self.INITIAL_RTO  # current retransmission time out in seconds
+        self.samples = 0  # number of round trip times measured
+
+    def sample(self, rtt):
+        """
+        Updates the smoothed round trip time and its variation from a measured
+        round trip time (Jacobson/Karels), and resets any timer back off.
+        Callers apply Karn's rule by only sampling packets that were sent once
+        :param rtt: seconds between sending a packet and receiving its acknowledgement
+        """
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.samples += 1
+        self.reset_back_off()
+
+        if self.metrics is not None:
+            self.metrics.observe('rtt_seconds', rtt)
+
+    def reset_back_off(self):
+        """
+        Recomputes the retransmission time out from the current estimates, clearing
+        any back off, once an acknowledgement shows new data is getting through
+        """
+        if self.srtt is None:
+            self.rto = self.INITIAL_RTO  # nothing measured yet, as before the first time out
+        else:
+            self.rto = min(self.MAX_RTO, max(self.MIN_RTO, self.srtt + self.K * self.rttvar))
+
+    def back_off(self):
+        """
+        Doubles the retransmission time out after a time out has expired
+        """
+        self.rto = min(self.MAX_RTO, self.rto * 2)
+
+    def report(self):
+        """
+        Describes the current smoothed round trip time and retransmission time out
+        :return: report string for the transmission summary
+        """
+        srtt = "n/a" if self.srtt is None else str(round(self.srtt * 1000, 3)) + " ms"
+        return ("\n - smoothed round trip time of " + srtt + " over " + str(self.samples) + " samples" +
+                "\n - retransmission time out of " + str(round(self.rto * 1000, 3)) + " ms")
@@ -0,0 +1,262 @@
+"""
+COSC264 Networking assignment
+The headless runner of parallel transfer experiments for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, STDOUT, DEVNULL, TimeoutExpired
+from tempfile import TemporaryDirectory
+from tcp_transmission import TCP
+from socket import socket, AF_INET, SOCK_STREAM
+from threading import Lock
+from time import perf_counter
+from random import Random
+from sys import argv, executable
+import filecmp
+import json
+import csv
+import os
+
+
+class Runner(TCP):
+
+    RUNNER = 'runner'  # name of the runner program file
+    PROGRAMS = ('channel', 'receiver', 'sender')  # programs started for each run, in order
+    SIZES = (65536, 1048576)  # default file sizes in bytes of the experiments
+    PROBABILITIES = (0.0, 0.1, 0.2, 0.3)  # default packet loss probabilities of the experiments
+    SEEDS = (0, 1, 2)  # default channel seeds of the experiments
+    RUN_TIME_OUT = 300  # default seconds a run may take before its programs are killed
+    OWN_OPTIONS = ('sizes', 'p', 'seeds', 'jobs', 'timeout', 'output', 'runs')  # options not passed to the programs
+    RUN_FIELDS = ('size', 'p', 'seed', 'seconds', 'throughput', 'goodput', 'packets_sent', 'bytes_sent', 'intact')
+    CURVE_FIELDS = ('size', 'p', 'runs', 'intact', 'seconds', 'throughput', 'goodput')
+
+    def __init__(self):
+        super().__init__()
+        self.program = self.RUNNER
+        self.metrics.program = self.program  # label of the program's metrics
+        self.programs[self.RUNNER] = ('[--sizes=<bytes>,...] [--p=<P>,...] [--seeds=<n>,...] [--jobs=<N>] '
+                                      '[--timeout=<seconds>] [--output=<file.csv>] [--runs=<file.csv>] '
+                                      '[<channel, receiver and sender options> ...]')
+        self.directory = os.path.dirname(os.path.abspath(__file__))  # directory the programs are run from
+        self.lock = Lock()  # guards the ports handed out to runs started at the same time
+        self.used = set()  # ports handed out to runs of this runner, never handed out again
+
+    def free_ports(self, count):
+        """
+        Binds sockets to port 0 so the OS assigns free ephemeral ports, holding them all until
+        count distinct ports are found, then closes them for the programs to bind instead
+        :return: list of count ports, none of them handed out to another run of this runner
+        """
+        ports, socks = list(), list()
+
+        with self.lock:
+            try:
+                while len(ports) < count:
+                    sock = socket(AF_INET, SOCK_STREAM)
+                    socks.append(sock)
+                    sock.bind((self.LOOPBACK, 0))
+                    port = sock.getsockname()[1]
+
+                    if self.MIN_RANGE <= port <= self.MAX_RANGE and port not in self.used:
+                        ports.append(port)
+                        self.used.add(port)
+            finally:
+                for sock in socks:
+                    sock.close()
+        return ports
+
+    def commands(self, file_name, output_name, p, options=()):
+        """
+        :return: dictionary of program: command line running it, on free ports laid out as tcp_transmission does
+        """
+        options = list(options)
+
+        if '--duplex' in options:  # each program connects once to the channel
+            port = [str(i) for i in self.free_ports(2)]
+            arguments = {
+                'channel': [port[0], port[1], str(p)],
+                'receiver': [port[1], output_name],
+                'sender': [port[0], file_name]
+            }
+        else:
+            port = [str(i) for i in self.free_ports(8)]
+            arguments = {
+                'channel': port[:6] + [str(p)],
+                'receiver': [port[5], port[6], port[2], output_name],
+                'sender': [port[4], port[7], port[0], file_name]
+            }
+        return {program: [executable, os.path.join(self.directory, program + '.py')] + options + arguments[program]
+                for program in self.PROGRAMS}
+
+    def launch(self, file_name, output_name, p, options=(), timeout=RUN_TIME_OUT, directory=None):
+        """
+        Starts the channel, receiver and sender as subprocesses, capturing their output,
+        and waits for all three to exit, killing them once the time out has passed
+        :return: seconds until the sender exited, dictionary of program: output
+        """
+        commands = self.commands(file_name, output_name, p, options)
+        started, seconds = perf_counter(), None
+        processes = {program: Popen(command, stdin=DEVNULL, stdout=PIPE, stderr=STDOUT, cwd=directory, text=True)
+                     for program, command in commands.items()}
+        outputs = dict()
+
+        try:
+            for program in reversed(self.PROGRAMS):  # the sender finishes first
+                try:
+                    outputs[program] = processes[program].communicate(
+                        timeout=max(0.0, timeout - (perf_counter() - started)))[0]
+                except TimeoutExpired:
+                    processes[program].kill()
+                    outputs[program] = processes[program].communicate()[0] + "\nKilled after " + \
+                        str(timeout) + " seconds"
+                seconds = perf_counter() - started if seconds is None else seconds
+        finally:
+            for process in processes.values():
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+        return seconds, outputs
+
+    @staticmethod
+    def sender_metrics(output):
+        """
+        :return: counters of the metrics a sender run with --metrics=json printed, empty if there are none
+        """
+        try:
+            return json.JSONDecoder().raw_decode(output, output.index('{'))[0].get('counters', dict())
+        except (ValueError, AttributeError):
+            return dict()
+
+    def experiment(self, size, p, seed, options=(), timeout=RUN_TIME_OUT):
+        """
+        Sends a file of size random bytes through a channel seeded with seed, in a directory of its own
+        :return: dictionary of the run's results, and of program: output
+        """
+        with TemporaryDirectory(prefix='tcp_run_') as directory:
+            file_name, output_name = 'input.bin', 'received_input.bin'
+
+            with open(os.path.join(directory, file_name), 'wb') as file:
+                file.write(Random(seed).randbytes(size))
+            seconds, outputs = self.launch(file_name, output_name, p, list(options) + [
+                '--quiet', '--seed=' + str(seed), '--metrics=json'], timeout, directory)
+
+            output_path = os.path.join(directory, output_name)
+            intact = os.path.exists(output_path) and filecmp.cmp(os.path.join(directory, file_name),
+                                                                 output_path, shallow=False)
+        counters = self.sender_metrics(outputs['sender'])  # empty if the sender exited on a failed connection
+        bytes_sent = counters.get('bytes_sent')
+        throughput = bytes_sent / seconds if bytes_sent is not None and seconds else None  # None, not 0, if unmeasured
+
+        return {
+            'size': size,
+            'p': p,
+            'seed': seed,
+            'seconds': seconds,
+            'throughput': throughput,  # bytes on the wire, retransmissions included
+            'goodput': size / seconds if intact and seconds else 0.0,  # bytes of the file delivered intact
+            'packets_sent': counters.get('packets_sent'),
+            'bytes_sent': bytes_sent,
+            'intact': intact
+        }, outputs
+
+    def sweep(self, sizes, probabilities, seeds, options=(), jobs=None, timeout=RUN_TIME_OUT):
+        """
+        Runs an experiment for every file size, probability of packet loss and seed,
+        as many at a time as there are jobs, printing each as it completes
+        :return: list of the results of every run, in grid order
+        """
+        grid = [(size, p, seed) for size in sizes for p in probabilities for seed in seeds]
+
+        with ThreadPoolExecutor(jobs or os.cpu_count() or 1) as executor:  # each run's work is in its subprocesses
+            runs = [executor.submit(self.experiment, size, p, seed, options, timeout) for size, p, seed in grid]
+            results = list()
+
+            for run in runs:
+                result, outputs = run.result()
+                results.append(result)
+                print("Size " + str(result['size']) + ", P " + str(result['p']) + ", seed " +
+                      str(result['seed']) + ": " + str(round(result['seconds'], 3)) + " seconds, " +
+                      str(round(result['goodput'])) + " bytes/s goodput" +
+                      ("" if result['intact'] else ", received data differs"))
+
+                if not result['intact']:
+                    for program in self.PROGRAMS:
+                        print(" - " + program + ": " + " | ".join(outputs[program].strip().splitlines()[-3:]))
+        return results
+
+    @staticmethod
+    def curves(results):
+        """
+        :return: list of the mean seconds, throughput and goodput of the runs of each file size and probability,
+        the throughput of only the runs it was measured for, None if there are none
+        """
+        groups = dict()
+        for result in results:
+            groups.setdefault((result['size'], result['p']), list()).append(result)
+
+        def mean(values):
+            values = [value for value in values if value is not None]
+            return sum(values) / len(values) if values else None
+
+        return [{
+            'size': size,
+            'p': p,
+            'runs': len(runs),
+            'intact': sum(run['intact'] for run in runs),
+            'seconds': sum(run['seconds'] for run in runs) / len(runs),
+            'throughput': mean(run['throughput'] for run in runs),
+            'goodput': sum(run['goodput'] for run in runs) / len(runs)
+        } for (size, p), runs in sorted(groups.items())]
+
+    @staticmethod
+    def save(rows, file_name, fields):
+        with open(file_name, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def run(self, options):
+        """
+        Runs the grid of experiments set by the options and saves the curves of throughput and goodput against P
+        """
+        sizes = [self.check_instance(size, int) for size in str(self.option('sizes', str, ','.join(
+            str(size) for size in self.SIZES))).split(',')]
+        probabilities = [self.check_instance(p, float) for p in str(self.option('p', str, ','.join(
+            str(p) for p in self.PROBABILITIES))).split(',')]
+        seeds = [self.check_instance(seed, int) for seed in str(self.option('seeds', str, ','.join(
+            str(seed) for seed in self.SEEDS))).split(',')]
+        jobs, timeout = self.option('jobs', int, None), self.option('timeout', float, self.RUN_TIME_OUT)
+
+        if any(size < 0 for size in sizes) or any(not 0.0 <= p < 1.0 for p in probabilities) or \
+                (jobs is not None and jobs < 1) or timeout <= 0:
+            self.exit_program()
+
+        results = self.sweep(sizes, probabilities, seeds, options, jobs, timeout)
+        curves = self.curves(results)
+        print("\n" + str(sum(result['intact'] for result in results)) + " of " + str(len(results)) +
+              " runs received intact")
+
+        for curve in curves:
+            print("Size " + str(curve['size']) + ", P " + str(curve['p']) + ": " +
+                  ("no" if curve['throughput'] is None else str(round(curve['throughput']))) + " bytes/s throughput, " +
+                  str(round(curve['goodput'])) + " bytes/s goodput")
+
+        self.save(curves, self.option('output', str, 'sweep.csv'), self.CURVE_FIELDS)
+        print("Curves saved to " + self.option('output', str, 'sweep.csv'))
+
+        if self.option('runs', str, None):
+            self.save(results, self.option('runs', str, None), self.RUN_FIELDS)
+            print("Runs saved to " + self.option('runs', str, None))
+
+
+def main(arguments):
+    runner = Runner()
+    runner.validate_args(arguments, 1, list())
+    runner.run([argument for argument in arguments[1:] if argument.startswith('--') and
+                argument[2:].partition('=')[0] not in Runner.OWN_OPTIONS])
+
+
+if __name__ == '__main__':
+    main(argv)
@@ -0,0 +1,90 @@
+"""
+COSC264 Networking assignment
+The segment source of the sender for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from packet import Packet
+import mmap
+
+
+class SegmentSource:
+
+    READ_AHEAD = 128  # segments read at a time from inputs that cannot be memory mapped
+
+    def __init__(self, file, size=Packet.MAX_BYTES):
+        self.file = file  # file data is read from
+        self.name = getattr(file, 'name', repr(file))  # name of the file, for messages
+        self.size = size  # bytes of data per segment
+        self.position = 0  # index of the next segment read in sequence
+        self.map = self.view = None  # memory map of the whole file, and a view of it from the file's position
+        self.segments = list()  # segments read ahead from an input that is not mapped
+        self.first = 0  # index of the first segment kept in segments
+        self.pending = b''  # bytes read ahead that do not yet fill a segment
+        self.eof = False  # if the whole input has been read ahead
+
+        try:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            start = file.tell()  # segments start where the file is positioned, such as when resuming
+        except (OSError, ValueError):
+            return  # pipes, in memory files and empty files are read ahead instead
+
+        if hasattr(self.map, 'madvise'):
+            self.map.madvise(mmap.MADV_SEQUENTIAL)  # the kernel reads ahead of the segments sent
+        self.view = memoryview(self.map)[start:]
+
+    def segment(self, index):
+        """
+        :return: view of the data of a segment by its index, empty beyond the end of the file
+        """
+        if self.view is not None:
+            return self.view[index * self.size:(index + 1) * self.size]
+
+        while index >= self.first + len(self.segments) and not self.eof:
+            self.read_ahead()
+
+        if index < self.first:
+            raise IndexError("segment " + str(index) + " has been released")
+        return self.segments[index - self.first] if index < self.first + len(self.segments) else b''
+
+    def read(self):
+        """
+        :return: view of the data of the next segment in sequence, releasing the ones before it
+        """
+        self.release(self.position)
+        data = self.segment(self.position)
+        self.position += 1
+        return data
+
+    def read_ahead(self):
+        """
+        Reads the next block of segments from an input that is not mapped
+        """
+        chunk = self.file.read(self.size * self.READ_AHEAD)
+        self.eof = not chunk
+        block = memoryview(self.pending + chunk if self.pending else chunk)
+        whole = len(block) if self.eof else len(block) - len(block) % self.size  # pipes may return short reads
+
+        self.segments.extend(block[i:i + self.size] for i in range(0, whole, self.size))
+        self.pending = bytes(block[whole:])
+
+    def release(self, index):
+        """
+        Discards the read ahead segments before index, once they can no longer be resent
+        """
+        released = min(index - self.first, len(self.segments))
+
+        if released > 0:
+            del self.segments[:released]
+            self.first += released
+
+    def close(self):
+        self.file.close()
+
+        if self.map is not None:
+            self.view.release()
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # packets still hold views of the map, it is unmapped once they are freed
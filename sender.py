@@ -7,7 +7,14 @@ Authors:
 """
 
 from tcp_transmission import TCP
+from tcp_async import AsyncLink, AsyncSender
+from rtt import RttEstimator
+from segment_source import SegmentSource
+from compression import Compression
+from delta import Signatures, DeltaEncoder
 from packet import Packet
+import tracing
+from hashlib import sha256
 from select import select
 from time import time
 from sys import argv
@@ -20,56 +27,107 @@ class Sender(TCP):
     def __init__(self):
         super().__init__()
         self.program = self.SENDER
+        self.metrics.program = self.program  # label of the program's metrics
+        self.rtt = RttEstimator(self.metrics)  # adaptive retransmission time out
+        self.flow = 0  # flow_id of every data packet sent
+        self.compression = None  # compression offered to, then agreed with, the receiver
+        self.mss = Packet.MAX_BYTES  # bytes of data per segment offered to, then agreed with, the receiver
+        self.version = 1  # header version of data packets, 2 when a segment size is negotiated
+        self.resume = False  # if resuming from the receiver's checkpoint is offered
+        self.checkpoint = None  # (offset, digest) of the data the receiver already holds
+        self.skipped = 0  # bytes at the start of the file the receiver already holds, which are not sent
+        self.delta = False  # if a delta against the receiver's copy of the file is offered
+        self.signatures = None  # block signatures of the receiver's copy, once it agrees to a delta
+        self.blocks = 0  # number of blocks the receiver has signatures for
+        self.agreed = False  # if the receiver has answered the offer
 
     def sender(self, s_in, s_out, cs_in, file_name):
         """
         Sends data to other programs by the implementation of TCP connections
         """
         file = self.open_file(file_name)  # opens the file for reading data from
+        window = self.option('window', int, 1)  # max number of unacknowledged packets in flight
+        self.flow = self.option('flow', int, 0)  # flow_id of every data packet, for a multiplexed channel
+
+        self.mss = self.option('mss', int, Packet.MAX_BYTES)  # segment size to offer the receiver
+        self.resume = self.option('resume', bool, False)  # skip the data the receiver already holds
+        self.delta = self.option('delta', bool, False)  # send only what differs from the receiver's copy
+        self.version = 2 if 'mss' in self.options or self.resume else 1  # wide headers carry the offset
+
+        try:
+            self.compression = Compression.parse(self.option('compress', str, 'none'))
+        except ValueError:
+            self.exit_program()
+
+        if window < 1 or not 0 < self.mss <= Packet.MAX_MSS or (self.resume and self.delta):
+            self.exit_program()
 
         exit_flag, nxt, p_cnt, r_cnt, s_cnt, fails = False, 0, 1, 0, 0, 0
 
-        self.ports = {
-            'sIn': s_in,
-            'sOut': s_out,
-            'csIn': cs_in
-        }  # dictionary for ports
-        self.socks = {
-            'sIn': None,
-            'sOut': None
-        }  # dictionary for sockets
+        if self.option('duplex', bool, False):  # one connection to the channel carries both ways
+            self.ports = {'csIn': cs_in}  # dictionary for ports
+            self.socks = {'sOut': None}  # dictionary for sockets
+        else:
+            self.ports = {
+                'sIn': s_in,
+                'sOut': s_out,
+                'csIn': cs_in
+            }  # dictionary for ports
+            self.socks = {
+                'sIn': None,
+                'sOut': None
+            }  # dictionary for sockets
 
         self.port_socket_init()  # init ports, sockets
-        self.conns = [[self.socks['sIn'], self.socks['sOut'], self.ports['csIn']]]  # connection data
+
+        if self.option('async', bool, False):
+            self.async_sender(file, window)  # asyncio engine, closes program
+
+        self.conns = [[self.socks.get('sIn'), self.socks['sOut'], self.ports['csIn']]]  # connection data
         timer = self.conn_init()  # init socket connections
 
+        while self.offer():
+            self.negotiate(file)  # terms the receiver accepts, then the signatures of its copy
+        file = self.source(file)
+
+        if window > 1:
+            self.window_sender(file, window, timer)  # pipelined transfer, closes program
+
         while not exit_flag:
-            packet_count = 0  # initialize a count of data sending attempts to zero
-            data = file.read(Packet.MAX_BYTES)  # read at most 512 characters from a file
+            packet_count, number = 0, file.position  # count of data sending attempts, packet number
+            data = file.read()  # view of at most one segment of the file
+            data_pack = self.data_packet(nxt, number, data)
+            data = data_pack.data  # data as sent, compressed if agreed with the receiver
 
-            if len(data) == 0:  # create empty data packet to declare end of file
-                data_pack = Packet(Packet.MAGIC_NO, Packet.PTYPE_DATA, nxt, 0, b'')
+            if len(data) == 0:  # empty data packet declares end of file
                 exit_flag = True  # exit_flag is set to True to exit from while loop
-            else:
-                data_pack = Packet(Packet.MAGIC_NO, Packet.PTYPE_DATA, nxt, len(data), data)
-            check_sum = Packet.MAGIC_NO + Packet.PTYPE_DATA + data_pack.seq_no + data_pack.data_len
 
             while True:
-                self.send_packet('sOut', data_pack, check_sum, file)
+                self.send_packet('sOut', data_pack, file)
                 packet_count += 1  # increment packet sending attempts by 1
-                readable, _, _ = select(self.conns, [], [], 1)  # wait for input on sock
+                sent, received_packets = time(), list()
 
-                if readable:  # if a packet of data is received from channel
-                    received_packet, fails, error = self.receive_packet(fails, -1, file)
-                    if error:
-                        continue
-                    r_cnt += 1
+                while not received_packets and time() - sent < self.rtt.rto:  # wait for whole packets
+                    readable, _, _ = select(self.conns, [], [], max(0, sent + self.rtt.rto - time()))
 
-                    if received_packet.sender_check():  # check if data is invalid
+                    if readable:  # if data is received from channel
+                        received_packets, fails, _ = self.receive_packets(fails, -1, file)
+
+                if not received_packets:
+                    self.rtt.back_off()  # time out expired, wait longer before the next resend
+                else:
+                    r_cnt += len(received_packets)
+                    received_packets = [packet for packet in received_packets if not packet.is_negotiate()]
+                    acks = [packet for packet in received_packets if not packet.sender_check()]
+
+                    if len(acks) < len(received_packets):  # check if data is invalid
                         self.print_invalid_packet(list(self.programs.keys()).index(self.program) - 1)
-                        continue
 
-                    if received_packet.seq_no == nxt:  # check if seq_no is equal to send data
+                    if any(ack.seq_no == nxt for ack in acks):  # check if seq_no is equal to send data
+                        self.rtt.reset_back_off()  # new data is acknowledged, the link is alive
+
+                        if packet_count == 1:  # Karn's rule: only time packets sent once
+                            self.rtt.sample(time() - sent)
                         p_cnt = self.print_data(data, p_cnt, len(data), packet_count)
                         s_cnt += packet_count  # increment sent data count
                         nxt = 1 - nxt  # toggle next between a value of 0 and 1
@@ -77,13 +135,200 @@ class Sender(TCP):
 
                 if ((time() - timer) > self.TIME_OUT and r_cnt == 0) or fails > self.TIME_OUT:
                     self.conn_error(file)  # close program
-        self.trans_finn([s_cnt, r_cnt], p_cnt, file)  # close program
+        self.trans_finn([s_cnt, r_cnt], p_cnt, file, self.rtt)  # close program
+
+    def window_sender(self, file, window, timer):
+        """
+        Sends data with up to window unacknowledged packets in flight, sliding
+        the window on cumulative acknowledgements and resending any packet not
+        acknowledged within the retransmission time out
+        """
+        base, nxt, p_cnt, r_cnt, s_cnt, fails, eof = 0, 0, 1, 0, 0, 0, False
+        in_flight = dict()  # seq_no: [packet, last send time, attempts]
+
+        while not eof or in_flight:
+            while not eof and nxt < base + window:  # fill the window with new packets
+                data_pack = self.data_packet(nxt, nxt, file.segment(nxt))  # at most one segment of the file
+                eof = data_pack.data_len == 0  # empty data packet declares end of file
+
+                self.send_packet('sOut', data_pack, file)
+                in_flight[nxt] = [data_pack, time(), 1]
+                nxt += 1
+
+            oldest = min(entry[1] for entry in in_flight.values())
+            readable, _, _ = select(self.conns, [], [], max(0, oldest + self.rtt.rto - time()))
+
+            if readable:  # if acknowledgements are received from channel
+                received_packets, fails, _ = self.receive_packets(fails, -1, file)
+
+                for received_packet in received_packets:
+                    r_cnt += 1
+
+                    if received_packet.is_negotiate():  # answer to a resent offer
+                        continue
+
+                    if received_packet.sender_check():  # check if data is invalid
+                        self.print_invalid_packet(list(self.programs.keys()).index(self.program) - 1)
+                        continue
+
+                    if received_packet.echoed() is not None:  # ack names the packet that caused it
+                        echoed = in_flight.get(received_packet.echoed())
+
+                        if echoed and echoed[2] == 1:  # Karn's rule: only time packets sent once
+                            self.rtt.sample(time() - echoed[1])
+
+                    if base < min(received_packet.seq_no, nxt):  # ack declares the next expected seq_no
+                        while base < min(received_packet.seq_no, nxt):
+                            data_pack, _, attempts = in_flight.pop(base)
+                            p_cnt = self.print_data(data_pack.data, p_cnt, data_pack.data_len, attempts)
+                            s_cnt += attempts  # increment sent data count
+                            base += 1
+                        file.release(base)  # acknowledged segments are never resent
+
+                        self.rtt.reset_back_off()  # new data is acknowledged, the link is alive
+
+            overdue = [entry for entry in in_flight.values() if time() - entry[1] >= self.rtt.rto]
+            for entry in overdue:  # resend packets whose acknowledgement is overdue
+                self.resend(entry, file)
+
+            if overdue and overdue[0] is in_flight.get(base):
+                self.rtt.back_off()  # oldest packet timed out, wait longer before the next resend
+
+            if ((time() - timer) > self.TIME_OUT and r_cnt == 0) or fails > self.TIME_OUT:
+                self.conn_error(file)  # close program
+        self.trans_finn([s_cnt, r_cnt], p_cnt, file, self.rtt)  # close program
+
+    def async_sender(self, file, window):
+        """
+        Sends data with the asyncio engine, resending from loop timers rather than polling
+        """
+        link = AsyncLink(self, self.socks.get('sIn'), self.socks['sOut'], self.ports['csIn'], 'channel')
+        cnts, p_cnt = self.run_async(AsyncSender(self, link, file, window, self.rtt).run(), file)
+        self.trans_finn(cnts, p_cnt, file, self.rtt)  # close program
+
+    def offer(self):
+        """
+        :return: negotiation packet offering the compression, a version 2 header
+        of the segment size, resuming and a delta until the receiver answers, then
+        one requesting each page of the signatures of its copy, None once nothing is left to ask
+        """
+        if self.agreed:
+            if self.signatures is None or len(self.signatures) >= self.blocks:
+                return None
+            return Packet.negotiation({'signatures': len(self.signatures)}, self.flow, len(self.signatures) + 1)
+
+        terms = dict()
+        if self.compression:
+            terms['compress'] = self.compression.spec()
+        if self.version == 2:
+            terms['version'], terms['mss'] = 2, self.mss
+        if self.resume:
+            terms['resume'] = 1
+        if self.delta:
+            terms['delta'] = 1
+        return Packet.negotiation(terms, self.flow) if terms else None
+
+    def agree(self, answer):
+        """
+        Takes the terms the receiver answered the offer with, or a page of the signatures of its copy
+        """
+        terms = answer.terms()
+
+        if 'sigs' in terms:
+            self.signatures.add(terms)
+            return
+        self.agreed = True
+        self.compression = Compression.parse(terms.get('compress', 'none'))
+        self.version = int(terms.get('version', 1))
+        self.mss = int(terms.get('mss', Packet.MAX_BYTES)) if self.version == 2 else Packet.MAX_BYTES
+
+        if terms.get('resume', '').isdigit() and self.version == 2:
+            self.checkpoint = int(terms['resume']), terms.get('digest')
+        if terms.get('delta', '').isdigit() and terms.get('blocks', '').isdigit():
+            self.signatures, self.blocks = Signatures(int(terms['delta'])), int(terms['blocks'])
+
+    def resume_offset(self, file):
+        """
+        Compares the start of the file with the data the receiver holds
+        :return: offset of the receiver's checkpoint if the file starts with its data, otherwise 0
+        """
+        if not self.checkpoint or not self.checkpoint[0] or not file.seekable():
+            return 0
+        offset, prefix, read = self.checkpoint[0], sha256(), 0
+        file.seek(0)
+
+        while read < offset:
+            chunk = file.read(min(offset - read, 1024 * 1024))
+            if not chunk:
+                break  # the file is shorter than the data the receiver holds
+            prefix.update(chunk)
+            read += len(chunk)
+
+        if read == offset and prefix.hexdigest() == self.checkpoint[1]:
+            return offset
+        file.seek(0)
+        return 0
+
+    def source(self, file):
+        """
+        :return: segment source of the file in segments of the agreed size, compressed if agreed,
+        starting past the data the receiver holds when resuming, or of the delta against its copy
+        """
+        if self.signatures is not None:
+            file = DeltaEncoder(file, self.signatures)  # block references and literal data in place of the file
+        self.skipped = self.resume_offset(file)
+        if self.skipped:
+            print("Resuming " + str(file.name) + " at byte " + str(self.skipped))
+            self.metrics.count('resumed_bytes', self.skipped)
+        return self.compression.source(file, self.mss) if self.compression else SegmentSource(file, self.mss)
+
+    def data_packet(self, seq_no, number, data):
+        """
+        :return: data packet of the segment of a packet number, compressed and with the header as agreed
+        """
+        data, flags = self.compression.encode(data) if self.compression else (data, 0)
+        return Packet(Packet.MAGIC_NO, Packet.PTYPE_DATA | flags, seq_no, len(data), data, self.flow,
+                      self.skipped + number * self.mss, self.version)
+
+    def negotiate(self, file):
+        """
+        Offers the terms to the receiver, resending the offer after each
+        retransmission time out until the receiver answers it
+        """
+        offer, timer = self.offer(), time()
+
+        while time() - timer < self.TIME_OUT:
+            self.send_packet('sOut', offer, file)
+            sent = time()
+
+            while time() - sent < self.rtt.rto:
+                readable, _, _ = select(self.conns, [], [], max(0, sent + self.rtt.rto - time()))
+
+                if readable:
+                    for received_packet in self.receive_packets(0, -1, file)[0]:
+                        if received_packet.is_negotiate() and received_packet.seq_no == offer.seq_no:
+                            self.agree(received_packet)
+                            return
+            self.rtt.back_off()  # time out expired, wait longer before the next offer
+        self.conn_error(file)  # close program
+
+    def resend(self, entry, file):
+        """
+        Resends an in flight packet and updates its send time and attempts
+        """
+        self.send_packet('sOut', entry[0], file, tracing.RETRANSMIT)
+        entry[1], entry[2] = time(), entry[2] + 1
 
 
 def main(arguments):
     tcp_app_sender = Sender()
-    vals = tcp_app_sender.validate_args(arguments, 5, [int] * 3 + [str])
-    tcp_app_sender.sender(vals[0], vals[1], vals[2], vals[3])
+
+    if '--duplex' in arguments:
+        vals = tcp_app_sender.validate_args(arguments, 3, [int, str])
+        tcp_app_sender.sender(None, None, vals[0], vals[1])
+    else:
+        vals = tcp_app_sender.validate_args(arguments, 5, [int] * 3 + [str])
+        tcp_app_sender.sender(vals[0], vals[1], vals[2], vals[3])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,170 @@
+"""
+COSC264 Networking assignment
+The session of the sender for transferring many files over one set of connections.
+Author:
+    - Adam Ross
+"""
+
+import asyncio
+from tcp_async import AsyncLink, AsyncSender
+from compression import Compression
+from urllib.parse import quote
+from sender import Sender
+from packet import Packet
+from io import BytesIO
+from os import path
+from sys import argv
+
+
+class Session(Sender):
+
+    SESSION = 'session'  # name of the session program file
+
+    def __init__(self):
+        super().__init__()
+        self.program = self.SESSION
+        self.metrics.program = self.program  # label of the program's metrics
+        self.programs[self.SESSION] = ('[--quiet] [--metrics=json|prom] [--window=<N>] '
+                                       '[--compress=zlib|lzma[:stream|segment]] [--mss=<bytes>] '
+                                       '(<sIn> <sOut> <csIn> | --duplex <csIn>) <input file> [<input file> ...]')
+        self.window = 1  # max number of unacknowledged packets in flight
+        self.runner = None  # event loop kept between the transfers of the session
+        self.link = None  # connection to the channel, open for the whole session
+        self.manifest = list()  # (name, size) of each file sent, in order
+        self.cnts, self.p_cnt = [0, 0], 1  # sent and received counts, count of packets, over every file
+
+    @staticmethod
+    def open(s_in, s_out, cs_in, window=1, compress='none', mss=None, flow=0):
+        """
+        Connects to the channel once for every file to be sent, and agrees the
+        compression and segment size with a receiver run with --session.
+        Without s_in and s_out one connection carries both ways, as with --duplex
+        :return: open session
+        """
+        session = Session()
+        session.window, session.flow = window, flow
+        session.compression = Compression.parse(compress)
+
+        if mss is not None:
+            session.mss, session.version = mss, 2  # wide headers are needed for large segments
+        if window < 1 or not 0 < session.mss <= Packet.MAX_MSS:
+            raise ValueError("window must be >= 1 and mss between 1 and " + str(Packet.MAX_MSS))
+
+        if s_in is None and s_out is None:
+            session.ports, session.socks = {'csIn': cs_in}, {'sOut': None}
+        else:
+            session.ports = {
+                'sIn': s_in,
+                'sOut': s_out,
+                'csIn': cs_in
+            }  # dictionary for ports
+            session.socks = {
+                'sIn': None,
+                'sOut': None
+            }  # dictionary for sockets
+        session.port_socket_init()  # init ports, sockets
+
+        session.link = AsyncLink(session, session.socks.get('sIn'), session.socks['sOut'], session.ports['csIn'],
+                                 'channel')
+        session.runner = asyncio.Runner()
+        session.runner.run(session.start())
+        return session
+
+    async def start(self):
+        await self.link.open()
+        print("All sockets are connected\n\nTransmission status report: ")
+
+        if self.offer():
+            self.agree(await AsyncSender(self, self.link, None, self.window, self.rtt).negotiate(self.offer()))
+
+    def send_file(self, file_name, name=None):
+        """
+        Sends a file, named in the receiver's directory by its base name unless a name is given
+        :return: sent and received counts of the file, count of its packets
+        """
+        with open(file_name, 'rb') as file:
+            return self.send(name or path.basename(file_name), path.getsize(file_name), file)
+
+    def send_bytes(self, name, data):
+        """
+        Sends data as a file of the given name in the receiver's directory
+        :return: sent and received counts of the file, count of its packets
+        """
+        return self.send(name, len(data), BytesIO(data))
+
+    def send(self, name, size, file):
+        """
+        Announces a file with a manifest entry of its name and size, then sends it over the open connections
+        :return: sent and received counts of the file, count of its packets
+        """
+        entry = Packet.negotiation({'file': quote(name, safe=''), 'size': size}, self.flow, len(self.manifest) + 1)
+        cnts, p_cnt = self.runner.run(self.transfer(entry, file))
+
+        self.manifest.append((name, size))
+        self.cnts = [total + cnt for total, cnt in zip(self.cnts, cnts)]
+        self.p_cnt += p_cnt - 1
+        return cnts, p_cnt
+
+    async def transfer(self, entry, file):
+        engine = AsyncSender(self, self.link, file, self.window, self.rtt)
+        await engine.negotiate(entry)  # the receiver has opened the file once it answers
+
+        try:
+            return await engine.transfer()
+        finally:
+            engine.file.close()
+
+    def print_invalid_packet(self, sender_program):
+        super().print_invalid_packet(list(self.programs.keys()).index(self.RECEIVER))  # acks come from the receiver
+
+    def close(self):
+        """
+        Closes the connections, which ends the session of the channel and receiver
+        """
+        if self.runner is not None:
+            self.link.close()
+            self.runner.close()
+            self.runner = None
+
+        for sock in self.socks.values():
+            sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(arguments):
+    options = Session()
+    positional = options.parse_options(arguments)
+    count = 3 if '--duplex' in arguments else 5  # ports, then at least one file
+
+    if len(positional) < count or any(not port.isdigit() for port in positional[1:count - 1]) or \
+            any(not path.isfile(file_name) for file_name in positional[count - 1:]):
+        options.exit_program()
+    ports = [int(port) for port in positional[1:count - 1]]
+
+    try:
+        session = Session.open(*([None, None] + ports if count == 3 else ports),
+                               window=options.option('window', int, 1),
+                               compress=options.option('compress', str, 'none'),
+                               mss=options.option('mss', int, None))
+    except ValueError:
+        options.exit_program()
+    session.options, session.quiet = options.options, options.option('quiet', bool, False)
+
+    try:
+        for file_name in positional[count - 1:]:
+            session.send_file(file_name)
+            print(path.basename(file_name) + " sent, " + str(path.getsize(file_name)) + " bytes")
+    except (OSError, ConnectionError, asyncio.TimeoutError):
+        session.close()
+        session.conn_error()  # close program
+    session.close()
+    session.trans_finn(session.cnts, session.p_cnt, rtt=session.rtt)  # close program
+
+
+if __name__ == '__main__':
+    main(argv)
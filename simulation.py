@@ -0,0 +1,191 @@
+"""
+COSC264 Networking assignment
+The in-process simulation for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+import asyncio
+from tcp_async import AsyncLink, AsyncSender, AsyncReceiver, AsyncChannel
+from tcp_transmission import TCP
+from contextlib import redirect_stdout
+from selectors import SelectSelector
+from receiver import Receiver
+from channel import Channel
+import loss_model
+import tracing
+from sender import Sender
+from io import BytesIO, StringIO
+from os import path
+import json
+from sys import argv
+
+
+class VirtualSelector(SelectSelector):
+
+    def __init__(self):
+        super().__init__()
+        self.clock = 0.0  # virtual seconds since the simulation started
+
+    def select(self, timeout=None):
+        """
+        Moves the virtual clock to the next timer of the event loop instead of waiting
+        for it, as simulated programs only exchange data through in-memory queues
+        """
+        if timeout is None:
+            raise RuntimeError("simulation has no timer left to wait for")
+        self.clock += timeout
+        return list()
+
+
+class SimulationLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self):
+        self.selector = VirtualSelector()  # drives the virtual clock
+        super().__init__(self.selector)
+
+    def time(self):
+        return self.selector.clock
+
+
+class QueueLink(AsyncLink):
+
+    def __init__(self, tcp, name, delay):
+        super().__init__(tcp, None, None, None, name)
+        self.delay = delay  # virtual seconds a chunk takes to reach the other program
+        self.queue = asyncio.Queue()  # chunks of the stream from the other program
+        self.peer = None  # link of the other program
+        self.closed = False  # if this program has closed the link
+        self.ended = False  # if the other program has closed the link
+
+    @staticmethod
+    def pair(tcp, name, peer_tcp, peer_name, delay):
+        """
+        Connects two programs in place of a pair of socket connections
+        :return: link of tcp to the peer program, link of the peer program to tcp
+        """
+        link, peer = QueueLink(tcp, peer_name, delay), QueueLink(peer_tcp, name, delay)
+        link.peer, peer.peer = peer, link
+        return link, peer
+
+    async def open(self):
+        print("Queue to " + self.name + " connected...")
+
+    async def read(self):
+        """
+        :return: every chunk that has arrived from the other program, empty once it has closed
+        """
+        if self.ended:
+            return b''
+        chunk = await self.queue.get()
+        chunks = [chunk]
+
+        while chunk and not self.queue.empty():
+            chunk = self.queue.get_nowait()
+            chunks.append(chunk)
+        self.ended = not chunk  # data before the end of the stream is returned first
+        return b''.join(chunks)
+
+    def send(self, packet, chk_sum=None, reason=tracing.NONE):
+        if not self.closed:
+            byte_pack = packet.buffer(chk_sum)
+            asyncio.get_running_loop().call_later(self.delay, self.peer.queue.put_nowait, byte_pack)
+            self.tcp.count_sent(byte_pack, packet, reason)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            asyncio.get_running_loop().call_later(self.delay, self.peer.queue.put_nowait, b'')  # end of stream
+
+
+class Simulation(TCP):
+
+    SIMULATION = 'simulation'  # name of the simulation program file
+    DELAY = 0.001  # default virtual seconds a packet takes to cross each link
+
+    def __init__(self):
+        super().__init__()
+        self.program = self.SIMULATION
+        self.metrics.program = self.program  # label of the program's metrics
+        self.programs[self.SIMULATION] = ('[--quiet] [--metrics=json] [--window=<N>] [--seed=<n>] [--delay=<seconds>] '
+                                          '[--loss=<model>] [--bit-err=<P>] <input file> <P>')
+
+    def simulate(self, data, p, seed=None, window=1, delay=DELAY, loss='bernoulli', bit_err=TCP.BIT_ERR, quiet=False):
+        """
+        Transfers data from a sender through a channel to a receiver, all in this
+        process on virtual time, so a seed repeats a run exactly
+        :return: dictionary of the received data, each program's counts, metrics and
+        output, and the virtual seconds the transfer took
+        """
+        sender, receiver, channel = Sender(), Receiver(), Channel(seed)
+        channel.BIT_ERR = bit_err  # probability of a bit error in each delivered packet
+        channel.use_loss_model(loss, p)
+
+        for program in (sender, receiver, channel):
+            program.quiet = quiet  # per packet messages are not printed
+        s_link, cs_link = QueueLink.pair(sender, 'sender', channel, 'channel', delay)
+        r_link, cr_link = QueueLink.pair(receiver, 'receiver', channel, 'channel', delay)
+        received, output = BytesIO(), StringIO()
+
+        engines = [
+            AsyncSender(sender, s_link, BytesIO(data), window, sender.rtt).run(),
+            AsyncChannel(channel, cs_link, cr_link, p).run(),
+            AsyncReceiver(receiver, r_link, received, window).run()
+        ]
+
+        async def run():
+            return await asyncio.gather(*engines, return_exceptions=True)
+
+        with redirect_stdout(output), asyncio.Runner(loop_factory=SimulationLoop) as runner:
+            results = runner.run(run())
+            seconds = runner.get_loop().time()
+
+        return {
+            'received': received.getvalue(),
+            'sender': results[0],
+            'channel': results[1],
+            'receiver': results[2],
+            'seconds': seconds,
+            'metrics': {program.program: program.metrics.snapshot(seconds) for program in (sender, channel, receiver)},
+            'output': output.getvalue()
+        }
+
+    def run(self, file_name, p):
+        """
+        Simulates the transfer of a file, writing what is received to received_<file>
+        """
+        loss, bit_err = self.option('loss', str, 'bernoulli'), self.option('bit-err', float, self.BIT_ERR)
+        try:
+            loss_model.create(loss, p, 0.0)  # checks the loss model before the programs start
+        except (ValueError, OSError):
+            self.exit_program()
+
+        if not path.exists(file_name) or not 0.0 <= p < 1.0 or not 0.0 <= bit_err <= 1.0:
+            self.exit_program()
+
+        with open(file_name, 'rb') as file:
+            data = file.read()
+        result = self.simulate(data, p, self.option('seed', int, None), self.option('window', int, 1),
+                               self.option('delay', float, self.DELAY), loss, bit_err, self.quiet)
+
+        with open("received_" + file_name, 'wb') as received:
+            received.write(result['received'])
+
+        if self.option('metrics', str, None) is not None:
+            print(json.dumps(result['metrics'], indent=2))
+
+        for program in ('sender', 'channel', 'receiver'):
+            outcome = result[program]
+            print(program.capitalize() + ": " + (str(outcome[0]) if isinstance(outcome, tuple) else repr(outcome)))
+        print(("Received data matches " if result['received'] == data else "Received data differs from ") +
+              str(file_name) + " after " + str(round(result['seconds'], 3)) + " virtual seconds")
+
+
+def main(arguments):
+    simulation = Simulation()
+    vals = simulation.validate_args(arguments, 3, [str, float])
+    simulation.run(vals[0], vals[1])
+
+
+if __name__ == '__main__':
+    main(argv)
@@ -0,0 +1,191 @@
+"""
+COSC264 Networking assignment
+The striped transfer of a file over parallel streams for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from tcp_transmission import TCP
+from tcp_async import run_loopback
+from contextlib import redirect_stdout
+from time import perf_counter
+from receiver import Receiver
+from channel import Channel
+from sender import Sender
+from packet import Packet
+from io import RawIOBase, StringIO
+import loss_model
+import filecmp
+import sys
+import os
+
+
+class FileRange(RawIOBase):
+
+    def __init__(self, file, start, length):
+        super().__init__()
+        self.fd = file.fileno()  # descriptor the range is read from, shared with other stripes
+        self.name = file.name + "[" + str(start) + ":" + str(start + length) + "]"  # for messages
+        self.position = start  # offset of the next byte read
+        self.end = start + length  # offset just past the range
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        """
+        :return: up to size bytes of the range, read at their offset so stripes never share a file position
+        """
+        left = self.end - self.position
+        data = os.pread(self.fd, left if size < 0 else min(size, left), self.position) if left > 0 else b''
+        self.position += len(data)
+        return data
+
+
+class RangeWriter:
+
+    def __init__(self, file, start):
+        self.fd = file.fileno()  # descriptor of the preallocated output file
+        self.name = file.name + "[" + str(start) + ":]"  # for messages
+        self.position = start  # offset the next data received is written at
+
+    def write(self, data):
+        """
+        Writes data delivered in order at its offset in the output file, continuing after partial writes
+        """
+        view = memoryview(data)
+
+        while view:
+            written = os.pwrite(self.fd, view, self.position)
+            self.position += written
+            view = view[written:]
+
+    def close(self):
+        pass  # the output file is shared with the other stripes and closed by the stripe
+
+
+def silence():
+    """
+    Discards the messages of the programs run by a worker process
+    """
+    sys.stdout = StringIO()
+
+
+def transfer_range(stripe, file_name, output_name, start, length, p, window, mss, seed, loss):
+    """
+    Transfers one byte range of a file through its own sender, channel and
+    receiver, writing it at the same offset of the preallocated output file
+    :return: dictionary of the stripe, its range, seconds taken and the outcome of each program
+    """
+    sender, receiver, channel = Sender(), Receiver(), Channel(seed)
+    channel.use_loss_model(loss, p)
+    sender.flow = stripe  # flow_id of every data packet of the stripe
+
+    if mss is not None:
+        sender.mss, sender.version = mss, 2  # offered to the receiver like --mss
+    for program in (sender, receiver, channel):
+        program.quiet = True  # per packet messages are not printed
+
+    with open(file_name, 'rb') as file, open(output_name, 'r+b') as output:
+        started = perf_counter()
+        outcomes = run_loopback(sender, channel, receiver, FileRange(file, start, length),
+                                RangeWriter(output, start), p, window)
+        seconds = perf_counter() - started
+
+    return {
+        'stripe': stripe,
+        'start': start,
+        'length': length,
+        'seconds': seconds,
+        'outcomes': [outcome[0] if isinstance(outcome, tuple) else repr(outcome) for outcome in outcomes]
+    }
+
+
+class Striped(TCP):
+
+    STRIPED = 'striped'  # name of the striped program file
+    POOLS = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}  # pools the streams may run in
+    WINDOW = 16  # default window of each stream
+
+    def __init__(self):
+        super().__init__()
+        self.program = self.STRIPED
+        self.metrics.program = self.program  # label of the program's metrics
+        self.programs[self.STRIPED] = ('[--streams=<N>] [--pool=process|thread] [--window=<N>] [--mss=<bytes>] '
+                                       '[--seed=<n>] [--loss=<model>] <input file> <P>')
+
+    @staticmethod
+    def ranges(size, streams, segment=Packet.MAX_BYTES):
+        """
+        Splits a file into at most streams byte ranges of whole segments, the last one holding the rest
+        :return: list of (start, length) of each range
+        """
+        step = max(1, -(-size // (streams * segment))) * segment  # bytes per range, rounded up to whole segments
+        return [(start, min(step, size - start)) for start in range(0, size, step)] or [(0, 0)]
+
+    @staticmethod
+    def preallocate(file, size):
+        """
+        Sizes the output file before the stripes write into it, reserving its blocks where supported
+        """
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(file.fileno(), 0, size)
+                return
+            except OSError:
+                pass  # file systems without fallocate only have their size set
+        os.ftruncate(file.fileno(), size)
+
+    def run(self, file_name, p):
+        """
+        Transfers a file over parallel streams, writing it to received_<file>
+        """
+        streams = self.option('streams', int, os.cpu_count() or 1)
+        pool = self.POOLS.get(self.option('pool', str, 'process'))
+        window = self.option('window', int, self.WINDOW)
+        mss = self.option('mss', int, None)
+        seed = self.option('seed', int, None)
+        loss = self.option('loss', str, 'bernoulli')
+
+        try:
+            loss_model.create(loss, p, 0.0)  # checks the loss model before the streams start
+        except (ValueError, OSError):
+            self.exit_program()
+
+        if not os.path.exists(file_name) or not 0.0 <= p < 1.0 or streams < 1 or window < 1 or pool is None or \
+                (mss is not None and not 0 < mss <= Packet.MAX_MSS):
+            self.exit_program()
+
+        size, output_name = os.path.getsize(file_name), "received_" + file_name
+        with open(output_name, 'wb') as output:
+            self.preallocate(output, size)
+        ranges = self.ranges(size, streams, mss or Packet.MAX_BYTES)
+
+        started = perf_counter()
+        with redirect_stdout(StringIO()), pool(len(ranges), **({'initializer': silence}
+                                                               if pool is ProcessPoolExecutor else {})) as executor:
+            jobs = [executor.submit(transfer_range, stripe, file_name, output_name, start, length, p, window,
+                                    mss, None if seed is None else seed + stripe, loss)
+                    for stripe, (start, length) in enumerate(ranges)]
+            results = [job.result() for job in jobs]
+        seconds = perf_counter() - started
+
+        for result in results:
+            print("Stripe " + str(result['stripe']) + ": bytes " + str(result['start']) + "-" +
+                  str(result['start'] + result['length']) + " in " + str(round(result['seconds'], 3)) +
+                  " seconds, sender " + str(result['outcomes'][0]) + ", receiver " + str(result['outcomes'][2]))
+        print(str(size) + " bytes over " + str(len(ranges)) + " stream(s) in " + str(round(seconds, 3)) +
+              " seconds: " + str(round(size / seconds)) + " bytes/s")
+        print(("Received data matches " if filecmp.cmp(file_name, output_name, shallow=False) else
+               "Received data differs from ") + str(file_name))
+
+
+def main(arguments):
+    striped = Striped()
+    vals = striped.validate_args(arguments, 3, [str, float])
+    striped.run(vals[0], vals[1])
+
+
+if __name__ == '__main__':
+    main(sys.argv)
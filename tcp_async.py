@@ -0,0 +1,573 @@
+"""
+COSC264 Networking assignment
+The asyncio engine for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+import asyncio
+from socket import socket, AF_INET, SOCK_STREAM
+from packet import Packet, PacketReader
+import tracing
+
+
+def clock():
+    """
+    :return: seconds on the clock of the running event loop, which a simulation runs on virtual time
+    """
+    return asyncio.get_running_loop().time()
+
+
+class AsyncLink:
+
+    def __init__(self, tcp, in_sock, out_sock, port, name):
+        self.tcp = tcp  # program the link belongs to, for its messages and time out
+        self.in_sock = in_sock  # bound socket the other program connects to
+        self.out_sock = out_sock  # socket connected to the other program
+        self.port = port  # In port of the other program
+        self.name = name  # name of the other program
+        self.reader = None  # stream of packets from the other program, on the accepted socket
+        self.writer = None  # stream of packets to the other program, on the Out socket
+        self.accepted = None  # writing end of the accepted socket, kept open until the link closes
+        self.packets = PacketReader(None)  # reassembly buffer of the received byte stream
+        self.heard = False  # if anything has arrived from the other program
+
+    async def open(self):
+        """
+        Accepts the other program's connection to the In socket while connecting
+        the Out socket to the other program, waiting between connection attempts.
+        In duplex mode the link has only one of the two, which carries both ways
+        """
+        accepted, started = asyncio.get_running_loop().create_future(), clock()
+
+        def accept(reader, writer):
+            self.tcp.no_delay(writer.get_extra_info('socket'))
+
+            if not accepted.done():
+                accepted.set_result((reader, writer))
+
+        if self.in_sock:
+            server = await asyncio.start_server(accept, sock=self.in_sock)
+            print("Listening for a socket connection to " + self.name + "...")
+
+        if self.out_sock:
+            await self.connect()
+
+        if self.in_sock:
+            self.reader, self.accepted = await accepted
+            server.close()  # stops listening, the accepted connection stays open
+            print("In port for " + self.name + " connected...")
+
+            if not self.out_sock:
+                self.writer = self.accepted  # packets are sent back on the accepted connection
+        self.tcp.metrics.observe('link_setup_seconds', clock() - started)
+        print("Link to " + self.name + " set up in " + str(round((clock() - started) * 1000, 1)) + " ms")
+
+    async def connect(self):
+        """
+        Connects the Out socket to the other program's In port, backing off
+        between refused attempts until the other program is listening
+        """
+        loop, delay = asyncio.get_running_loop(), self.tcp.CONNECT_DELAY
+        self.out_sock.setblocking(False)
+
+        while True:
+            try:
+                await loop.sock_connect(self.out_sock, (self.tcp.LOOPBACK, self.port))
+                break
+            except OSError:
+                await asyncio.sleep(delay)  # the other program is not listening yet
+                delay = min(self.tcp.MAX_CONNECT_DELAY, delay * 2)
+        reader, self.writer = await asyncio.open_connection(sock=self.tcp.no_delay(self.out_sock))
+        print("Out port for " + self.name + " connected...")
+
+        if not self.in_sock:
+            self.reader = reader  # packets are received on the same connection
+
+    async def read(self):
+        """
+        :return: next chunk of the stream from the other program, empty once it has closed
+        """
+        return await self.reader.read(PacketReader.READ_SIZE)
+
+    async def receive(self):
+        """
+        Waits for the next chunk of the stream from the other program. As in the
+        select engine, only silence since the link opened is deemed a failure,
+        as a lossy link can be quiet for long while packets are resent
+        :return: list of (data packet, check sum) tuples, in order of arrival
+        """
+        read = self.read()
+
+        if not self.heard:
+            read = asyncio.wait_for(read, self.tcp.TIME_OUT)
+        chunk = await read
+        self.heard = True
+
+        if not chunk:
+            raise ConnectionError("connection closed by " + self.name)
+        dropped = self.packets.dropped
+        packets = self.packets.feed(chunk)
+        self.tcp.count_received(packets, self.packets.dropped - dropped)
+        return packets
+
+    def send(self, packet, chk_sum=None, reason=tracing.NONE):
+        """
+        Queues a packet on the stream to the other program, unless it has closed
+        """
+        if not self.writer.is_closing():
+            byte_pack = packet.buffer(chk_sum)
+            self.tcp.count_sent(byte_pack, packet, reason)  # traced before it can arrive
+            self.writer.write(byte_pack)
+
+    def close(self):
+        for writer in (self.writer, self.accepted):
+            if writer:
+                writer.close()
+
+
+class AsyncSender:
+
+    def __init__(self, tcp, link, file, window, rtt):
+        self.tcp = tcp  # sender program, for its messages and the terms agreed with the receiver
+        self.link = link  # connection to the channel
+        self.file = file  # file data is read from, replaced by its segment source once connected
+        self.window = window  # max number of unacknowledged packets in flight
+        self.rtt = rtt  # adaptive retransmission time out
+        self.in_flight = dict()  # packet number: [packet, last send time, attempts]
+        self.base, self.nxt, self.eof = 0, 0, False
+        self.p_cnt, self.r_cnt, self.s_cnt = 1, 0, 0
+        self.timer = None  # retransmission timer of the earliest packet sent that is unacknowledged
+
+    async def run(self):
+        """
+        Sends the file, resending from a loop timer instead of polling for time outs
+        :return: sent and received counts, count of packets
+        """
+        await self.link.open()
+        print("All sockets are connected\n\nTransmission status report: ")
+
+        try:
+            while self.tcp.offer():  # terms the receiver accepts, then the signatures of its copy
+                self.tcp.agree(await self.negotiate(self.tcp.offer()))
+            return await self.transfer()
+        finally:
+            self.link.close()
+
+    async def transfer(self):
+        """
+        Sends the file over the open link, leaving it open for a session's next file
+        :return: sent and received counts, count of packets
+        """
+        self.file = self.tcp.source(self.file)
+
+        try:
+            self.fill()
+
+            while self.in_flight:
+                for packet, _ in await self.link.receive():
+                    self.acknowledge(packet)
+                self.fill()
+        finally:
+            self.stop_timer()
+        return [self.s_cnt, self.r_cnt], self.p_cnt
+
+    async def negotiate(self, offer):
+        """
+        Offers terms to the receiver, resending the offer after each
+        retransmission time out until the receiver answers
+        :return: answer of the receiver, with the seq_no of the offer
+        """
+        started = clock()
+
+        while clock() - started < self.tcp.TIME_OUT:
+            self.link.send(offer)
+            try:
+                packets = await asyncio.wait_for(self.link.receive(), self.rtt.rto)
+            except asyncio.TimeoutError:
+                self.rtt.back_off()  # time out expired, wait longer before the next offer
+                continue
+
+            for packet, _ in packets:
+                if packet.is_negotiate() and packet.seq_no == offer.seq_no:
+                    return packet
+        raise ConnectionError("receiver did not answer the offer")
+
+    def seq_no(self, number):
+        """
+        :return: seq_no of a packet number, alternating between 0 and 1 for stop-and-wait
+        """
+        return number if self.window > 1 else number % 2
+
+    def fill(self):
+        """
+        Sends new packets until the window is full or the file is read
+        """
+        while not self.eof and self.nxt < self.base + self.window:
+            data_pack = self.tcp.data_packet(self.seq_no(self.nxt), self.nxt, self.file.segment(self.nxt))
+            self.eof = data_pack.data_len == 0  # empty data packet declares end of file
+
+            self.link.send(data_pack)
+            self.in_flight[self.nxt] = [data_pack, clock(), 1]
+            self.nxt += 1
+
+        if self.in_flight and self.timer is None:
+            self.start_timer()
+
+    def acknowledge(self, packet):
+        """
+        Slides the window on an acknowledgement, which in stop-and-wait names the
+        seq_no received, and otherwise the next seq_no the receiver expects
+        """
+        self.r_cnt += 1
+
+        if packet.is_negotiate():  # answer to a resent offer
+            return
+
+        if packet.sender_check():  # check if data is invalid
+            self.tcp.print_invalid_packet(list(self.tcp.programs.keys()).index(self.tcp.program) - 1)
+            return
+
+        if packet.echoed() is not None:  # ack names the packet that caused it
+            echoed = self.in_flight.get(packet.echoed())
+
+            if echoed and echoed[2] == 1:  # Karn's rule: only time packets sent once
+                self.rtt.sample(clock() - echoed[1])
+
+        if self.window > 1:
+            acked = min(packet.seq_no, self.nxt)
+        else:
+            acked = self.base + 1 if self.in_flight and packet.seq_no == self.seq_no(self.base) else self.base
+
+        if acked <= self.base:
+            return
+
+        while self.base < acked:
+            data_pack, sent, attempts = self.in_flight.pop(self.base)
+
+            if self.window == 1 and attempts == 1:  # Karn's rule: only time packets sent once
+                self.rtt.sample(clock() - sent)
+            self.p_cnt = self.tcp.print_data(data_pack.data, self.p_cnt, data_pack.data_len, attempts)
+            self.s_cnt += attempts  # increment sent data count
+            self.base += 1
+        self.file.release(self.base)  # acknowledged segments are never resent
+
+        self.rtt.reset_back_off()  # new data is acknowledged, the link is alive
+
+        if self.in_flight:
+            self.start_timer()  # restart the timer for the packets still in flight
+        else:
+            self.stop_timer()
+
+    def resend(self, entry):
+        """
+        Resends an in flight packet and updates its send time and attempts
+        """
+        self.link.send(entry[0], reason=tracing.RETRANSMIT)
+        entry[1], entry[2] = clock(), entry[2] + 1
+
+    def time_out(self, due):
+        """
+        Resends every packet whose acknowledgement was due by the time the timer was set for
+        """
+        overdue = [entry for entry in self.in_flight.values() if entry[1] + self.rtt.rto <= due]
+        for entry in overdue:
+            self.resend(entry)
+
+        if overdue and overdue[0] is self.in_flight.get(self.base):
+            self.rtt.back_off()  # oldest packet timed out, wait longer before the next resend
+        self.start_timer()
+
+    def start_timer(self):
+        """
+        Sets the timer for when the acknowledgement of the earliest packet sent is due
+        """
+        self.stop_timer()
+        due = min(entry[1] for entry in self.in_flight.values()) + self.rtt.rto
+        self.timer = asyncio.get_running_loop().call_at(due, self.time_out, due)
+
+    def stop_timer(self):
+        if self.timer:
+            self.timer.cancel()
+        self.timer = None
+
+
+class AsyncReceiver:
+
+    def __init__(self, tcp, link, file, window):
+        self.tcp = tcp  # receiver program, for its messages
+        self.link = link  # connection to the channel
+        self.file = file  # file received data is written to
+        self.window = window  # max number of packets buffered out of order
+        self.out_of_order = dict()  # seq_no: packet received ahead of the expected seq_no
+        self.expected, self.finished = 0, False
+        self.p_cnt, self.r_cnt, self.s_cnt = 1, 0, 0
+
+    async def run(self):
+        """
+        Receives the file, acknowledging each packet as it arrives
+        :return: sent and received counts, count of packets
+        """
+        await self.link.open()
+        print("All sockets are connected\n\nTransmission status report: ")
+
+        try:
+            while not self.finished:
+                for packet, _ in await self.link.receive():
+                    self.r_cnt += 1  # increment received packet count
+
+                    if packet.is_negotiate():  # answer an offer of compression or segment size
+                        self.link.send(self.tcp.negotiated(packet))
+                        self.s_cnt += 1  # increment sent packet count
+                    elif not packet.receiver_check():
+                        self.tcp.print_invalid_packet(list(self.tcp.programs.keys()).index(self.tcp.program) + 1)
+                    elif self.window > 1:
+                        self.window_deliver(packet)
+                    else:
+                        self.deliver(packet)
+
+                    if self.finished:
+                        break
+            await self.linger()
+        finally:
+            self.link.close()
+        return [self.s_cnt, self.r_cnt], self.p_cnt
+
+    async def linger(self):
+        """
+        Acknowledges each data packet resent after the final one was written, as the
+        sender resends until it gets an acknowledgement, until the channel closes once
+        the sender has finished, or nothing arrives for the receiver's LINGER seconds
+        """
+        while True:
+            try:
+                packets = await asyncio.wait_for(self.link.receive(), self.tcp.LINGER)
+            except (ConnectionError, asyncio.TimeoutError):
+                return  # the channel has closed, or the sender has stopped resending
+
+            for packet, _ in packets:
+                self.r_cnt += 1  # increment received packet count
+
+                if not packet.receiver_check():
+                    continue
+                elif self.window > 1:  # acknowledged again, as it is no longer expected
+                    self.window_deliver(packet)
+                else:
+                    self.deliver(packet)
+
+    def deliver(self, packet):
+        """
+        Stop-and-wait: acknowledges the seq_no received, writing the packet if it was expected
+        """
+        if packet.seq_no == self.expected:
+            self.p_cnt = self.tcp.print_data(packet.data, self.p_cnt, len(packet.data))
+            self.expected = 1 - self.expected  # toggle expected between 1 and 0
+            self.write(packet)
+        self.link.send(packet.ack(packet.seq_no))
+        self.s_cnt += 1  # increment sent packet count
+
+    def window_deliver(self, packet):
+        """
+        Pipelined: buffers packets ahead of the expected seq_no, writes every packet
+        now in sequence and acknowledges the next expected seq_no
+        """
+        if self.expected <= packet.seq_no < self.expected + self.window:
+            self.out_of_order[packet.seq_no] = packet  # hold until the gap is filled
+
+        while self.expected in self.out_of_order:  # deliver every packet now in sequence
+            in_order = self.out_of_order.pop(self.expected)
+            self.p_cnt = self.tcp.print_data(in_order.data, self.p_cnt, len(in_order.data))
+            self.expected += 1
+            self.write(in_order)
+
+        self.link.send(packet.ack(self.expected, echo=True))  # the echo lets the sender time this packet
+        self.s_cnt += 1  # increment sent packet count
+
+    def write(self, packet):
+        self.file.write(self.tcp.decode(packet))  # write received data to file
+        self.finished = packet.data_len == 0  # empty data packet declares end of file
+
+
+class AsyncSessionReceiver(AsyncReceiver):
+
+    def __init__(self, tcp, link, window):
+        super().__init__(tcp, link, None, window)
+        self.index = 0  # seq_no of the manifest entry of the file being received, 0 before the first
+        self.finished = True  # no file is being received until the first manifest entry
+
+    async def run(self):
+        """
+        Receives every file of a session, each announced by a manifest entry,
+        until the sender closes the session
+        :return: sent and received counts, count of packets
+        """
+        await self.link.open()
+        print("All sockets are connected\n\nTransmission status report: ")
+
+        try:
+            while True:
+                try:
+                    packets = await self.link.receive()
+                except ConnectionError:
+                    if self.finished:
+                        break  # the sender closed the session between files
+                    raise
+
+                for packet, _ in packets:
+                    self.r_cnt += 1  # increment received packet count
+
+                    if packet.is_negotiate() and 'file' in packet.terms():
+                        self.begin(packet)
+                    elif packet.is_negotiate():  # answer an offer of compression or segment size
+                        self.link.send(self.tcp.negotiated(packet))
+                        self.s_cnt += 1  # increment sent packet count
+                    elif not packet.receiver_check() or self.file is None:  # data must follow a manifest entry
+                        self.tcp.print_invalid_packet(list(self.tcp.programs.keys()).index(self.tcp.program) + 1)
+                    elif self.window > 1:
+                        self.window_deliver(packet)
+                    else:
+                        self.deliver(packet)
+        finally:
+            if self.file is not None and not self.finished:
+                self.file.close()
+            self.link.close()
+        return [self.s_cnt, self.r_cnt], self.p_cnt
+
+    def begin(self, entry):
+        """
+        Starts receiving the file of a manifest entry, unless the entry is a
+        resent one of the file being received, and answers it
+        """
+        if entry.seq_no != self.index:
+            self.file = self.tcp.session_file(entry)  # file the entry's data is written to
+            self.index, self.expected, self.finished = entry.seq_no, 0, False
+            self.out_of_order.clear()
+        self.link.send(Packet.negotiation({'file': entry.terms()['file']}, entry.flow_id, entry.seq_no))
+        self.s_cnt += 1  # increment sent packet count
+
+    def write(self, packet):
+        super().write(packet)
+
+        if self.finished:
+            self.tcp.session_file_done(self.file)
+
+
+class AsyncChannel:
+
+    def __init__(self, tcp, sender_link, receiver_link, p):
+        self.tcp = tcp  # channel program, for its messages and error injection
+        self.links = {
+            tcp.SENDER: (sender_link, receiver_link),
+            tcp.RECEIVER: (receiver_link, sender_link)
+        }  # transmitter: (link packets are received from, link they are sent to)
+        self.p = p  # probability of packet loss
+        self.end = False  # if the final data packet has been received from the sender
+        self.last = 0.0  # loop time the last packet on the emulated link is delivered at
+        self.p_cnt, self.r_cnt, self.snt, self.lss, self.bit = 0, 0, 0, 0, 0
+
+    async def run(self):
+        """
+        Relays packets both ways until the sender or receiver closes its connection
+        :return: transmission counts for the channel report, count of packets
+        """
+        timer = clock()
+        await asyncio.gather(*(link.open() for link, _ in self.links.values()))
+        print("All sockets are connected\n\nTransmission status report: ")
+        relays = [asyncio.ensure_future(self.relay(transmitter)) for transmitter in self.links]
+
+        try:
+            await asyncio.wait(relays, return_when=asyncio.FIRST_COMPLETED)
+            await asyncio.sleep(max(0.0, self.last - asyncio.get_running_loop().time()))  # still on the link
+        finally:
+            for relay in relays:
+                relay.cancel()
+
+            for link, _ in self.links.values():
+                link.close()
+
+        if not self.end:
+            raise ConnectionError("connection closed before the final data packet")
+        print("All TCP transmissions are complete")
+        return [self.snt, self.r_cnt, self.p, self.lss, self.bit, clock() - timer], self.p_cnt
+
+    async def relay(self, transmitter):
+        """
+        Forwards packets from one program to the other, injecting packet loss and
+        bit errors, until the transmitting program closes its connection
+        """
+        source, destination = self.links[transmitter]
+
+        while True:
+            try:
+                received_packets = await source.receive()
+            except (ConnectionError, asyncio.TimeoutError):
+                return
+
+            for received_packet, check_sum in received_packets:
+                if transmitter == self.tcp.SENDER and len(received_packet.data) == 0:
+                    self.end = True  # this indicates final data pack
+                self.tcp.print_packet_transmission_success(transmitter, received_packet, False)
+                self.r_cnt += 1  # increment the count of packets received
+
+                received_packet, self.lss, self.bit, self.snt, err = self.tcp.is_err(
+                    received_packet, self.p, self.lss, self.bit, self.snt)
+
+                # if there is neither packet loss, bit error, invalidity, nor a drop by the emulated link
+                if not err and self.forward(destination, received_packet, check_sum, transmitter):
+                    self.tcp.print_packet_transmission_success(transmitter, received_packet)
+                    self.snt += 1  # increment total transmissions count
+
+                    if transmitter == self.tcp.RECEIVER:
+                        self.p_cnt += 2  # increment data packet count
+
+    def forward(self, destination, packet, check_sum, transmitter):
+        """
+        Sends a packet on with its original check sum, or schedules it on a loop
+        timer for when it has crossed the channel's emulated link
+        :return: False if the emulated link dropped the packet, otherwise True
+        """
+        reason = self.tcp.corruption()
+
+        if self.tcp.emulator is None:
+            destination.send(packet, check_sum, reason)
+            return True
+        size = (Packet.HEADER_V2 if packet.version == 2 else Packet.HEADER) + packet.data_len
+        at = self.tcp.admit(packet, transmitter, size)  # the loop's clock is the monotonic clock
+
+        if at is not None:
+            asyncio.get_running_loop().call_at(at, destination.send, packet, check_sum, reason)
+            self.last = max(self.last, at)
+        return at is not None
+
+
+def run_loopback(sender, channel, receiver, file, received, p, window):
+    """
+    Transfers a file from a sender through a channel to a receiver over loopback
+    sockets, running the asyncio engines of all three programs in this process
+    :return: outcome of the sender, channel and receiver, an exception if one failed
+    """
+    socks = {name: socket(AF_INET, SOCK_STREAM) for name in ('sIn', 'sOut', 'rIn', 'rOut',
+                                                              'csIn', 'csOut', 'crIn', 'crOut')}
+    for name in ('sIn', 'rIn', 'csIn', 'crIn'):
+        socks[name].bind((sender.LOOPBACK, 0))  # any free port
+
+    def port(name):
+        return socks[name].getsockname()[1]
+
+    engines = [
+        AsyncSender(sender, AsyncLink(sender, socks['sIn'], socks['sOut'], port('csIn'), 'channel'),
+                    file, window, sender.rtt).run(),
+        AsyncChannel(channel, AsyncLink(channel, socks['csIn'], socks['csOut'], port('sIn'), 'sender'),
+                     AsyncLink(channel, socks['crIn'], socks['crOut'], port('rIn'), 'receiver'), p).run(),
+        AsyncReceiver(receiver, AsyncLink(receiver, socks['rIn'], socks['rOut'], port('crIn'), 'channel'),
+                      received, window).run()
+    ]
+
+    async def run():
+        return await asyncio.gather(*engines, return_exceptions=True)
+
+    try:
+        return asyncio.run(run())
+    finally:
+        for sock in socks.values():
+            sock.close()
@@ -5,13 +5,17 @@ Author:
     - Adam Ross
 """
 
-from socket import socket, AF_INET, SOCK_STREAM, error as socket_error
+import asyncio
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_ERROR, IPPROTO_TCP, TCP_NODELAY, \
+    error as socket_error
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
 from struct import error as struct_error
-from os import path, system as terminal
+from os import path
+from errno import EINPROGRESS, EWOULDBLOCK
 from collections import Counter
-from random import sample as rs
-from select import select
-from packet import Packet
+from packet import Packet, PacketReader
+from metrics import Metrics
+import tracing
 from pathlib import Path
 from time import time
 from sys import argv
@@ -23,9 +27,13 @@ class TCP:
     BIT_ERR = 0.1  # probability of a bit error occurring
     MIN_RANGE = 1024  # minimum integer value for a port
     MAX_RANGE = 64000  # maximum integer value for a port
-    BUFFER = Packet.MAX_BYTES + Packet.HEADER  # maximum number of bytes per recv
     TIME_OUT = 30  # max time/clocks before connections are deemed disrupted
+    CONNECT_DELAY = 0.01  # first wait in seconds between attempts to connect to another program
+    MAX_CONNECT_DELAY = 0.1  # longest wait in seconds between attempts to connect
     PACKET_DATA_DIVISOR = 5  # for iterating through packet data
+    READER = PacketReader  # reads and decodes the packets of each socket
+    FLAGS = {'true': True, '1': True, 'yes': True, 'on': True,
+             'false': False, '0': False, 'no': False, 'off': False}  # values a boolean flag can be given
 
     def __init__(self):
         self.socks = dict()  # dictionary for sockets
@@ -33,12 +41,24 @@ class TCP:
         self.conns = list()  # list for socket connections
 
         self.programs = {
-            'channel': '<csIn> <csOut> <crIn> <crOut> <sIn> <rIn> <P>',
-            'receiver': '<rIn> <rOut> <crIn> <output file>',
-            'sender': '<sIn> <sOut> <csIn> <input file>'
+            'channel': '[--quiet] [--metrics=json|prom] [--trace=<file>] [--async] [--seed=<n>] [--loss=<model>] '
+                       '[--bit-err=<P>] [--link=lan|dsl|wan|lte|satellite] [--bandwidth=<bits/s>] [--delay=<seconds>] '
+                       '[--jitter=<seconds>] [--reorder=<P>] [--queue=<packets>] '
+                       '[--aqm=tail|red[:<min>:<max>:<max_p>]] '
+                       '(<csIn> <csOut> <crIn> <crOut> <sIn> <rIn> | --duplex <csIn> <crIn>) <P>',
+            'receiver': '[--quiet] [--metrics=json|prom] [--trace=<file>] [--window=<N>] [--async] '
+                        '[--fsync=none|end|<MB>] [--resume | --delta] '
+                        '(<rIn> <rOut> <crIn> | --duplex <crIn>) (<output file> | --session <output directory>)',
+            'sender': '[--quiet] [--metrics=json|prom] [--trace=<file>] [--window=<N>] [--async] [--flow=<id>] '
+                      '[--compress=zlib|lzma[:stream|segment]] [--mss=<bytes>] [--resume | --delta] '
+                      '(<sIn> <sOut> <csIn> | --duplex <csIn>) <input file>'
         }  # For error messages
         self.program = None
-        self.programs_conn_counter = 0  # counter to know which program is being connected to
+        self.options = dict()  # optional '--name=value' command line flags
+        self.readers = dict()  # socket: reassembly buffer of its byte stream
+        self.metrics = Metrics()  # counters and histograms of the transmission
+        self.quiet = False  # if per packet messages are not printed
+        self.tracer = None  # records an event for each packet with --trace, otherwise None
 
     def open_file(self, file_name):
         """
@@ -88,13 +108,17 @@ class TCP:
             except (socket_error, OSError, AttributeError):
                 print("Socket #" + str(count) + " has failed to close")
 
-    def trans_finn(self, cnts, packs, file=None):
+        if self.tracer is not None:
+            self.tracer.close()  # the events stay in the trace file
+
+    def trans_finn(self, cnts, packs, file=None, rtt=None):
         """
         Prints a message declaring that a program has completed a successful
         data file transfer and exits the program after closing the file
         """
-        if len(cnts) == 2 and file is not None:
-            file.close()  # closes the file being written to/read from
+        if len(cnts) == 2:
+            if file is not None:
+                self.close_file(file)  # closes the file being written to/read from
             time_str = stmt = ""
         else:
             l_prb, b_err, b_prb = str(cnts[2] * 100), str(cnts[4]), str(self.BIT_ERR * 100)
@@ -103,9 +127,15 @@ class TCP:
             stmt = ("\n - " + lst + " packets lost at a probability of " + l_prb + "%" +
                     "\n - " + b_err + " bit errors at a probability of " + b_prb + "%")
 
-        print("\nSuccessful transmission of " + str(packs) + " packets" + time_str + ":\n - " +
-              str(cnts[0]) + " transmissions sent \n - " +
-              str(cnts[1]) + " transmissions received" + stmt + "\n")
+        if rtt is not None:
+            stmt += rtt.report()  # smoothed round trip time and retransmission time out
+
+        if self.option('metrics', str, None) is not None:  # structured metrics in place of the report
+            print(self.metrics.dump(self.option('metrics', str, None)))
+        else:
+            print("\nSuccessful transmission of " + str(packs) + " packets" + time_str + ":\n - " +
+                  str(cnts[0]) + " transmissions sent \n - " +
+                  str(cnts[1]) + " transmissions received" + stmt + "\n")
 
         if file:
             print(str(file.name) + " has successfully closed")
@@ -113,13 +143,26 @@ class TCP:
         print("TCP socket program: " + str(self.program).capitalize() + " has completed transmitting.")
         exit(1)  # exits the program
 
+    def close_file(self, file):
+        """
+        Closes a file, and if data written behind by the receiver could not be
+        written to it, prints why, closes sockets and connections and exits the program
+        """
+        try:
+            file.close()
+        except OSError as error:
+            print("\nError! Data could not be written to " + str(file.name) + ": " +
+                  str(error.strerror or error) + ".")
+            self.close_sockets_connections()  # closes sockets and connections
+            self.exit_program()  # exits the program
+
     def conn_error(self, file=None):
         """
         When connection error occurs, closes sockets and connections
         prints explanatory declarations, and exits the program
         """
         if file:
-            file.close()  # closes the file being written to/read from
+            self.close_file(file)  # closes the file being written to/read from
             print(str(file.name) + " has successfully closed")
         self.close_sockets_connections()  # closes sockets and connections
         print("\nA connection to another program has failed!")
@@ -166,21 +209,30 @@ class TCP:
                 self.ports[port] = int(self.new_port(port))
                 item = self.ports[port]
 
-            if port in self.socks.keys():
-                # creates a socket
-                try:
-                    self.socks[port] = socket(AF_INET, SOCK_STREAM)
+        for name in self.socks:  # in duplex mode Out sockets have no port of their own
+            # creates a socket
+            try:
+                self.socks[name] = socket(AF_INET, SOCK_STREAM)
 
-                    if port[-2:] == 'In':
-                        # binds the created socket to its relevant port value
-                        self.socks[port].bind((self.LOOPBACK, item))
-                except socket_error:
-                    self.conn_error()
+                if name[-2:] == 'In':
+                    # binds the created socket to its relevant port value
+                    self.socks[name].bind((self.LOOPBACK, self.ports[name]))
+            except socket_error:
+                self.conn_error()
 
     def print_data(self, raw_data, pack_num, length, count=0):
         """
-        Prints data that has been successfully transmitted between programs
+        Counts, and unless quiet prints, data that has been successfully transmitted between programs
         """
+        self.metrics.count('packets_delivered')
+        self.metrics.count('data_bytes', length)
+
+        if count > 1:
+            self.metrics.count('retransmissions', count - 1)
+
+        if self.quiet:
+            return pack_num + 1 if len(raw_data) > 0 else pack_num  # the end of transfer packet is not counted
+
         if count > 0:
             count = " after " + str(count) + " attempt(s)."
         else:
@@ -193,91 +245,132 @@ class TCP:
             pack_num -= 1  # decrement packet count as its end of transfer packet
         else:
             try:
-                data = raw_data.decode()  # data from the data packet as string text
+                data = str(raw_data, 'utf-8')  # data from the data packet as string text
             except UnicodeDecodeError:
-                data = raw_data  # data from the transferred data packet in bytes
+                data = bytes(raw_data)  # data from the transferred data packet in bytes
 
         for i in range(0, len(data), Packet.MAX_BYTES // self.PACKET_DATA_DIVISOR):  # iterate through data
             print(data[i:Packet.MAX_BYTES // self.PACKET_DATA_DIVISOR + i])  # print a line of up to 102 chars
         return pack_num + 1  # return an incremented count of packets sent
 
-    def server_listen(self, sock, conn):
+    def peer_name(self, pos):
         """
-        Listen for a socket connection
+        :return: name of the program a connection of self.conns links to
         """
-        print("Listening for a socket connection to " + list(self.programs.keys())[self.programs_conn_counter] + "...")
-        try:
-            sock.listen(5)  # listens for a socket connection
-        except socket_error:
-            return conn
-        return [1] + conn[:2]
+        names = list(self.programs.keys())
+        return names[pos + 1] if self.program == names[0] else names[0]
 
-    def server_accept(self, sock, conn):
+    @staticmethod
+    def no_delay(sock):
         """
-        Accept and return a socket connection
+        Sends each packet as it is written rather than holding small packets back
+        until the last is acknowledged, which with delayed ACKs stalls the window
+        :return: the socket
         """
-        try:
-            is_readable, _, _ = select([sock], [], [], 1)  # waits for input on socket
-
-            if is_readable:
-                connection, _ = sock.accept()  # accepts a socket connection
-                print("In port for " + list(self.programs.keys())[self.programs_conn_counter] + " connected...")
-                return connection, [1] + conn[:2]
-        except socket_error:
-            return sock, conn
-        return sock, conn
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        return sock
 
-    def client_connect(self, client, server, conn):
+    def start_connect(self, selector, pos):
         """
-        Connect client sockets to server sockets
+        Starts a non-blocking connect of a connection's Out socket, which
+        the selector reports as writable once it succeeds or fails
+        :return: True if connecting is in progress, False if it was refused at once
         """
-        while True:
-            try:
-                client.connect((self.LOOPBACK, server))  # connect to a port
-            except socket_error:
-                continue
-            print("Out port for " + list(self.programs.keys())[self.programs_conn_counter] + " connected...")
-            break
-        return [1] + conn[:2]
+        _, out_sock, port = self.conns[pos]
+        out_sock.setblocking(False)
+
+        if out_sock.connect_ex((self.LOOPBACK, port)) not in (0, EINPROGRESS, EWOULDBLOCK):
+            return False
+        selector.register(out_sock, EVENT_WRITE, (pos, 'Out'))
+        return True
 
     def conn_init(self):
         """
-        Connect a programs sockets to other program sockets
+        Connects every connection of the program at once, listening on the In
+        sockets while the Out sockets connect without blocking. Refused connects
+        are retried with exponential back off, and the program sleeps on socket
+        readiness rather than polling until the other programs are up. In duplex
+        mode a connection has only an In or only an Out socket, which carries both ways
+        :return: time connecting started
         """
         print("\nWaiting for connection...")
-        cnc, go, timer = [[0] * len(self.conns[0])] * len(self.conns), [1, 0], time()
-        result = [None, None] if self.program == list(self.programs.keys())[0] else [None]
-        dbl = False
-
-        if len(self.conns) > 1:
-            dbl = True
-
-        while (time() - timer) < self.TIME_OUT and any(0 in stg for stg in cnc):
-            for conn in self.conns:
-                self.programs_conn_counter += 1 if self.program == list(self.programs.keys())[0] else 0
-                self.programs_conn_counter = min(2, self.programs_conn_counter)
-
-                pos = self.conns.index(conn)
-                tmp = cnc[pos]
+        selector, timer = DefaultSelector(), time()
+        result, up = [None] * len(self.conns), [set() for _ in self.conns]  # ports connected per connection
+        needed = [{port for port, sock in (('In', conn[0]), ('Out', conn[1])) if sock} for conn in self.conns]
+        delays, retries = [self.CONNECT_DELAY] * len(self.conns), dict()  # back off, pos: time to retry
 
-                if 0 in cnc[pos]:
-                    if (1 not in tmp and dbl) or (tmp[:2] == go and not dbl):
-                        cnc[pos] = self.server_listen(conn[0], cnc[pos])
-                        tmp = cnc[pos]
-
-                    if (tmp[:2] == go and dbl) or (tmp[-2:] == go and not dbl):
-                        result[pos], cnc[pos] = self.server_accept(conn[0], cnc[pos])
-                        tmp = cnc[pos]
-
-                    if (tmp[-2:] == go and dbl) or (1 not in tmp and not dbl):
-                        cnc[pos] = self.client_connect(conn[1], conn[2], cnc[pos])
+        def back_off(pos):
+            retries[pos] = time() + delays[pos]  # the other program is not listening yet
+            delays[pos] = min(self.MAX_CONNECT_DELAY, delays[pos] * 2)
 
+        for pos, (in_sock, out_sock, _) in enumerate(self.conns):
+            if in_sock:
+                try:
+                    in_sock.listen(5)  # listens for a socket connection
+                except socket_error:
+                    self.conn_error()
+                in_sock.setblocking(False)
+                selector.register(in_sock, EVENT_READ, (pos, 'In'))
+                print("Listening for a socket connection to " + self.peer_name(pos) + "...")
+            else:
+                result[pos] = out_sock  # the Out socket also receives
+
+            if out_sock and not self.start_connect(selector, pos):
+                back_off(pos)
+
+        while up != needed and time() - timer < self.TIME_OUT:
+            wait = min(list(retries.values()) + [timer + self.TIME_OUT]) - time()
+
+            for key, _ in selector.select(max(0.0, wait)):
+                pos, port = key.data
+
+                if port == 'In':
+                    try:
+                        result[pos], _ = key.fileobj.accept()  # accepts a socket connection
+                    except BlockingIOError:
+                        continue
+                    self.no_delay(result[pos]).setblocking(True)
+                    selector.unregister(key.fileobj)
+                elif key.fileobj.getsockopt(SOL_SOCKET, SO_ERROR) == 0:
+                    self.no_delay(key.fileobj).setblocking(True)
+                    selector.unregister(key.fileobj)
+                else:
+                    selector.unregister(key.fileobj)
+                    back_off(pos)
+                    continue
+
+                up[pos].add(port)
+                print(port + " port for " + self.peer_name(pos) + " connected...")
+
+                if up[pos] == needed[pos]:
+                    self.metrics.observe('link_setup_seconds', time() - timer)
+                    print("Link to " + self.peer_name(pos) + " set up in " +
+                          str(round((time() - timer) * 1000, 1)) + " ms")
+
+            for pos in [pos for pos, due in retries.items() if due <= time()]:
+                del retries[pos]
+
+                if not self.start_connect(selector, pos):
+                    back_off(pos)
+        selector.close()
+
+        if up != needed:
+            self.conn_error()  # closes when connecting fails
         self.conns = result
+        print("All sockets are connected\n\nTransmission status report: ")
+        return timer
 
-        if not any(0 in stg for stg in cnc):
-            print("All sockets are connected\n\nTransmission status report: ")
-            return timer
-        self.conn_error()  # closes when connecting fails
+    def run_async(self, engine, file=None):
+        """
+        Runs an asyncio engine of the program to completion in place of polling
+        loops, closing the program if a connection fails
+        :return: result of the engine
+        """
+        self.conns = list()  # the engine owns and closes its connections
+        try:
+            return asyncio.run(engine)
+        except (socket_error, ConnectionError):
+            self.conn_error(file)  # close program
 
     def check_instance(self, val, instance):
         """
@@ -288,48 +381,137 @@ class TCP:
         except (TypeError, ValueError):
             self.exit_program()
 
-    def send_packet(self, port, packet, check_sum, file):
+    def send_packet(self, port, packet, file, reason=tracing.NONE):
         try:
-            self.socks[port].send(packet.buffer(check_sum))
+            byte_pack = packet.buffer()
+            self.count_sent(byte_pack, packet, reason)  # traced before it can arrive
+            self.socks[port].sendall(byte_pack)
         except (socket_error, ConnectionError):
             self.conn_error(file)  # close program
 
-    def receive_packet(self, fails, offset, file):
+    def count_sent(self, byte_pack, packet=None, reason=tracing.NONE):
+        """
+        Counts a packet sent, tracing it with the reason it was sent for, such as a retransmission
+        """
+        self.metrics.count('packets_sent')
+        self.metrics.count('bytes_sent', len(byte_pack))
+
+        if self.tracer is not None and packet is not None:
+            self.tracer.packet(tracing.SENT, packet, reason)
+
+    def count_received(self, packets, dropped):
+        """
+        Counts packets received, declaring each packet dropped for an invalid check sum
+        """
+        self.metrics.count('packets_received', len(packets) + dropped)
+
+        if self.tracer is not None:
+            for packet, _ in packets:
+                self.tracer.packet(tracing.RECEIVED, packet)
+            for _ in range(dropped):  # nothing of a packet failing its check sum can be trusted
+                self.tracer.record(tracing.DROPPED, 0, 0, reason=tracing.CHECKSUM)
+
+        if dropped:
+            self.metrics.count('checksum_drops', dropped)
+
+            for _ in range(0 if self.quiet else dropped):
+                print("\nReceived packet failed its check sum. Packet dropped.")
+
+    def read_packets(self, sock):
+        """
+        Receives from a socket and returns every complete (packet, check sum) in
+        its stream, declaring each packet dropped for an invalid check sum
+        """
+        if sock not in self.readers:
+            self.readers[sock] = self.READER(sock)
+        reader = self.readers[sock]
+        dropped = reader.dropped
+        packets = reader.read()
+        self.count_received(packets, reader.dropped - dropped)
+        return packets
+
+    def receive_packets(self, fails, offset, file):
         try:
-            received_packet, _ = Packet.un_buffer(self.conns[0].recv(self.BUFFER))
-            return received_packet, 0, None
+            received_packets = [packet for packet, _ in self.read_packets(self.conns[0])]
+            return received_packets, 0, None
         except (socket_error, struct_error, ValueError) as error:
             if fails == 0:
                 self.print_invalid_packet(list(self.programs.keys()).index(self.program) + offset)
             elif fails > self.TIME_OUT:  # connection is deemed lost
                 self.conn_error(file)  # close program
             fails += 1  # increment number of failed socket readings
-            return None, fails, error
+            return list(), fails, error
 
     def print_invalid_packet(self, sender_program):
-        print("\nReceived packet from " + list(self.programs.keys())[sender_program] + " is invalid. Packet dropped.")
+        self.metrics.count('invalid_packets')
+
+        if not self.quiet:
+            print("\nReceived packet from " + list(self.programs.keys())[sender_program] +
+                  " is invalid. Packet dropped.")
 
     def validate_args(self, arguments, required_length, types):
-        if len(arguments) < required_length:
+        arguments = self.parse_options(arguments)
+        self.quiet = self.option('quiet', bool, False)
+
+        if len(arguments) < required_length or self.option('metrics', str, 'json') not in ('json', 'prom'):
             self.exit_program()
+
+        if self.option('trace', str, None) is not None:
+            try:
+                self.tracer = tracing.Tracer(self.program, self.option('trace', str, None),
+                                             self.option('trace-events', int, tracing.Tracer.CAPACITY))
+            except (ValueError, OSError):
+                self.exit_program()
         return [self.check_instance(argument, typ) for argument, typ in zip(arguments[1:required_length], types)]
 
+    def parse_options(self, arguments):
+        """
+        Separates optional '--name=value' flags from the positional program arguments
+        """
+        positional = list()
+        for argument in arguments:
+            if argument.startswith('--'):
+                name, _, value = argument[2:].partition('=')
+                self.options[name] = value if value else True  # bare flags are switched on
+            else:
+                positional.append(argument)
+        return positional
+
+    def option(self, name, instance, default):
+        """
+        Returns an optional flag value as the specified instance, otherwise the default.
+        A boolean flag is switched on bare or by a value such as 'true' or 'off', and
+        any other flag given without a value exits the program
+        """
+        if name not in self.options:
+            return default
+        value = self.options[name]
+
+        if instance is bool:
+            if value is not True and str(value).lower() not in self.FLAGS:
+                self.exit_program()
+            return value is True or self.FLAGS[str(value).lower()]
+
+        if value is True:  # bare flag, such as --trace without a file
+            self.exit_program()
+        return self.check_instance(value, instance)
+
 
 def main(arguments):
+    from runner import Runner  # imported here, as the runner builds on this module
+    options = [argument for argument in arguments[1:] if argument.startswith('--')]
+    arguments = [argument for argument in arguments if not argument.startswith('--')]
+
     if len(arguments) == 3:
-        f, p, port = arguments[1], arguments[2], [str(i) for i in rs(range(1024, 6400), 8)]
-        commands = {
-            "python3 channel.py " + port[0] + " " + port[1] + " " + port[2] + " " +
-            port[3] + " " + port[4] + " " + port[5] + " " + p,
-            "python3 receiver.py " + port[5] + " " + port[6] + " " + port[2] + " received_" + f,
-            "python3 sender.py " + port[4] + " " + port[7] + " " + port[0] + " " + f
-        }
-
-        for command in commands:
-            terminal(f"xfce4-terminal --hold --command='{command}' &")
-            print("Executed " + command.split()[1])
+        f, p = arguments[1], arguments[2]
+        seconds, outputs = Runner().launch(f, "received_" + f, p, options)
+
+        for program, output in outputs.items():
+            print("==== " + program + " ====\n" + output)
+        print("Sender completed in " + str(round(seconds, 2)) + " seconds")
     else:
-        print("Error! Must enter: python3 tcp_transmission.py <file> <float>")
+        print("Error! Must enter: python3 tcp_transmission.py [--window=<N>] [--async] [--duplex] [--quiet] "
+              "[--metrics=json|prom] <file> <float>")
 
 
 if __name__ == '__main__':
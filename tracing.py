@@ -0,0 +1,137 @@
+"""
+COSC264 Networking assignment
+The per packet event tracing of the programs for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from struct import Struct
+from time import monotonic_ns, time_ns
+from packet import Packet
+from sys import argv
+import heapq
+import json
+import mmap
+import os
+
+HEADER_STRUCT = Struct('<8sIIQQq')  # magic, capacity, event size, events recorded, clock at creation, epoch offset
+EVENT_STRUCT = Struct('<QQIIBBBB4x')  # time, seq_no, data_len, flow_id, program, direction, reason, packet type
+COUNT_STRUCT = Struct('<Q')  # number of events recorded, updated in the header after each event
+COUNT_OFFSET = 16  # byte of the header holding the number of events recorded
+MAGIC = b'TCPTRACE'  # first bytes of a trace file
+
+PROGRAMS = ('channel', 'receiver', 'sender', 'session')  # programs by the number events hold for them
+DIRECTIONS = ('received', 'sent', 'dropped')  # what happened to the packet at the program
+RECEIVED, SENT, DROPPED = range(3)
+REASONS = (None, 'loss', 'corrupt', 'retransmit', 'checksum', 'invalid', 'queue')  # why, if it was not the usual
+NONE, LOSS, CORRUPT, RETRANSMIT, CHECKSUM, INVALID, QUEUE = range(7)
+TYPES = ('data', 'ack', 'negotiate')  # packet types by their data_type
+
+
+class Tracer:
+
+    CAPACITY = 65536  # default number of events kept, the oldest are overwritten after that
+
+    def __init__(self, program, file_name, capacity=CAPACITY):
+        if capacity < 1:
+            raise ValueError("a trace must hold at least one event")
+        self.program = PROGRAMS.index(program) if program in PROGRAMS else 255  # number events hold for the program
+        self.capacity = capacity  # events the ring holds
+        self.count = 0  # events recorded, including those overwritten
+        size = HEADER_STRUCT.size + capacity * EVENT_STRUCT.size
+
+        with open(file_name, 'w+b') as file:  # the mapping outlives the file object
+            file.truncate(size)
+            self.buffer = mmap.mmap(file.fileno(), size)  # header, then the ring, left on disk if the program dies
+        HEADER_STRUCT.pack_into(self.buffer, 0, MAGIC, capacity, EVENT_STRUCT.size, 0, monotonic_ns(),
+                                time_ns() - monotonic_ns())
+
+    def record(self, direction, seq_no, data_len, flow_id=0, data_type=Packet.PTYPE_DATA, reason=NONE):
+        """
+        Packs an event into the next slot of the ring, with the time from the monotonic clock
+        """
+        EVENT_STRUCT.pack_into(self.buffer, HEADER_STRUCT.size + self.count % self.capacity * EVENT_STRUCT.size,
+                               monotonic_ns(), seq_no, data_len, flow_id, self.program, direction, reason,
+                               data_type & Packet.TYPE_MASK)
+        self.count += 1
+        COUNT_STRUCT.pack_into(self.buffer, COUNT_OFFSET, self.count)
+
+    def packet(self, direction, packet, reason=NONE):
+        self.record(direction, packet.seq_no, packet.data_len, packet.flow_id, packet.data_type, reason)
+
+    def close(self):
+        if not self.buffer.closed:
+            self.buffer.flush()
+            self.buffer.close()
+
+
+def read_events(file_name):
+    """
+    :return: nanoseconds the monotonic clock is behind the epoch, and list of the events kept in a
+    trace file, oldest first, each a tuple of (monotonic clock, seq_no, data_len, flow_id,
+    program, direction, reason, type)
+    """
+    with open(file_name, 'rb') as file:
+        data = file.read()
+    magic, capacity, size, count, _, epoch = HEADER_STRUCT.unpack_from(data)
+
+    if magic != MAGIC or size != EVENT_STRUCT.size:
+        raise ValueError(str(file_name) + " is not a trace file")
+    first = max(0, count - capacity)  # events before it were overwritten
+    events = list()
+
+    for number in range(first, count):
+        events.append(EVENT_STRUCT.unpack_from(data, HEADER_STRUCT.size + number % capacity * EVENT_STRUCT.size))
+    return epoch, events
+
+
+def to_dict(event, epoch=0):
+    """
+    :return: dictionary of an event, naming its program, direction, reason and packet type
+    """
+    clock, seq_no, data_len, flow_id, program, direction, reason, data_type = event
+    return {
+        'time': (clock + epoch) / 1e9,
+        'program': PROGRAMS[program] if program < len(PROGRAMS) else None,
+        'direction': DIRECTIONS[direction],
+        'type': TYPES[data_type] if data_type < len(TYPES) else data_type,
+        'seq_no': seq_no,
+        'length': data_len,
+        'flow_id': flow_id,
+        'reason': REASONS[reason] if reason < len(REASONS) else reason
+    }
+
+
+def write_jsonl(events, file_name, epoch=0):
+    with open(file_name, 'w') as file:
+        for event in events:
+            file.write(json.dumps(to_dict(event, epoch)) + "\n")
+
+
+def write_pcap(events, file_name, epoch=0):
+    """
+    Writes each event as a packet of a pcap file of link type USER0, whose
+    bytes are the event, so the time between events can be analysed by pcap tools
+    """
+    with open(file_name, 'wb') as file:
+        file.write(Struct('<IHHiIII').pack(0xa1b23c4d, 2, 4, 0, 0, 65535, 147))  # nanosecond pcap, LINKTYPE_USER0
+        record = Struct('<IIII')
+
+        for event in events:
+            data, clock = EVENT_STRUCT.pack(*event), event[0] + epoch
+            file.write(record.pack(clock // 1000000000, clock % 1000000000, len(data), len(data)) + data)
+
+
+def main(arguments):
+    if len(arguments) < 3 or any(not os.path.isfile(file_name) for file_name in arguments[2:]):
+        print("Error! Must enter: python3 tracing.py <output.jsonl|output.pcap> <trace file> [<trace file> ...]")
+        return
+
+    traces = [read_events(file_name) for file_name in arguments[2:]]
+    events = list(heapq.merge(*(events for _, events in traces)))  # the monotonic clock is shared by every program
+    (write_pcap if arguments[1].endswith('.pcap') else write_jsonl)(events, arguments[1], traces[0][0])
+    print(str(len(events)) + " events written to " + arguments[1])
+
+
+if __name__ == '__main__':
+    main(argv)
@@ -0,0 +1,140 @@
+"""
+COSC264 Networking assignment
+The write behind output of the receiver for the TCP socket assignment.
+Author:
+    - Adam Ross
+"""
+
+from threading import Thread, Condition
+from collections import deque
+import os
+
+
+class WriteBehind:
+
+    CAPACITY = 4 * 1024 * 1024  # default bytes queued before writes wait for the disk
+    MB = 1024 * 1024  # bytes in a megabyte of the fsync policy
+    IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024  # most buffers per writev
+
+    def __init__(self, file, fsync='none', capacity=CAPACITY, journal=None):
+        self.file = file  # file received data is written to
+        self.journal = journal  # checkpoint journal of the data written, None if the transfer cannot resume
+        self.name = file.name  # name of the file, for messages
+        self.every = self.policy(fsync)  # bytes written between syncs, 0 to sync only at close, None never
+        self.capacity = capacity  # most bytes queued and not yet written
+        self.segments = deque()  # data waiting to be written, in order
+        self.queued = 0  # bytes in segments
+        self.written = 0  # bytes written since the last sync
+        self.closed = False  # if no more data will be queued
+        self.error = None  # error raised by the writer thread, re-raised on the next write
+        self.ready = Condition()  # signals data queued, or room made in the queue
+        self.file.flush()  # data is written to the file descriptor, past the file's buffer
+        self.thread = Thread(target=self.drain, name="write-behind " + str(self.name), daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def policy(fsync):
+        """
+        Parses a durability policy of 'none', 'end' or a number of megabytes
+        :return: bytes written between syncs, 0 to sync only at close, None to never sync
+        """
+        if fsync == 'none':
+            return None
+        if fsync == 'end':
+            return 0
+        megabytes = float(fsync)
+
+        if megabytes <= 0:
+            raise ValueError("fsync interval must be > 0 megabytes")
+        return int(megabytes * WriteBehind.MB)
+
+    def write(self, data):
+        """
+        Queues data to be written by the writer thread, only waiting when the
+        queue is at capacity, so a slow disk cannot grow memory without bound
+        """
+        if len(data) == 0:
+            return  # nothing to write, such as the end of file packet of uncompressed data
+
+        with self.ready:
+            while self.queued >= self.capacity and self.error is None:
+                self.ready.wait()
+
+            if self.error is not None:
+                raise self.error
+            self.segments.append(data)
+            self.queued += len(data)
+            self.ready.notify_all()
+
+    def drain(self):
+        """
+        Writer thread: takes every queued segment at once and writes them in as
+        few writev calls as possible, syncing as the policy requires
+        """
+        fd = self.file.fileno()
+
+        while True:
+            with self.ready:
+                while not self.segments and not self.closed:
+                    self.ready.wait()
+
+                if not self.segments:
+                    return  # closed and every segment is written
+                batch = [self.segments.popleft() for _ in range(min(len(self.segments), self.IOV_MAX))]
+            try:
+                self.write_all(fd, batch)
+            except OSError as error:
+                with self.ready:
+                    self.error = error
+                    self.segments.clear()
+                    self.ready.notify_all()
+                return
+
+            with self.ready:
+                self.queued -= sum(len(data) for data in batch)
+                self.ready.notify_all()
+
+    def write_all(self, fd, batch):
+        """
+        Writes a batch of segments with writev, continuing after partial writes
+        """
+        size = sum(len(data) for data in batch)
+        views = [memoryview(data) for data in batch]
+
+        while views:
+            written = os.writev(fd, views)
+
+            while views and written >= len(views[0]):  # drops the buffers written in full
+                written -= len(views.pop(0))
+            if views:
+                views[0] = views[0][written:]
+
+        if self.journal is not None:
+            for data in batch:
+                self.journal.update(data)  # checkpoints once enough is written
+
+        self.written += size
+        if self.every and self.written >= self.every:
+            os.fsync(fd)
+            self.written = 0
+
+    def close(self):
+        """
+        Waits for every queued segment to be written, syncs if the policy requires,
+        closes the journal and closes the file
+        """
+        with self.ready:
+            self.closed = True
+            self.ready.notify_all()
+        self.thread.join()
+
+        try:
+            if self.error is None and self.every is not None:
+                os.fsync(self.file.fileno())
+            if self.error is None and self.journal is not None:
+                self.journal.close()
+        finally:
+            self.file.close()
+
+        if self.error is not None:
+            raise self.error